@@ -1,552 +1,1270 @@
-from flask import Flask, render_template, request, redirect, url_for, session
-from db.dbhelper import getall, addrecord, getrecord, deleterecord, updaterecord
-from datetime import datetime
-import sqlite3
-import base64
-import re
-import os
-
-app = Flask(__name__)
-app.secret_key = "supersecretkey"
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB file upload limit
-
-def init_db():
-    conn = sqlite3.connect('Avila.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS attendance (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            idno TEXT NOT NULL,
-            name TEXT NOT NULL,
-            course_level TEXT NOT NULL,
-            time_in TEXT NOT NULL,
-            date TEXT NOT NULL,
-            UNIQUE(idno, date)  -- Prevents duplicate entries for same student on same day
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            idno TEXT UNIQUE NOT NULL,
-            lastname TEXT NOT NULL,
-            firstname TEXT NOT NULL,
-            course TEXT,
-            level TEXT,
-            avatar TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS user (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL
-        )
-    ''')
-    
-    # Create index for faster lookups
-    c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_idno_date ON attendance(idno, date)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_students_idno ON students(idno)')
-    
-    conn.commit()
-    conn.close()
-
-@app.route("/")
-def index():
-    return render_template("index.html", show_login=True)
-
-@app.route('/check', methods=['GET'])
-def check_student():
-    idno = request.args.get('idno')
-    print(f"DEBUG: Checking student: {idno}")
-    
-    student_row = getrecord("students", idno=idno) 
-    if student_row:
-        student = dict(student_row[0])
-        name = student['firstname'] + ' ' + student['lastname']
-        course_level = student['course'] + ' ' + student['level']
-        import datetime
-        now = datetime.datetime.now()
-        time_in = now.strftime("%I:%M %p")
-        date = now.strftime("%Y-%m-%d")
-        
-        print(f"DEBUG: Recording attendance for: {name}")
-        
-        conn = sqlite3.connect('Avila.db')
-        c = conn.cursor()
-        
-        # Check if attendance already exists for this student today
-        c.execute("SELECT * FROM attendance WHERE idno = ? AND date = ?", (idno, date))
-        existing = c.fetchone()
-        
-        if existing:
-            # Update existing attendance with current time
-            print(f"DEBUG: Updating existing attendance for {idno}")
-            c.execute("UPDATE attendance SET time_in = ?, name = ?, course_level = ? WHERE idno = ? AND date = ?",
-                     (time_in, name, course_level, idno, date))
-        else:
-            # Insert new attendance record
-            print(f"DEBUG: Creating new attendance record for {idno}")
-            c.execute("INSERT OR REPLACE INTO attendance (idno, name, course_level, time_in, date) VALUES (?, ?, ?, ?, ?)", 
-                     (idno, name, course_level, time_in, date))
-        
-        conn.commit()
-        conn.close()
-        
-        print(f"DEBUG: Attendance recorded successfully")
-        
-        html = '''
-        <center>
-            <img src="''' + url_for('static', filename='images/' + (student['avatar'] if student['avatar'] else 'default_avatar.png')) + '''" 
-                 style="width:100px;height:100px;border-radius:50%;object-fit:cover;margin-bottom:10px;">
-        </center>
-        <table class="w3-table-all">
-            <tr><td>IDNO</td><td>''' + student['idno'] + '''</td></tr>
-            <tr><td>LASTNAME</td><td>''' + student['lastname'] + '''</td></tr>
-            <tr><td>FIRSTNAME</td><td>''' + student['firstname'] + '''</td></tr>
-            <tr><td>COURSE</td><td>''' + student['course'] + '''</td></tr>
-            <tr><td>LEVEL</td><td>''' + student['level'] + '''</td></tr>
-        </table>
-        '''
-        return html
-    else:
-        return 'STUDENT NOT FOUND'
-
-
-@app.route("/login", methods=["GET", "POST"])
-def login():
-    if request.method == "POST":
-        email = request.form["email"].strip()
-        password = request.form["password"].strip()
-        user = getrecord("user", email=email)
-        if user:
-            if user[0]["password"] == password:
-                session['user'] = email
-                return redirect(url_for('admin'))
-            else:
-                error = "Invalid email or password"
-                return render_template("login.html", title="Login", error=error)
-        else:
-            error = "Email not registered. Please register first."
-            return render_template("login.html", title="Login", error=error)
-    return render_template("login.html", title="Login")
-
-@app.route("/register", methods=["GET", "POST"])
-def register():
-    if request.method == "POST":
-        email = request.form["email"].strip()
-        password = request.form["password"].strip()
-        confirm_password = request.form["confirm_password"].strip()
-
-        if password != confirm_password:
-            return "Passwords do not match!"
-        if getrecord("user", email=email):
-            return "Email already registered."
-
-        addrecord("user", email=email, password=password)
-        return redirect(url_for('login'))
-    return render_template("register.html", title="Register")
-
-@app.route("/logout")
-def logout():
-    session.pop('user', None)
-    return redirect(url_for('index'))
-
-
-@app.route("/admin", methods=["GET", "POST"])
-def admin():
-    if 'user' not in session:
-        return redirect(url_for('login'))
-
-    if request.method == "POST":
-        email = request.form["email"].strip()
-        password = request.form["password"].strip()
-        edit_id = request.form.get("edit_id")
-        if edit_id:
-            updaterecord("user", {"email": email, "password": password}, id=edit_id)
-        else:
-            addrecord("user", email=email, password=password)
-        return redirect(url_for('admin'))
-
-    users = getall("user")
-    edit_id = request.args.get("edit_id")
-    edit_user = getrecord("user", id=edit_id)[0] if edit_id else None
-    return render_template("admin.html", users=users, edit_user=edit_user, edit_id=edit_id, title="User Management")
-
-@app.route("/admin/delete/<int:user_id>")
-def delete_user(user_id):
-    if 'user' not in session:
-        return redirect(url_for('login'))
-    deleterecord("user", id=user_id)
-    return redirect(url_for("admin"))
-
-
-@app.route("/studentmngt", methods=["GET", "POST"])
-def student_mngt():
-    if 'user' not in session:
-        return redirect(url_for('login'))
-
-    if request.method == "POST":
-        idno = request.form["idno"].strip()
-        lastname = request.form["lastname"].strip()
-        firstname = request.form["firstname"].strip()
-        course = request.form["course"].strip()
-        level = request.form["level"].strip()
-        edit_id = request.form.get("edit_id")
-        
-        # Store OLD student info before update
-        old_student_info = None
-        old_idno = None
-        if edit_id:
-            old_student = getrecord("students", id=edit_id)
-            if old_student:
-                old_student_info = dict(old_student[0])
-                old_idno = old_student_info['idno']
-        
-        # Handle file upload
-        avatar_filename = None
-        avatar_file = request.files.get("profile_picture")
-        
-        images_dir = "static/images"
-        if not os.path.exists(images_dir):
-            os.makedirs(images_dir)
-        
-        if avatar_file and avatar_file.filename != '':
-            allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif'}
-            file_ext = os.path.splitext(avatar_file.filename)[1].lower()
-            
-            if file_ext in allowed_extensions:
-                avatar_filename = f"{idno}{file_ext}"
-                file_path = os.path.join(images_dir, avatar_filename)
-                avatar_file.save(file_path)
-            else:
-                return f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
-
-        data = {
-            "idno": idno,
-            "lastname": lastname,
-            "firstname": firstname,
-            "course": course,
-            "level": level
-        }
-        
-        if edit_id:
-            if avatar_filename:
-                data["avatar"] = avatar_filename
-            else:
-                existing_student = getrecord("students", id=edit_id)
-                if existing_student and existing_student[0]['avatar']:
-                    data["avatar"] = existing_student[0]['avatar']
-            
-            updaterecord("students", data, id=edit_id)
-            
-            # Update attendance records if student info changed
-            if old_student_info:
-                new_name = firstname + ' ' + lastname
-                new_course_level = course + ' ' + level
-                old_name = old_student_info['firstname'] + ' ' + old_student_info['lastname']
-                old_course_level = old_student_info['course'] + ' ' + old_student_info['level']
-                
-                # Check if anything changed
-                if new_name != old_name or new_course_level != old_course_level or idno != old_idno:
-                    conn = sqlite3.connect('Avila.db')
-                    c = conn.cursor()
-                    
-                    # Update attendance records with new IDNO if it changed
-                    if idno != old_idno:
-                        c.execute("UPDATE attendance SET idno = ?, name = ?, course_level = ? WHERE idno = ?",
-                                 (idno, new_name, new_course_level, old_idno))
-                    else:
-                        c.execute("UPDATE attendance SET name = ?, course_level = ? WHERE idno = ?",
-                                 (new_name, new_course_level, idno))
-                    
-                    conn.commit()
-                    conn.close()
-                    print(f"DEBUG: Updated attendance records for {old_idno} -> {idno}")
-                    
-        else:
-            # Adding new student
-            if avatar_filename:
-                data["avatar"] = avatar_filename
-            else:
-                data["avatar"] = "default_avatar.png"
-            addrecord("students", **data)
-
-        return redirect(url_for("student_mngt"))
-
-    students_list = getall("students", order_by="lastname ASC, firstname ASC")
-    edit_id = request.args.get("edit_id")
-    
-    edit_student_row = getrecord("students", id=edit_id)
-    edit_student = dict(edit_student_row[0]) if edit_id and edit_student_row else None
-    
-    return render_template("studentmngt.html", students=students_list, edit_student=edit_student)
-
-
-@app.route("/student/add", methods=["GET", "POST"])
-def add_student_page():
-    if 'user' not in session:
-        return redirect(url_for('login'))
-
-    if request.method == "POST":
-        idno = request.form["idno"].strip()
-        lastname = request.form["lastname"].strip()
-        firstname = request.form["firstname"].strip()
-        course = request.form["course"].strip()
-        level = request.form["level"].strip()
-        avatar_data = request.form.get("avatar")
-        avatar_filename = None
-
-        images_dir = "static/images"
-        if not os.path.exists(images_dir):
-            os.makedirs(images_dir)
-        
-        if avatar_data and avatar_data.startswith("data:image/"):
-            header, encoded = avatar_data.split(",", 1)
-            try:
-                avatar_bytes = base64.b64decode(encoded)
-                avatar_filename = f"{idno}.png"
-                with open(os.path.join(images_dir, avatar_filename), "wb") as f:
-                    f.write(avatar_bytes)
-            except Exception as e:
-                print(f"Error saving avatar: {e}")
-                avatar_filename = "default_avatar.png"
-
-        data = {
-            "idno": idno,
-            "lastname": lastname,
-            "firstname": firstname,
-            "course": course,
-            "level": level,
-            "avatar": avatar_filename if avatar_filename else "default_avatar.png"
-        }
-        
-        addrecord("students", **data)
-        return redirect(url_for("student_mngt"))
-
-    return render_template("student.html", student=None)
-
-@app.route("/student/edit/<int:student_id>", methods=["GET", "POST"])
-def edit_student_page(student_id):
-    if 'user' not in session:
-        return redirect(url_for('login'))
-
-    student_row = getrecord("students", id=student_id)
-    student = dict(student_row[0]) if student_row else None
-
-    if request.method == "POST":
-        idno = request.form["idno"].strip()
-        lastname = request.form["lastname"].strip()
-        firstname = request.form["firstname"].strip()
-        course = request.form["course"].strip()
-        level = request.form["level"].strip()
-        avatar_data = request.form.get("avatar")
-        
-        # Store old info
-        old_idno = student['idno']
-        old_name = student['firstname'] + ' ' + student['lastname']
-        old_course_level = student['course'] + ' ' + student['level']
-        
-        data = {
-            "idno": idno,
-            "lastname": lastname,
-            "firstname": firstname,
-            "course": course,
-            "level": level
-        }
-
-        if avatar_data and avatar_data.startswith("data:image/"):
-            images_dir = "static/images"
-            if not os.path.exists(images_dir):
-                os.makedirs(images_dir)
-                
-            try:
-                header, encoded = avatar_data.split(",", 1)
-                avatar_bytes = base64.b64decode(encoded)
-                avatar_filename = f"{idno}.png"
-                with open(os.path.join(images_dir, avatar_filename), "wb") as f:
-                    f.write(avatar_bytes)
-                data["avatar"] = avatar_filename
-            except Exception as e:
-                print(f"Error saving avatar: {e}")
-                if student and student.get('avatar'):
-                    data["avatar"] = student['avatar']
-
-        # Update student record
-        updaterecord("students", data, id=student_id)
-        
-        # Update attendance records if needed
-        new_name = firstname + ' ' + lastname
-        new_course_level = course + ' ' + level
-        
-        if new_name != old_name or new_course_level != old_course_level or idno != old_idno:
-            conn = sqlite3.connect('Avila.db')
-            c = conn.cursor()
-            
-            # Update attendance records with new IDNO if it changed
-            if idno != old_idno:
-                c.execute("UPDATE attendance SET idno = ?, name = ?, course_level = ? WHERE idno = ?",
-                         (idno, new_name, new_course_level, old_idno))
-            else:
-                c.execute("UPDATE attendance SET name = ?, course_level = ? WHERE idno = ?",
-                         (new_name, new_course_level, idno))
-            
-            conn.commit()
-            conn.close()
-            print(f"DEBUG: Updated attendance records for {old_idno} -> {idno}")
-
-        return redirect(url_for("student_mngt"))
-
-    return render_template("student.html", student=student)
-
-
-@app.route("/student/delete/<int:student_id>")
-def delete_student(student_id):
-    if 'user' not in session:
-        return redirect(url_for('login'))
-
-    # Get student info before deleting
-    student_row = getrecord("students", id=student_id)
-    if student_row:
-        student = dict(student_row[0])
-        idno = student['idno']
-        
-        # Delete attendance records for this student
-        conn = sqlite3.connect('Avila.db')
-        c = conn.cursor()
-        c.execute("DELETE FROM attendance WHERE idno = ?", (idno,))
-        conn.commit()
-        conn.close()
-        print(f"DEBUG: Deleted attendance records for {idno}")
-    
-    # Delete student
-    deleterecord("students", id=student_id)
-    return redirect(url_for("student_mngt"))
-
-
-@app.route("/attend", methods=['GET'])
-def attend():
-    selected_date = request.args.get('date')
-    if not selected_date:
-        import datetime
-        now = datetime.datetime.now()
-        selected_date = now.strftime("%Y-%m-%d")
-    
-    print(f"DEBUG: Fetching attendance for {selected_date}")
-
-    conn = sqlite3.connect('Avila.db')
-    c = conn.cursor()
-    
-    # Get unique attendance records for the selected date
-    c.execute("SELECT DISTINCT idno, name, course_level, time_in FROM attendance WHERE date = ? ORDER BY time_in", (selected_date,))
-    records = c.fetchall()
-    
-    print(f"DEBUG: Found {len(records)} unique records for {selected_date}")
-    
-    conn.close()
-    return render_template('attend.html', records=records, selected_date=selected_date)
-
-
-@app.route('/attendance', methods=['POST'])
-def record_attendance():
-    idno = request.form['idno']
-    student_row = getrecord("students", idno=idno)
-    if student_row:
-        student = dict(student_row[0])
-        name = student['firstname'] + ' ' + student['lastname']
-        course_level = student['course'] + ' ' + student['level']
-        import datetime
-        now = datetime.datetime.now()
-        time_in = now.strftime("%I:%M %p")
-        date = now.strftime("%Y-%m-%d")
-
-        conn = sqlite3.connect('Avila.db')
-        c = conn.cursor()
-        
-        # Check if attendance already exists for today
-        c.execute("SELECT * FROM attendance WHERE idno = ? AND date = ?", (idno, date))
-        existing = c.fetchone()
-        
-        if existing:
-            # Update existing attendance
-            c.execute("UPDATE attendance SET time_in = ?, name = ?, course_level = ? WHERE idno = ? AND date = ?", 
-                     (time_in, name, course_level, idno, date))
-        else:
-            # Insert new attendance
-            c.execute("INSERT INTO attendance (idno, name, course_level, time_in, date) VALUES (?, ?, ?, ?, ?)", 
-                     (idno, name, course_level, time_in, date))
-        
-        conn.commit()
-        conn.close()
-        return 'Attendance recorded successfully!'
-    else:
-        return 'Student not found', 404
-
-
-# DEBUG ROUTE: Clean duplicate attendance records
-@app.route("/clean_duplicates")
-def clean_duplicates():
-    if 'user' not in session:
-        return redirect(url_for('login'))
-    
-    conn = sqlite3.connect('Avila.db')
-    c = conn.cursor()
-    
-    # Keep only the latest attendance record per student per day
-    c.execute('''
-        DELETE FROM attendance 
-        WHERE id NOT IN (
-            SELECT MAX(id) 
-            FROM attendance 
-            GROUP BY idno, date
-        )
-    ''')
-    
-    deleted_count = c.rowcount
-    conn.commit()
-    conn.close()
-    
-    return f"Cleaned {deleted_count} duplicate attendance records"
-
-
-# DEBUG ROUTE: View all attendance
-@app.route("/view_all_attendance")
-def view_all_attendance():
-    if 'user' not in session:
-        return redirect(url_for('login'))
-    
-    conn = sqlite3.connect('Avila.db')
-    c = conn.cursor()
-    
-    # Get all attendance
-    c.execute("SELECT * FROM attendance ORDER BY date DESC, time_in DESC")
-    all_records = c.fetchall()
-    
-    # Get all students
-    c.execute("SELECT idno, firstname, lastname, course, level FROM students ORDER BY lastname")
-    all_students = c.fetchall()
-    
-    conn.close()
-    
-    html = "<h1>Attendance Debug View</h1>"
-    html += f"<p>Total Attendance Records: {len(all_records)}</p>"
-    html += f"<p>Total Students: {len(all_students)}</p>"
-    html += '<p><a href="/clean_duplicates">Clean Duplicate Records</a></p>'
-    
-    html += "<h2>All Attendance Records:</h2>"
-    html += "<table border='1'><tr><th>ID</th><th>IDNO</th><th>Name</th><th>Course & Level</th><th>Time In</th><th>Date</th></tr>"
-    for record in all_records:
-        html += f"<tr><td>{record[0]}</td><td>{record[1]}</td><td>{record[2]}</td><td>{record[3]}</td><td>{record[4]}</td><td>{record[5]}</td></tr>"
-    html += "</table>"
-    
-    html += "<h2>All Students:</h2>"
-    html += "<table border='1'><tr><th>IDNO</th><th>First Name</th><th>Last Name</th><th>Course</th><th>Level</th></tr>"
-    for student in all_students:
-        html += f"<tr><td>{student[0]}</td><td>{student[1]}</td><td>{student[2]}</td><td>{student[3]}</td><td>{student[4]}</td></tr>"
-    html += "</table>"
-    
-    return html
-
-
-if __name__ == "__main__":
-    init_db() 
+from flask import Flask, render_template, request, redirect, url_for, session, Response, stream_with_context, jsonify, send_file
+from flask import g, before_render_template, template_rendered, make_response
+from flask.helpers import get_debug_flag
+from db.dbhelper import getall, addrecord, getrecord, deleterecord, updaterecord, connection
+from db.dbhelper import getpage, encode_cursor, decode_cursor
+from db import dbhelper, roster, export, roster_import, avatars, reports, checkin, live, metrics, search, archive
+from db import pagecache, memory, sync, maintenance, debounce, bitmaps, jobs
+from db.migrations import migrate, import_legacy_attendance
+from db.attendance_writer import AttendanceWriter, ACK_IMMEDIATE, WAIT_TIMEOUT
+from datetime import datetime, timedelta
+import threading
+import logging
+import time
+import sqlite3
+import json
+import atexit
+import signal
+import zipfile
+import io
+import re
+import os
+import sys
+import hmac
+
+app = Flask(__name__)
+app.secret_key = "supersecretkey"
+app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB file upload limit
+app.config['IMPORT_MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # roster + photo zip for /student/import
+
+# Logging: LOG_LEVEL=DEBUG shows per-scan detail; SLOW_QUERY_MS logs statements
+# at least that slow to "db.slow_query" (unset to turn the slow-query log off)
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+app.config['SLOW_QUERY_MS'] = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+
+logging.basicConfig(level=app.config['LOG_LEVEL'],
+                    format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s")
+log = logging.getLogger("attendance")
+if app.config['SLOW_QUERY_MS'] is not None:
+    metrics.slow_query_seconds = app.config['SLOW_QUERY_MS'] / 1000.0
+
+def is_reloader_parent():
+    """Whether this process is the werkzeug reloader's watcher rather than the server.
+
+    With the reloader (app.run(debug=True) below, or flask run --debug) the
+    app is also imported by a parent that serves nothing and only restarts
+    the child, which runs with WERKZEUG_RUN_MAIN=true. Background work that
+    writes the database file or relies on this process's caches belongs to
+    the serving child alone.
+    """
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        return False
+    if __name__ == '__main__':
+        return True
+    flask_cli = os.path.basename(sys.argv[0]) in ('flask', 'flask.exe') or \
+        sys.argv[0].endswith(os.path.join('flask', '__main__.py'))
+    if not flask_cli or 'run' not in sys.argv[1:]:
+        return False
+    if '--no-reload' in sys.argv or '--reload' in sys.argv:
+        return '--reload' in sys.argv
+    return get_debug_flag()
+
+RELOADER_PARENT = is_reloader_parent()
+
+# DATABASE_PATH picks the database file (db/Avila.db by default). With
+# DATABASE_MODE=memory the app works on an in-memory copy of it that is
+# snapshotted back every SNAPSHOT_SECONDS and at shutdown; DATABASE_JOURNAL
+# names an append-only journal that keeps commits made between snapshots
+# (see db/memory.py).
+app.config['DATABASE_PATH'] = os.environ.get('DATABASE_PATH', dbhelper.database)
+app.config['DATABASE_MODE'] = os.environ.get('DATABASE_MODE', 'file')
+app.config['SNAPSHOT_SECONDS'] = float(os.environ.get('SNAPSHOT_SECONDS', memory.SNAPSHOT_SECONDS))
+app.config['DATABASE_JOURNAL'] = os.environ.get('DATABASE_JOURNAL') or None
+app.config['DATABASE_JOURNAL_FSYNC'] = os.environ.get('DATABASE_JOURNAL_FSYNC', '') == '1'
+
+if app.config['DATABASE_MODE'] == 'memory':
+    memory_db = memory.MemoryDatabase(app.config['DATABASE_PATH'],
+                                      interval=app.config['SNAPSHOT_SECONDS'],
+                                      journal=app.config['DATABASE_JOURNAL'],
+                                      journal_fsync=app.config['DATABASE_JOURNAL_FSYNC'])
+    dbhelper.database = memory_db.load()
+elif app.config['DATABASE_MODE'] == 'file':
+    memory_db = None
+    dbhelper.database = os.path.abspath(app.config['DATABASE_PATH'])
+else:
+    raise ValueError("DATABASE_MODE must be 'file' or 'memory'")
+DATABASE = dbhelper.database
+# Attendance used to be written to a separate Avila.db in the working directory
+LEGACY_DATABASE = 'Avila.db'
+
+# Group-commit settings for check-ins: flush every N ms or every M rows.
+# ATTENDANCE_ACK is 'flush' (answer the scan once committed) or 'immediate'.
+app.config['ATTENDANCE_FLUSH_MS'] = 50
+app.config['ATTENDANCE_BATCH_ROWS'] = 500
+app.config['ATTENDANCE_ACK'] = 'flush'
+
+# Repeat reads of a badge within SCAN_DEBOUNCE_SECONDS of the first are
+# answered from memory without a write (see db/debounce.py); 0 turns it off
+app.config['SCAN_DEBOUNCE_SECONDS'] = float(os.environ.get('SCAN_DEBOUNCE_SECONDS', debounce.WINDOW_SECONDS))
+app.config['SCAN_DEBOUNCE_ENTRIES'] = debounce.MAX_ENTRIES
+scan_debounce = debounce.ScanDebouncer(app.config['SCAN_DEBOUNCE_SECONDS'], app.config['SCAN_DEBOUNCE_ENTRIES'])
+
+# Most scans a kiosk may send to /check/batch in one request
+app.config['CHECKIN_BATCH_MAX'] = 500
+
+# Avatars are served from content-hashed URLs and can be cached for a year
+app.config['AVATAR_MAX_AGE'] = 365 * 24 * 3600
+
+# Rows per page on the admin listings
+app.config['PAGE_SIZE'] = 50
+
+# Change-log replication between gates and a central node (see db/sync.py).
+# The /sync endpoints answer only when SYNC_TOKEN is set, and only to
+# requests carrying it as "Authorization: Bearer <token>".
+app.config['NODE_ID'] = os.environ.get('NODE_ID') or sync.node_id()
+app.config['SYNC_TOKEN'] = os.environ.get('SYNC_TOKEN') or None
+app.config['SYNC_BATCH_MAX'] = 5000
+# change_log retention for gates nothing pushes from (see sync.trim), applied hourly
+app.config['SYNC_LOG_KEEP_DAYS'] = float(os.environ.get('SYNC_LOG_KEEP_DAYS', sync.KEEP_DAYS))
+app.config['SYNC_LOG_MAX_ENTRIES'] = int(os.environ.get('SYNC_LOG_MAX_ENTRIES', sync.MAX_LOG_ENTRIES))
+
+# Maintenance tasks (see db/maintenance.py) work through this many attendance
+# ids per transaction and pause between transactions so scans get through
+app.config['MAINTENANCE_CHUNK_ROWS'] = 2000
+app.config['MAINTENANCE_PAUSE_MS'] = 50
+
+# Background jobs (see db/jobs.py): threads shared by all job types, and how
+# many jobs of each type may run at once
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', jobs.WORKERS))
+app.config['JOB_CONCURRENCY'] = {'avatar': 2, 'delete_student': 1, 'rebuild_reports': 1, 'rebuild_term': 1}
+app.config['JOB_MAX_ATTEMPTS'] = jobs.MAX_ATTEMPTS
+
+# Rendered /attend and /studentmngt pages kept in memory (see db/pagecache.py)
+app.config['PAGE_CACHE_ENTRIES'] = 256
+page_cache = pagecache.PageCache(app.config['PAGE_CACHE_ENTRIES'])
+
+_attendance_writer = None
+_attendance_writer_lock = threading.Lock()
+
+def get_attendance_writer():
+    global _attendance_writer
+    if _attendance_writer is None:
+        with _attendance_writer_lock:
+            if _attendance_writer is None:
+                writer = AttendanceWriter(DATABASE,
+                                          flush_ms=app.config['ATTENDANCE_FLUSH_MS'],
+                                          max_rows=app.config['ATTENDANCE_BATCH_ROWS'],
+                                          ack=app.config['ATTENDANCE_ACK'],
+                                          on_commit=publish_checkins)
+                writer.start()
+                atexit.register(writer.stop)
+                _attendance_writer = writer
+    return _attendance_writer
+
+def cached_page(scopes, render, *key):
+    """Serves render() through the page cache with ETag/Last-Modified.
+
+    The page is identified by its route, query string and key, and is
+    current for as long as the data_versions of its scopes do not change.
+    A matching If-None-Match gets a 304 without a query or a render.
+    """
+    key = (request.path, tuple(sorted(request.args.items(multi=True)))) + key
+    scope_versions, changed = pagecache.versions(DATABASE, scopes)
+    tag = pagecache.make_tag(key, scope_versions)
+    if request.if_none_match.contains(tag):
+        response = make_response('', 304)
+    else:
+        body = page_cache.get(key, tag)
+        if body is None:
+            body = render()
+            page_cache.put(key, tag, body)
+        response = make_response(body)
+    response.set_etag(tag)
+    if changed:
+        response.last_modified = changed
+    # Always revalidate: a 304 costs one small query
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+def checkin_event(student, date, time_in):
+    # NULL-safe like the roster's name/course_level: the check-in is already committed
+    return {"date": date, "idno": student['idno'],
+            "name": ' '.join(filter(None, (student['firstname'], student['lastname']))),
+            "course_level": ' '.join(filter(None, (student['course'], student['level']))),
+            "time_in": time_in, "time": clock(time_in)}
+
+def publish_checkins(rows):
+    """Sends committed (student_id, date, time_in, kiosk_id) rows to the live /attend feed."""
+    ids = sorted({row[0] for row in rows})
+    with connection(DATABASE) as conn:
+        students = {s['id']: s for s in conn.execute(
+            f"SELECT id, idno, firstname, lastname, course, level FROM students WHERE id IN ({','.join('?' for _ in ids)})", ids)}
+    live.feed.publish([checkin_event(students[student_id], date, time_in)
+                       for student_id, date, time_in, _ in rows if student_id in students])
+
+def init_db():
+    """Creates or upgrades the database to the current schema."""
+    migrate(DATABASE)
+    if os.path.exists(LEGACY_DATABASE) and os.path.abspath(LEGACY_DATABASE) != dbhelper.file_path(DATABASE):
+        import_legacy_attendance(DATABASE, LEGACY_DATABASE)
+
+def page_cursor(key_count):
+    """Reads the ?after= token: returns (keyset values, rows already shown)."""
+    values = decode_cursor(request.args.get('after'))
+    if values and len(values) == key_count + 1:
+        return values[:key_count], values[key_count]
+    return None, 0
+
+def next_page(rows, start, key):
+    """Trims a LIMIT page_size+1 result to one page and builds the next page's token."""
+    page_size = app.config['PAGE_SIZE']
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(key(rows[-1]) + [start + page_size])
+
+@app.template_filter('clock')
+def clock(timestamp):
+    """Formats an epoch time_in for display, e.g. 08:05 AM."""
+    if timestamp is None:
+        return ''
+    return datetime.fromtimestamp(timestamp).strftime("%I:%M %p")
+
+@app.template_global()
+def avatar_url(avatar, thumb=False):
+    """URL for a student's avatar; content-hashed avatars go through the cached /avatars route."""
+    if avatars.is_stored_name(avatar):
+        return url_for('avatar_file', name=avatars.thumbnail_name(avatar) if thumb else avatar)
+    return url_for('static', filename='images/' + (avatar if avatar else 'default_avatar.png'))
+
+@app.route("/avatars/<name>")
+def avatar_file(name):
+    path = avatars.file_path(name)
+    if path is None:
+        return 'Not found', 404
+    # Names are content hashes, so the bytes behind a URL never change
+    response = send_file(path, max_age=app.config['AVATAR_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+# --- Request metrics ---
+request_seconds = metrics.register(metrics.Histogram(
+    "http_request_duration_seconds", "Time to build a response, by route.", ("method", "route")))
+requests_total = metrics.register(metrics.Counter(
+    "http_requests_total", "Responses sent, by route and status.", ("method", "route", "status")))
+render_seconds = metrics.register(metrics.Histogram(
+    "http_template_render_seconds", "Time to render a template.", ("template",)))
+scans_debounced = metrics.register(metrics.Counter(
+    "scans_debounced_total", "Repeat badge reads answered without a write, by route.", ("route",)))
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Streaming responses are timed up to their first byte
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    if 'request_start' in g:
+        request_seconds.observe(time.perf_counter() - g.request_start, request.method, route)
+    requests_total.inc(request.method, route, response.status_code)
+    return response
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.setdefault('render_starts', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_render(sender, template, context, **extra):
+    starts = g.get('render_starts')
+    if starts:
+        render_seconds.observe(time.perf_counter() - starts.pop(), template.name)
+
+@app.errorhandler(dbhelper.PoolTimeout)
+def database_busy(e):
+    # Every pooled connection stayed checked out for POOL_TIMEOUT seconds
+    log.warning("database busy: %s", e)
+    return 'Server busy, try again', 503
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/")
+def index():
+    return render_template("index.html", show_login=True)
+
+def record_scan(idno, route, callback):
+    """One badge read on /check or /attendance, for the Flask routes and checkin_server alike.
+
+    Looks the student up, applies the debouncer and queues the check-in on
+    the attendance writer. Returns the student, or None for an unknown idno;
+    otherwise callback(ok) is called exactly once: right away for a debounced
+    read (or in 'immediate' ack mode), else from the writer thread once the
+    check-in is written or has failed.
+    """
+    student = roster.lookup(idno)
+    if student is None:
+        return None
+    now = datetime.now()
+    time_in = int(now.timestamp())
+    date = now.strftime("%Y-%m-%d")
+    key = (student['idno'], date)
+
+    if scan_debounce.get(key, now.timestamp()) is not None:
+        scans_debounced.inc(route)
+        log.debug("debounced idno=%s date=%s", idno, date)
+        callback(True)
+        return student
+
+    def written(ok):
+        if ok:
+            log.debug("recorded idno=%s time_in=%s", idno, time_in)
+            scan_debounce.put(key, now.timestamp(), student)
+        else:
+            log.error("attendance not recorded idno=%s date=%s", idno, date)
+        callback(ok)
+
+    log.debug("recording idno=%s name=%r date=%s", idno, student['name'], date)
+    writer = get_attendance_writer()
+    immediate = writer.ack == ACK_IMMEDIATE
+    pending = writer.submit(student['id'], date, time_in, None if immediate else written)
+    if pending is None or immediate:
+        written(pending is not None)
+    return student
+
+def wait_for_scan(idno, route):
+    """(student, ok) for one badge read, blocking until its check-in is written."""
+    done = threading.Event()
+    outcome = []
+
+    def finished(ok):
+        outcome.append(ok)
+        done.set()
+
+    student = record_scan(idno, route, finished)
+    if student is None:
+        return None, False
+    if not done.wait(WAIT_TIMEOUT):
+        log.error("attendance write for idno=%s not done after %ss", idno, WAIT_TIMEOUT)
+        return student, False
+    return student, outcome[0]
+
+@app.route('/check', methods=['GET'])
+def check_student():
+    idno = request.args.get('idno')
+    log.debug("check idno=%s", idno)
+    student, ok = wait_for_scan(idno, '/check')
+    if student is None:
+        return 'STUDENT NOT FOUND'
+    if not ok:
+        return 'ATTENDANCE NOT RECORDED', 503
+    return student_card(student)
+
+
+def student_card(student):
+    """The HTML the scan screen shows for a recorded check-in."""
+    return '''
+        <center>
+            <img src="''' + avatar_url(student['avatar'], thumb=True) + '''" 
+                 style="width:100px;height:100px;border-radius:50%;object-fit:cover;margin-bottom:10px;">
+        </center>
+        <table class="w3-table-all">
+            <tr><td>IDNO</td><td>''' + student['idno'] + '''</td></tr>
+            <tr><td>LASTNAME</td><td>''' + (student['lastname'] or '') + '''</td></tr>
+            <tr><td>FIRSTNAME</td><td>''' + (student['firstname'] or '') + '''</td></tr>
+            <tr><td>COURSE</td><td>''' + (student['course'] or '') + '''</td></tr>
+            <tr><td>LEVEL</td><td>''' + (student['level'] or '') + '''</td></tr>
+        </table>
+        '''
+
+
+@app.route('/check/batch', methods=['POST'])
+def check_batch():
+    # Body: [{"idno": ..., "scanned_at": epoch or ISO 8601, "kiosk_id": ...}, ...]
+    # (or {"scans": [...]}). Answers with one result per scan, in order.
+    body, status = scan_batch(request.get_json(silent=True))
+    return jsonify(body), status
+
+
+def scan_batch(payload):
+    """(JSON body, status) for a /check/batch payload."""
+    scans = payload.get('scans') if isinstance(payload, dict) else payload
+    if not isinstance(scans, list):
+        return {"error": "expected a JSON array of scans"}, 400
+    if len(scans) > app.config['CHECKIN_BATCH_MAX']:
+        return {"error": f"at most {app.config['CHECKIN_BATCH_MAX']} scans per batch"}, 413
+
+    # The writer's on_commit sends recorded scans to the live feed
+    try:
+        results = checkin.record_batch(DATABASE, scans, get_attendance_writer(), scan_debounce)
+    except sqlite3.Error:
+        return {"error": "attendance not recorded"}, 503
+    for result in results:
+        student = result.get('student')
+        if student:
+            student['avatar'] = avatar_url(student['avatar'], thumb=True)
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    if counts.get(checkin.DEBOUNCED):
+        scans_debounced.inc('/check/batch', amount=counts[checkin.DEBOUNCED])
+    # Kiosks send the whole batch again after a 5xx; what was written comes back as duplicate
+    status = 503 if counts.get(checkin.FAILED) else 200
+    return {"results": results, "counts": counts}, status
+
+
+@app.route("/login", methods=["GET", "POST"])
+def login():
+    if request.method == "POST":
+        email = request.form["email"].strip()
+        password = request.form["password"].strip()
+        user = getrecord("user", email=email)
+        if user:
+            if user[0]["password"] == password:
+                session['user'] = email
+                return redirect(url_for('admin'))
+            else:
+                error = "Invalid email or password"
+                return render_template("login.html", title="Login", error=error)
+        else:
+            error = "Email not registered. Please register first."
+            return render_template("login.html", title="Login", error=error)
+    return render_template("login.html", title="Login")
+
+@app.route("/register", methods=["GET", "POST"])
+def register():
+    if request.method == "POST":
+        email = request.form["email"].strip()
+        password = request.form["password"].strip()
+        confirm_password = request.form["confirm_password"].strip()
+
+        if password != confirm_password:
+            return "Passwords do not match!"
+        if getrecord("user", email=email):
+            return "Email already registered."
+
+        addrecord("user", email=email, password=password)
+        return redirect(url_for('login'))
+    return render_template("register.html", title="Register")
+
+@app.route("/logout")
+def logout():
+    session.pop('user', None)
+    return redirect(url_for('index'))
+
+
+@app.route("/admin", methods=["GET", "POST"])
+def admin():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+
+    if request.method == "POST":
+        email = request.form["email"].strip()
+        password = request.form["password"].strip()
+        edit_id = request.form.get("edit_id")
+        if edit_id:
+            updaterecord("user", {"email": email, "password": password}, id=edit_id)
+        else:
+            addrecord("user", email=email, password=password)
+        return redirect(url_for('admin'))
+
+    users = getall("user")
+    edit_id = request.args.get("edit_id")
+    edit_user = getrecord("user", id=edit_id)[0] if edit_id else None
+    return render_template("admin.html", users=users, edit_user=edit_user, edit_id=edit_id, title="User Management")
+
+@app.route("/admin/delete/<int:user_id>")
+def delete_user(user_id):
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    deleterecord("user", id=user_id)
+    return redirect(url_for("admin"))
+
+
+@app.route("/studentmngt", methods=["GET", "POST"])
+def student_mngt():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+
+    if request.method == "POST":
+        idno = request.form["idno"].strip()
+        lastname = request.form["lastname"].strip()
+        firstname = request.form["firstname"].strip()
+        course = request.form["course"].strip()
+        level = request.form["level"].strip()
+        edit_id = request.form.get("edit_id")
+        
+        # Store OLD idno before update so its roster entry can be dropped
+        old_idno = None
+        if edit_id:
+            old_student = getrecord("students", id=edit_id)
+            if old_student:
+                old_idno = old_student[0]['idno']
+        
+        # Handle file upload; the image is decoded and stored by an avatar job
+        avatar_upload = None
+        avatar_file = request.files.get("profile_picture")
+        
+        if avatar_file and avatar_file.filename != '':
+            file_ext = os.path.splitext(avatar_file.filename)[1].lower()
+            avatar_upload = (avatar_file.read(), file_ext)
+            try:
+                avatars.validate(*avatar_upload)
+            except ValueError as e:
+                return str(e)
+
+        data = {
+            "idno": idno,
+            "lastname": lastname,
+            "firstname": firstname,
+            "course": course,
+            "level": level
+        }
+        
+        if edit_id:
+            # The current avatar stays until a new one has been stored
+            # Attendance references the student by id, so it needs no rewrite
+            updaterecord("students", data, id=edit_id)
+            roster.invalidate(old_idno, idno)
+            student_id = int(edit_id)
+                    
+        else:
+            # Adding new student
+            data["avatar"] = "default_avatar.png"
+            added = addrecord("students", **data)
+            roster.invalidate(idno)
+            student_id = max(row['id'] for row in getrecord("students", idno=idno)) if added else None
+
+        if avatar_upload and student_id:
+            enqueue_avatar(student_id, *avatar_upload)
+
+        return redirect(url_for("student_mngt"))
+
+    def render():
+        after, start = page_cursor(3)
+        students_list = getpage("students", ["lastname", "firstname", "id"], after=after,
+                                limit=app.config['PAGE_SIZE'] + 1)
+        students_list, next_cursor = next_page(students_list, start,
+                                               lambda s: [s['lastname'], s['firstname'], s['id']])
+        edit_id = request.args.get("edit_id")
+        
+        edit_student_row = getrecord("students", id=edit_id)
+        edit_student = dict(edit_student_row[0]) if edit_id and edit_student_row else None
+        
+        return render_template("studentmngt.html", students=students_list, edit_student=edit_student,
+                               start=start, next_cursor=next_cursor)
+
+    return cached_page(['students'], render)
+
+
+@app.route("/student/search", methods=["GET"])
+def search_students():
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    # ?q=<prefix text>[&limit=10] -> ranked matches for the typeahead box
+    limit = request.args.get('limit', 10, type=int)
+    results = search.search_students(DATABASE, request.args.get('q', ''), limit)
+    for student in results:
+        student['avatar'] = avatar_url(student['avatar'], thumb=True)
+        student['edit_url'] = url_for('student_mngt', edit_id=student['id'])
+    return jsonify({"results": results})
+
+
+@app.route("/student/import", methods=["POST"])
+def import_students():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+
+    # Rosters and photo zips are far larger than a single avatar upload
+    request.max_content_length = app.config['IMPORT_MAX_CONTENT_LENGTH']
+
+    roster_file = request.files.get("roster")
+    if not roster_file or roster_file.filename == '':
+        return jsonify({"error": "No roster file uploaded"}), 400
+    fmt = os.path.splitext(roster_file.filename)[1].lower().lstrip('.')
+    try:
+        rows = roster_import.parse_roster(roster_file.read(), fmt)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Could not read roster: {e}"}), 400
+
+    photos = None
+    photos_file = request.files.get("photos")
+    if photos_file and photos_file.filename != '':
+        try:
+            photos = zipfile.ZipFile(io.BytesIO(photos_file.read()))
+        except zipfile.BadZipFile:
+            return jsonify({"error": "Photos must be a zip file"}), 400
+
+    on_conflict = request.form.get("on_conflict", roster_import.ON_CONFLICT_UPDATE)
+    if on_conflict not in (roster_import.ON_CONFLICT_UPDATE, roster_import.ON_CONFLICT_SKIP):
+        return jsonify({"error": "on_conflict must be update or skip"}), 400
+    report = roster_import.import_roster(DATABASE, rows, photos, on_conflict=on_conflict)
+    roster.clear()
+    return jsonify(report), (200 if not report["errors"] else 207)
+
+
+@app.route("/student/add", methods=["GET", "POST"])
+def add_student_page():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+
+    if request.method == "POST":
+        idno = request.form["idno"].strip()
+        lastname = request.form["lastname"].strip()
+        firstname = request.form["firstname"].strip()
+        course = request.form["course"].strip()
+        level = request.form["level"].strip()
+        avatar_upload = webcam_avatar(request.form.get("avatar"), idno)
+
+        data = {
+            "idno": idno,
+            "lastname": lastname,
+            "firstname": firstname,
+            "course": course,
+            "level": level,
+            "avatar": "default_avatar.png"
+        }
+        
+        added = addrecord("students", **data)
+        roster.invalidate(idno)
+        if avatar_upload and added:
+            enqueue_avatar(max(row['id'] for row in getrecord("students", idno=idno)), *avatar_upload)
+        return redirect(url_for("student_mngt"))
+
+    return render_template("student.html", student=None)
+
+@app.route("/student/edit/<int:student_id>", methods=["GET", "POST"])
+def edit_student_page(student_id):
+    if 'user' not in session:
+        return redirect(url_for('login'))
+
+    student_row = getrecord("students", id=student_id)
+    student = dict(student_row[0]) if student_row else None
+
+    if request.method == "POST":
+        idno = request.form["idno"].strip()
+        lastname = request.form["lastname"].strip()
+        firstname = request.form["firstname"].strip()
+        course = request.form["course"].strip()
+        level = request.form["level"].strip()
+        avatar_upload = webcam_avatar(request.form.get("avatar"), idno)
+        
+        # Store old info
+        old_idno = student['idno']
+        
+        data = {
+            "idno": idno,
+            "lastname": lastname,
+            "firstname": firstname,
+            "course": course,
+            "level": level
+        }
+
+        # Update student record; attendance follows it by id
+        updaterecord("students", data, id=student_id)
+        roster.invalidate(old_idno, idno)
+        if avatar_upload:
+            enqueue_avatar(student_id, *avatar_upload)
+
+        return redirect(url_for("student_mngt"))
+
+    return render_template("student.html", student=student)
+
+
+@app.route("/student/delete/<int:student_id>")
+def delete_student(student_id):
+    if 'user' not in session:
+        return redirect(url_for('login'))
+
+    # Their attendance is deleted in batches by a job, then the student
+    enqueue_job('delete_student', {"student_id": student_id})
+    return redirect(url_for("student_mngt"))
+
+
+@app.route("/attend", methods=['GET'])
+def attend():
+    selected_date = request.args.get('date')
+    if not selected_date:
+        now = datetime.now()
+        selected_date = now.strftime("%Y-%m-%d")
+    
+    log.debug("attend date=%s", selected_date)
+
+    def render():
+        # Keyset pagination on (time_in, id) within the date
+        after, start = page_cursor(2)
+        keyset = " AND (time_in, id) > (?, ?)" if after else ""
+
+        with connection(DATABASE) as conn, archive.spanning(conn, selected_date, selected_date) as schemas:
+            # Get attendance records for the selected date (from its archive too, if the term is closed)
+            rows, vals = archive.attendance_rows(schemas, "date = ?" + keyset, [selected_date] + (after or []))
+            records = conn.execute(f"""
+                SELECT idno, firstname || ' ' || lastname AS name, course || ' ' || level AS course_level, time_in, id
+                FROM ({rows})
+                ORDER BY time_in, id
+                LIMIT ?
+            """, vals + [app.config['PAGE_SIZE'] + 1]).fetchall()
+
+            log.debug("attend date=%s rows=%d", selected_date, len(records))
+
+        records, next_cursor = next_page(records, start, lambda r: [r['time_in'], r['id']])
+        return render_template('attend.html', records=records, selected_date=selected_date,
+                               start=start, next_cursor=next_cursor, feed_token=live.feed.token())
+
+    # Names and courses come from students, so roster edits invalidate too
+    return cached_page(['students', 'attendance:' + selected_date], render, selected_date)
+
+
+@app.route("/attend/stream", methods=['GET'])
+def attend_stream():
+    # Server-Sent Events: one "checkin" event per new or updated check-in on
+    # ?date=. Resumes after Last-Event-ID (sent by EventSource on reconnect)
+    # or ?last_id= from the page; "reset" means the gap is lost, so reload.
+    selected_date = request.args.get('date') or datetime.now().strftime("%Y-%m-%d")
+    seq = stream_start(request.headers.get('Last-Event-ID'), request.args.get('last_id'))
+
+    def events():
+        yield "retry: 3000\n\n"
+        if seq is None:
+            yield "event: reset\ndata: {}\n\n"
+            return
+        last = seq
+        while True:
+            batch = live.feed.since(last, timeout=15)
+            if not batch:
+                yield ": keepalive\n\n"
+                continue
+            for event_seq, data in batch:
+                last = event_seq
+                if data['date'] == selected_date:
+                    yield checkin_sse(event_seq, data)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def stream_start(token, last_id):
+    """The feed seq a stream resumes after, from Last-Event-ID or the page's ?last_id=; None means reset."""
+    if token:
+        return live.feed.parse_token(token)
+    # The page's token may be older than the feed if the page came from the
+    # page cache, but then nothing on its date has changed since (a change
+    # would have invalidated it), so starting from now loses nothing
+    seq = live.feed.parse_token(last_id)
+    if seq is None:
+        seq = live.feed.parse_token(live.feed.token())
+    return seq
+
+
+def checkin_sse(event_seq, data):
+    return f"id: {live.feed.boot}:{event_seq}\nevent: checkin\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/attendance/export", methods=['GET'])
+def export_attendance():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+
+    # ?start=YYYY-MM-DD&end=YYYY-MM-DD[&course=][&level=][&format=csv|ndjson][&gzip=1]
+    start = request.args.get('start')
+    end = request.args.get('end') or start
+    try:
+        datetime.strptime(start or '', "%Y-%m-%d")
+        datetime.strptime(end, "%Y-%m-%d")
+    except ValueError:
+        return "start and end must be dates in YYYY-MM-DD format", 400
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return "format must be csv or ndjson", 400
+
+    with connection(DATABASE) as conn:
+        terms = len(archive.list_archives(conn, start, end))
+    if terms > archive.MAX_ATTACHED:
+        return f"The range spans {terms} archived terms; export at most {archive.MAX_ATTACHED} at a time", 400
+
+    chunks = export.iter_attendance(DATABASE, start, end,
+                                    course=request.args.get('course'),
+                                    level=request.args.get('level'))
+    body = export.to_csv(chunks) if fmt == 'csv' else export.to_ndjson(chunks)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"attendance_{start}_{end}.{fmt}"
+
+    if request.args.get('gzip') == '1':
+        body = export.gzipped(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+def report_range():
+    """(start, end, course, level, group_by) from the query string; defaults to the last 30 days."""
+    today = datetime.now().date()
+    start = request.args.get('start') or (today - timedelta(days=29)).isoformat()
+    end = request.args.get('end') or today.isoformat()
+    datetime.strptime(start, "%Y-%m-%d")
+    datetime.strptime(end, "%Y-%m-%d")
+    group_by = request.args.get('group_by', 'level')
+    if group_by not in reports.GROUPINGS:
+        raise ValueError(f"group_by must be one of {', '.join(reports.GROUPINGS)}")
+    return start, end, request.args.get('course'), request.args.get('level'), group_by
+
+
+@app.route("/reports", methods=['GET'])
+def reports_page():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    try:
+        start, end, course, level, group_by = report_range()
+    except ValueError as e:
+        return str(e), 400
+    rows = reports.daily_summary(DATABASE, start, end, course, level, group_by)
+    return render_template('reports.html', rows=rows, start=start, end=end, course=course or '',
+                           level=level or '', group_by=group_by, groupings=list(reports.GROUPINGS))
+
+
+@app.route("/reports/attendance.json", methods=['GET'])
+def reports_json():
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    # ?start=&end=[&course=][&level=][&group_by=date|course|level]
+    try:
+        start, end, course, level, group_by = report_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = reports.daily_summary(DATABASE, start, end, course, level, group_by)
+    return jsonify({"start": start, "end": end, "group_by": group_by, "rows": rows})
+
+
+@app.route("/reports/rebuild", methods=['POST'])
+def rebuild_reports():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    enqueue_job('rebuild_reports')
+    return redirect(url_for('reports_page', **request.args))
+
+
+@app.route("/reports/terms.json", methods=['GET'])
+def terms_json():
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    return jsonify({"terms": bitmaps.list_terms(DATABASE)})
+
+
+@app.route("/reports/terms", methods=['POST'])
+def add_term():
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    name = request.form.get('name', '').strip()
+    try:
+        bitmaps.add_term(DATABASE, name, request.form.get('start', ''), request.form.get('end', ''), build=False)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job_id = enqueue_job('rebuild_term', {"term": name})
+    log.info("added term %s job=%d", name, job_id)
+    return jsonify({"terms": bitmaps.list_terms(DATABASE), "job": url_for('job_status', job_id=job_id)}), 202
+
+
+@app.route("/reports/terms/<name>/rebuild", methods=['POST'])
+def rebuild_term(name):
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    if not any(term['name'] == name for term in bitmaps.list_terms(DATABASE)):
+        return jsonify({"error": f"Unknown term: {name}"}), 404
+    job_id = enqueue_job('rebuild_term', {"term": name})
+    return jsonify({"term": name, "job": url_for('job_status', job_id=job_id)}), 202
+
+
+def term_from_args():
+    """The TermBitmaps for ?term=, or raises ValueError."""
+    name = request.args.get('term')
+    if not name:
+        raise ValueError("term is required")
+    return bitmaps.term_bitmaps(DATABASE, name)
+
+
+@app.route("/reports/attendance-rates.json", methods=['GET'])
+def attendance_rates_json():
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    # ?term=[&course=][&level=][&order=desc|asc][&limit=]
+    try:
+        term = term_from_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    order = request.args.get('order', 'desc')
+    limit = request.args.get('limit', 100, type=int)
+    rows = term.rates(request.args.get('course'), request.args.get('level'), order == 'asc', limit)
+    return jsonify({"term": term.name, "school_days": term.school_days.bit_count(), "rows": rows})
+
+
+@app.route("/reports/absentees.json", methods=['GET'])
+def absentees_json():
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    # ?term=&dates=YYYY-MM-DD,...  or  ?term=&start=&end= (school days in the range)
+    # [&min_absent=n (default: absent on every one)][&course=][&level=]
+    try:
+        term = term_from_args()
+        if request.args.get('dates'):
+            days = term.mask(request.args['dates'].split(','))
+        else:
+            start = request.args.get('start') or term.start.isoformat()
+            end = request.args.get('end') or term.end.isoformat()
+            first, last = max(term.ordinal(start), 0), term.ordinal(end)
+            days = term.school_days & ~((1 << first) - 1) & ((1 << (last + 1)) - 1) if last >= 0 else 0
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = term.absentees(days, request.args.get('min_absent', type=int),
+                          request.args.get('course'), request.args.get('level'))
+    dates = [term.day(n) for n in range(days.bit_length()) if days >> n & 1]
+    return jsonify({"term": term.name, "dates": dates, "rows": rows})
+
+
+def sync_authorized():
+    token = app.config['SYNC_TOKEN']
+    supplied = request.headers.get('Authorization', '')
+    return token is not None and hmac.compare_digest(supplied.encode(), ("Bearer " + token).encode())
+
+
+@app.route("/sync/changes", methods=['GET'])
+def sync_changes():
+    # Pull side: this node's change_log after ?after=, for a central node to merge
+    if not sync_authorized():
+        return jsonify({"error": "not authorized"}), 403
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', sync.BATCH_SIZE, type=int), 0), app.config['SYNC_BATCH_MAX'])
+    entries = sync.changes_since(DATABASE, after, limit) if limit else []
+    return jsonify({"node": app.config['NODE_ID'], "entries": entries})
+
+
+@app.route("/sync/state", methods=['GET'])
+def sync_state():
+    # Push side: where a gate should resume from
+    if not sync_authorized():
+        return jsonify({"error": "not authorized"}), 403
+    node = request.args.get('node', '')
+    if not node:
+        return jsonify({"error": "node is required"}), 400
+    return jsonify({"node": node, "high_water": sync.high_water(DATABASE, node)})
+
+
+@app.route("/sync/push", methods=['POST'])
+def sync_push():
+    if not sync_authorized():
+        return jsonify({"error": "not authorized"}), 403
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not payload.get('node') or not isinstance(payload.get('entries'), list):
+        return jsonify({"error": "expected {\"node\": ..., \"entries\": [...]}"}), 400
+    entries = payload['entries']
+    if len(entries) > app.config['SYNC_BATCH_MAX']:
+        return jsonify({"error": f"at most {app.config['SYNC_BATCH_MAX']} entries per push"}), 413
+    try:
+        result = sync.apply_changes(DATABASE, payload['node'], entries)
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({"error": f"malformed entry: {e}"}), 400
+    except sqlite3.Error:
+        return jsonify({"error": "changes not merged"}), 503
+    roster.invalidate(*[idno for e in entries if e.get('entity') == 'student'
+                        for idno in (e.get('idno'), e.get('prev_idno')) if idno])
+    log.info("merged changes node=%s applied=%d conflicts=%d high_water=%d",
+             payload['node'], result['applied'], len(result['conflicts']), result['high_water'])
+    return jsonify(result)
+
+
+@app.route('/attendance', methods=['POST'])
+def record_attendance():
+    student, ok = wait_for_scan(request.form['idno'], '/attendance')
+    if student is None:
+        return 'Student not found', 404
+    if not ok:
+        return 'Failed to record attendance', 503
+    return 'Attendance recorded successfully!'
+
+
+def start_maintenance(task, restart=False):
+    return maintenance.start(DATABASE, task,
+                             chunk=app.config['MAINTENANCE_CHUNK_ROWS'],
+                             pause=app.config['MAINTENANCE_PAUSE_MS'] / 1000.0,
+                             restart=restart)
+
+@app.route("/maintenance", methods=['GET'])
+def maintenance_status():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    return jsonify({"tasks": sorted(maintenance.TASKS), "runs": maintenance.status(DATABASE)})
+
+@app.route("/maintenance/<task>", methods=['POST'])
+def maintenance_start(task):
+    # Starts (or resumes) a task in the background; ?restart=1 starts it over
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    if task not in maintenance.TASKS:
+        return jsonify({"error": f"unknown task {task}"}), 404
+    if not start_maintenance(task, restart=request.args.get('restart') == '1'):
+        return jsonify({"error": f"{task} is already running"}), 409
+    log.info("maintenance started task=%s", task)
+    return jsonify({"task": task, "started": True}), 202
+
+@app.route("/maintenance/<task>/stop", methods=['POST'])
+def maintenance_stop(task):
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    if not maintenance.stop(task):
+        return jsonify({"error": f"{task} is not running"}), 409
+    return jsonify({"task": task, "stopping": True}), 202
+
+
+job_runner = jobs.JobRunner(DATABASE, workers=app.config['JOB_WORKERS'])
+
+
+def trim_change_log():
+    dropped = sync.trim(DATABASE, app.config['SYNC_LOG_KEEP_DAYS'], app.config['SYNC_LOG_MAX_ENTRIES'])
+    if dropped:
+        log.info("trimmed change_log entries=%d", dropped)
+
+job_runner.every(3600, trim_change_log)
+
+
+def enqueue_job(job_type, args=None, payload=None):
+    job_id = jobs.enqueue(DATABASE, job_type, args, payload, app.config['JOB_MAX_ATTEMPTS'])
+    job_runner.wake()
+    log.info("job queued id=%d type=%s", job_id, job_type)
+    return job_id
+
+
+def webcam_avatar(avatar_data, idno):
+    """(bytes, ext) of a webcam capture from the form, or None."""
+    if not avatar_data or not avatar_data.startswith("data:image/"):
+        return None
+    try:
+        upload = avatars.decode_data_url(avatar_data)
+        avatars.validate(*upload)
+    except ValueError as e:
+        log.warning("avatar not saved idno=%s error=%s", idno, e)
+        return None
+    return upload
+
+
+def enqueue_avatar(student_id, data, ext):
+    return enqueue_job('avatar', {"student_id": student_id, "ext": ext}, data)
+
+
+def avatar_job(job):
+    # Decoding and thumbnailing are the slow part of saving a student
+    name = avatars.store(job.payload, job.args['ext'])
+    with connection(DATABASE) as conn:
+        student = conn.execute("SELECT idno FROM students WHERE id = ?", (job.args['student_id'],)).fetchone()
+        if student is None:
+            return {"avatar": name, "student": None}
+        conn.execute("UPDATE students SET avatar = ? WHERE id = ?", (name, job.args['student_id']))
+        conn.commit()
+    roster.invalidate(student['idno'])
+    return {"avatar": name}
+
+
+def delete_student_job(job, batch=500):
+    student_id = job.args['student_id']
+    deleted = 0
+    with connection(DATABASE) as conn:
+        student = conn.execute("SELECT idno FROM students WHERE id = ?", (student_id,)).fetchone()
+        if student is None:
+            return {"attendance_deleted": 0}
+        total = conn.execute("SELECT COUNT(*) FROM attendance WHERE student_id = ?", (student_id,)).fetchone()[0]
+        job.progress(0, total + 1)
+        # Short transactions, so check-ins keep getting the write lock
+        while True:
+            count = conn.execute("DELETE FROM attendance WHERE id IN (SELECT id FROM attendance WHERE student_id = ? LIMIT ?)",
+                                 (student_id, batch)).rowcount
+            conn.commit()
+            if not count:
+                break
+            deleted += count
+            job.progress(deleted)
+        conn.execute("DELETE FROM students WHERE id = ?", (student_id,))
+        conn.commit()
+    roster.invalidate(student['idno'])
+    return {"attendance_deleted": deleted}
+
+
+def rebuild_reports_job(job):
+    count = reports.rebuild_daily(DATABASE)
+    log.info("rebuilt attendance_daily rows=%d", count)
+    return {"rows": count}
+
+
+def rebuild_term_job(job):
+    words = bitmaps.rebuild(DATABASE, job.args['term'])
+    log.info("rebuilt term %s bitmap_words=%d", job.args['term'], words)
+    return {"words": words}
+
+
+for job_type, handler in (('avatar', avatar_job), ('delete_student', delete_student_job),
+                          ('rebuild_reports', rebuild_reports_job), ('rebuild_term', rebuild_term_job)):
+    job_runner.register(job_type, handler, app.config['JOB_CONCURRENCY'].get(job_type, 1))
+
+
+@app.route("/jobs", methods=['GET'])
+def jobs_list():
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    # ?status=queued|running|done|failed[&limit=50]
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({"jobs": jobs.recent(DATABASE, request.args.get('status'), limit)})
+
+@app.route("/jobs/<int:job_id>", methods=['GET'])
+def job_status(job_id):
+    # Status, attempts, progress/total, and the result or last error
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    job = jobs.get(DATABASE, job_id)
+    if job is None:
+        return jsonify({"error": "no such job"}), 404
+    return jsonify(job)
+
+@app.route("/jobs/<int:job_id>/retry", methods=['POST'])
+def job_retry(job_id):
+    if 'user' not in session:
+        return jsonify({"error": "login required"}), 401
+    if not jobs.retry(DATABASE, job_id):
+        return jsonify({"error": "only failed jobs can be retried"}), 409
+    job_runner.wake()
+    return jsonify(jobs.get(DATABASE, job_id)), 202
+
+
+# DEBUG ROUTE: Clean duplicate attendance records
+@app.route("/clean_duplicates")
+def clean_duplicates():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    # Runs as a chunked background task instead of one long DELETE in the request
+    started = start_maintenance('duplicates')
+    return (f"Duplicate clean-up {'started' if started else 'is already running'}; "
+            f"progress at <a href=\"{url_for('maintenance_status')}\">{url_for('maintenance_status')}</a>")
+
+
+# DEBUG ROUTE: View all attendance
+@app.route("/view_all_attendance")
+def view_all_attendance():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    
+    # One keyset page by default (newest first); ?all=1 streams every row
+    show_all = request.args.get('all') == '1'
+    after, start = (None, 0) if show_all else page_cursor(3)
+    page_size = app.config['PAGE_SIZE']
+
+    chunk_rows = 500
+
+    def read(sql, vals=()):
+        # Each chunk borrows a connection only while it is read, so a slow
+        # download neither pins a pooled connection nor holds a WAL snapshot open
+        with connection(DATABASE) as conn:
+            return conn.execute(sql, vals).fetchall()
+
+    def generate():
+        total_records = read("SELECT COUNT(*) FROM attendance")[0][0]
+        total_students = read("SELECT COUNT(*) FROM students")[0][0]
+
+        yield "<h1>Attendance Debug View</h1>"
+        yield f"<p>Total Attendance Records: {total_records}</p>"
+        yield f"<p>Total Students: {total_students}</p>"
+        yield '<p><a href="/clean_duplicates">Clean Duplicate Records</a></p>'
+
+        yield "<h2>All Attendance Records:</h2>"
+        yield "<table border='1'><tr><th>ID</th><th>IDNO</th><th>Name</th><th>Course & Level</th><th>Time In</th><th>Date</th></tr>"
+        keyset = after
+        shown = 0
+        last = None
+        has_more = False
+        while True:
+            # A page asks for one extra row, which only tells us there is a next page
+            limit = chunk_rows if show_all else min(chunk_rows, page_size + 1 - shown)
+            chunk = read(f"""
+                SELECT a.id, s.idno, s.firstname || ' ' || s.lastname, s.course || ' ' || s.level, a.time_in, a.date
+                FROM attendance a JOIN students s ON s.id = a.student_id
+                {"WHERE (a.date, a.time_in, a.id) < (?, ?, ?)" if keyset else ""}
+                ORDER BY a.date DESC, a.time_in DESC, a.id DESC
+                LIMIT ?
+            """, (keyset or []) + [limit])
+            fetched = len(chunk)
+            if not show_all and shown + fetched > page_size:
+                chunk = chunk[:page_size - shown]
+                has_more = True
+            if chunk:
+                shown += len(chunk)
+                last = chunk[-1]
+                keyset = [last[5], last[4], last[0]]
+                yield "".join(
+                    f"<tr><td>{record[0]}</td><td>{record[1]}</td><td>{record[2]}</td><td>{record[3]}</td><td>{clock(record[4])}</td><td>{record[5]}</td></tr>"
+                    for record in chunk)
+            if has_more or fetched < limit:
+                break
+        yield "</table>"
+        if has_more:
+            token = encode_cursor([last[5], last[4], last[0], start + shown])
+            yield f'<p><a href="{url_for("view_all_attendance", after=token)}">Next page</a></p>'
+        if not show_all:
+            yield f'<p><a href="{url_for("view_all_attendance", all=1)}">Show all records</a></p>'
+
+        yield "<h2>All Students:</h2>"
+        yield "<table border='1'><tr><th>IDNO</th><th>First Name</th><th>Last Name</th><th>Course</th><th>Level</th></tr>"
+        keyset = None
+        while True:
+            chunk = read(f"""
+                SELECT idno, firstname, lastname, course, level, id FROM students
+                {"WHERE (lastname, firstname, id) > (?, ?, ?)" if keyset else ""}
+                ORDER BY lastname, firstname, id
+                LIMIT ?
+            """, (keyset or []) + [chunk_rows])
+            yield "".join(
+                f"<tr><td>{student[0]}</td><td>{student[1]}</td><td>{student[2]}</td><td>{student[3]}</td><td>{student[4]}</td></tr>"
+                for student in chunk)
+            if len(chunk) < chunk_rows:
+                break
+            keyset = [chunk[-1][2], chunk[-1][1], chunk[-1][5]]
+        yield "</table>"
+
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+
+# Migrate on import so every launcher (flask run, WSGI servers, app.run) gets the schema
+init_db()
+roster.warm()
+# The reloader's parent serves no requests, so it takes no snapshots (its
+# in-memory copy would overwrite the server's) and claims no jobs (their
+# roster invalidations would land in the wrong process's cache)
+if not RELOADER_PARENT:
+    if memory_db is not None:
+        # Start from a snapshot of the migrated schema; registered before the
+        # attendance writer's stop, so atexit drains the writer first
+        memory_db.snapshot(force=True)
+        memory_db.start()
+        atexit.register(memory_db.stop)
+    # Registered last so running jobs finish before the final snapshot
+    job_runner.start()
+    atexit.register(job_runner.stop)
+
+_previous_handlers = {}
+
+def shutdown():
+    """Stops the background work in order; each step is safe to run again from atexit."""
+    # The writer's last check-ins and the jobs' last writes belong in the final snapshot
+    if _attendance_writer is not None:
+        _attendance_writer.stop()
+    job_runner.stop()
+    if memory_db is not None and not RELOADER_PARENT:
+        memory_db.stop()
+
+def stop_on_signal(signum, frame):
+    # SIGTERM ends the process without running atexit, so run the stop
+    # sequence here before handing over to whatever handler was there before
+    shutdown()
+    previous = _previous_handlers.get(signum)
+    if callable(previous):
+        previous(signum, frame)
+    elif previous != signal.SIG_IGN:
+        raise SystemExit(128 + signum)
+
+# Signal handlers can only be installed from the main thread
+if not RELOADER_PARENT and threading.current_thread() is threading.main_thread():
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        _previous_handlers[signum] = signal.signal(signum, stop_on_signal)
+
+if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
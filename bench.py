@@ -0,0 +1,373 @@
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlencode, urlsplit
+
+# --- Benchmark harness ---
+# Seeds a scratch database with synthetic students and attendance, then
+# drives the app with N concurrent simulated kiosks, either in-process
+# through Flask's test client, through a real HTTP server started here, or
+# against a server that is already running on the same database. Results
+# (throughput and p50/p95/p99 per scenario) are written as JSON so runs can
+# be compared across commits:
+#
+#   python bench.py --students 50000 --attendance 10000000 --kiosks 16
+#   python bench.py --target server --compare bench_results/<earlier run>.json
+SCENARIOS = ["check", "attendance", "attend", "studentmngt", "view_all_attendance"]
+
+BENCH_USER = ("bench@example.com", "bench")
+DAY_START = 7 * 3600   # seeded scans fall between 07:00 and 09:30
+DAY_SPREAD = 9000
+
+
+# --- Seeding ---
+
+def seed(path: str, students: int, attendance: int, rate: float) -> dict:
+    """Creates the scratch database. Everything is derived from row ids, so
+    the same arguments always produce the same data."""
+    from db.migrations import migrate
+    from db.dbhelper import close_all
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    migrate(path)
+    close_all()
+
+    days = max(1, math.ceil(attendance / (students * rate)))
+    first_day = date.today() - timedelta(days=days - 1)
+    threshold = int(rate * 1000)
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    with conn:
+        conn.execute("INSERT INTO user (email, password) VALUES (?, ?)", BENCH_USER)
+        conn.executemany(
+            "INSERT INTO students (idno, lastname, firstname, course, level, avatar) VALUES (?, ?, ?, ?, ?, ?)",
+            ((f"B{n:07d}", f"Last{n}", f"First{n}", ("BSIT", "BSCS", "BSCE", "BSEd")[n % 4], str(n % 4 + 1),
+              "default_avatar.png") for n in range(students)))
+    for d in range(days):
+        day = first_day + timedelta(days=d)
+        midnight = int(time.mktime(day.timetuple()))
+        with conn:
+            # Knuth-style multiplicative hashes pick who came and when
+            conn.execute('''
+                INSERT INTO attendance (student_id, date, time_in)
+                SELECT id, ?, ? + (id * 7919 + ? * 104729) % ?
+                FROM students
+                WHERE (id * 2654435761 + ? * 40503) % 1000 < ?
+            ''', (day.isoformat(), midnight + DAY_START, d, DAY_SPREAD, d, threshold))
+    conn.execute("PRAGMA optimize")
+    rows = conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    conn.close()
+    return {"students": students, "attendance": rows, "days": days,
+            "first_day": first_day.isoformat(), "rate": rate}
+
+
+def describe(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    try:
+        students, = conn.execute("SELECT COUNT(*) FROM students").fetchone()
+        rows, first, last = conn.execute("SELECT COUNT(*), MIN(date), MAX(date) FROM attendance").fetchone()
+    finally:
+        conn.close()
+    return {"students": students, "attendance": rows, "first_day": first, "last_day": last}
+
+
+def sample_keys(path: str) -> tuple:
+    conn = sqlite3.connect(path)
+    try:
+        idnos = [row[0] for row in conn.execute("SELECT idno FROM students")]
+        dates = [row[0] for row in conn.execute("SELECT DISTINCT date FROM attendance")]
+    finally:
+        conn.close()
+    return idnos, dates or [date.today().isoformat()]
+
+
+# --- Clients ---
+# Both return (status, body length) and log in as the seeded bench user.
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self):
+        with self.client.session_transaction() as session:
+            session['user'] = BENCH_USER[0]
+
+    def request(self, method: str, path: str, form: dict = None) -> tuple:
+        response = self.client.open(path, method=method, data=form)
+        body = response.get_data()  # drains streamed responses too
+        return response.status_code, len(body)
+
+
+class HttpClient:
+    """One keep-alive connection per kiosk, like a browser tab."""
+
+    def __init__(self, base_url: str):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        self.cookie = None
+
+    def login(self):
+        email, password = BENCH_USER
+        self.request("POST", "/login", {"email": email, "password": password})
+
+    def request(self, method: str, path: str, form: dict = None) -> tuple:
+        headers = {"Cookie": self.cookie} if self.cookie else {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            raise
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return response.status, len(data)
+
+
+# --- Scenarios ---
+
+def make_request(scenario: str, rng: random.Random, idnos: list, dates: list) -> tuple:
+    """(method, path, form) for one request of the scenario."""
+    if scenario == "check":
+        return "GET", "/check?" + urlencode({"idno": rng.choice(idnos)}), None
+    if scenario == "attendance":
+        return "POST", "/attendance", {"idno": rng.choice(idnos)}
+    if scenario == "attend":
+        return "GET", "/attend?" + urlencode({"date": rng.choice(dates)}), None
+    if scenario == "studentmngt":
+        return "GET", "/studentmngt", None
+    if scenario == "view_all_attendance":
+        return "GET", "/view_all_attendance", None
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(scenario: str, make_client, kiosks: int, requests: int, duration: float,
+                 idnos: list, dates: list, seed_value: int) -> dict:
+    """Runs one scenario with `kiosks` threads until `requests` are sent or `duration` passes."""
+    clients = []
+    for _ in range(kiosks):
+        client = make_client()
+        client.login()
+        clients.append(client)
+
+    latencies = [[] for _ in range(kiosks)]
+    errors = [0] * kiosks
+    sent = [0]
+    sent_lock = threading.Lock()
+    barrier = threading.Barrier(kiosks + 1)
+    deadline = [None]
+
+    def kiosk(index: int):
+        rng = random.Random(seed_value * 1000 + index)
+        client = clients[index]
+        barrier.wait()
+        while True:
+            with sent_lock:
+                if sent[0] >= requests or time.perf_counter() >= deadline[0]:
+                    return
+                sent[0] += 1
+            method, path, form = make_request(scenario, rng, idnos, dates)
+            start = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, form)
+            except Exception:
+                status = None
+            latencies[index].append(time.perf_counter() - start)
+            if status is None or status >= 400:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=kiosk, args=(i,), daemon=True) for i in range(kiosks)]
+    for thread in threads:
+        thread.start()
+    deadline[0] = time.perf_counter() + duration
+    started = time.perf_counter()
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    merged = sorted(value for values in latencies for value in values)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": len(merged),
+        "errors": sum(errors),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(merged) / elapsed, 1) if elapsed else None,
+        "mean_ms": ms(sum(merged) / len(merged)) if merged else None,
+        "p50_ms": ms(percentile(merged, 50)),
+        "p95_ms": ms(percentile(merged, 95)),
+        "p99_ms": ms(percentile(merged, 99)),
+        "max_ms": ms(merged[-1]) if merged else None,
+    }
+
+
+# --- Targets ---
+
+def load_app(db_path: str):
+    """Imports app.py against the scratch database (and a scratch working directory,
+    so the legacy ./Avila.db import does not pick up a real file)."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from db import dbhelper
+    dbhelper.database = os.path.abspath(db_path)
+    os.chdir(os.path.dirname(os.path.abspath(db_path)))
+    import app as app_module
+    return app_module
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name="bench-server", daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, previous_path: str) -> None:
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nvs {previous_path} ({previous.get('commit')}):")
+    for scenario, current in results.items():
+        before = previous.get("results", {}).get(scenario)
+        if not before:
+            continue
+        deltas = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if before.get(key) and current.get(key) is not None:
+                deltas.append(f"{key} {(current[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"  {scenario:<22} " + "  ".join(deltas))
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Seed a scratch database and benchmark the scan and admin paths.")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "avinz_bench", "bench.db"),
+                        help="scratch database (reused between runs unless --reseed)")
+    parser.add_argument("--reseed", action="store_true", help="rebuild the scratch database even if it exists")
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--attendance", type=int, default=10000000, help="approximate attendance rows to seed")
+    parser.add_argument("--rate", type=float, default=0.9, help="share of students present each seeded day")
+    parser.add_argument("--target", default="inprocess",
+                        help="'inprocess' (test client), 'server' (local HTTP server started here) "
+                             "or the URL of a running server using --db")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--kiosks", type=int, default=8, help="concurrent simulated kiosks")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--duration", type=float, default=60.0, help="time limit per scenario in seconds")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the request mix")
+    parser.add_argument("--out", default=None, help="results file (default bench_results/<time>-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results file to diff against")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # load_app() changes directory, so pin every path first
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    out = os.path.abspath(args.out) if args.out else None
+    previous = os.path.abspath(args.compare) if args.compare else None
+    db_path = os.path.abspath(args.db)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    if args.reseed or not os.path.exists(db_path):
+        print(f"Seeding {db_path} ...", flush=True)
+        started = time.perf_counter()
+        seeded = seed(db_path, args.students, args.attendance, args.rate)
+        print(f"Seeded {seeded['students']} students, {seeded['attendance']} attendance rows "
+              f"in {time.perf_counter() - started:.1f}s", flush=True)
+    data = describe(db_path)
+    idnos, dates = sample_keys(db_path)
+
+    server = None
+    if args.target in ("inprocess", "server"):
+        app_module = load_app(db_path)
+        app_module.log.setLevel("WARNING")
+        if args.target == "inprocess":
+            make_client = lambda: InProcessClient(app_module.app)
+        else:
+            logging.getLogger("werkzeug").setLevel("WARNING")
+            server, base_url = start_server(app_module.app)
+            make_client = lambda: HttpClient(base_url)
+    else:
+        app_module = None
+        make_client = lambda: HttpClient(args.target)
+
+    results = {}
+    try:
+        for scenario in scenarios:
+            results[scenario] = run_scenario(scenario, make_client, args.kiosks, args.requests, args.duration,
+                                             idnos, dates, args.seed)
+            r = results[scenario]
+            print(f"{scenario:<22} {r['requests']:>7} req  {r['throughput_rps']:>9} req/s  "
+                  f"p50 {r['p50_ms']}ms  p95 {r['p95_ms']}ms  p99 {r['p99_ms']}ms  errors {r['errors']}", flush=True)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if app_module is not None:
+            app_module.get_attendance_writer().stop()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "target": args.target,
+        "kiosks": args.kiosks,
+        "requests_per_scenario": args.requests,
+        "seed": args.seed,
+        "data": data,
+        "results": results,
+    }
+    out = out or os.path.join(here, "bench_results", f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+
+    if previous:
+        compare(results, previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,426 @@
+import argparse
+import asyncio
+import io
+import json
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import app as web
+from db import dbhelper, live
+from db.attendance_writer import WAIT_TIMEOUT
+
+# --- Async check-in server ---
+# An asyncio entry point for the scan traffic, run instead of app.run():
+#
+#   python checkin_server.py --host 0.0.0.0 --port 8000
+#
+# /check, /check/batch, /attendance and /attend/stream are served here on
+# the event loop, so an idle kiosk or dashboard connection costs a coroutine
+# instead of a thread. Scans go through the same code as the Flask routes
+# (app.record_scan, app.scan_batch) on a small executor sized like the
+# connection pool; a single check-in then waits for the group-commit
+# attendance writer's flush on a future instead of a thread, and a batch
+# waits on its executor thread. Dashboards wait for the live feed on an
+# asyncio event. A request body (or chunk) has READ_TIMEOUT to arrive, and
+# only the roster import may be as large as IMPORT_MAX_CONTENT_LENGTH.
+#
+# Every other request goes to the Flask app as WSGI on its own bounded
+# executor, so the admin pages work unchanged. Both halves run in one
+# process and share the app's database pool, roster cache, debouncer, writer
+# and live feed.
+READ_TIMEOUT = 75           # seconds an idle keep-alive connection is kept
+MAX_HEADER_BYTES = 16384
+DB_THREADS = dbhelper.POOL_SIZE
+WSGI_THREADS = 16
+STREAM_KEEPALIVE = 15
+
+NATIVE_ROUTES = {
+    ("GET", "/check"): "check",
+    ("POST", "/check/batch"): "check_batch",
+    ("POST", "/attendance"): "attendance",
+    ("GET", "/attend/stream"): "stream",
+}
+
+
+class BadRequest(Exception):
+    def __init__(self, status: int, message: str = None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method: str, target: str, version: str, headers: list, body: bytes):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers  # [(lower-case name, value)] as received
+        parts = urlsplit(target)
+        self.path = parts.path
+        self.query_string = parts.query
+        self.query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        self.body = body
+
+    def header(self, name: str, default: str = None) -> str:
+        for key, value in reversed(self.headers):
+            if key == name:
+                return value
+        return default
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = (self.header("connection") or "").lower()
+        if self.version == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+
+def body_limit(path: str) -> int:
+    if path == "/student/import":
+        return web.app.config['IMPORT_MAX_CONTENT_LENGTH']
+    return web.app.config['MAX_CONTENT_LENGTH']
+
+
+async def read_body(reader: asyncio.StreamReader, request: Request, max_body: int) -> bytes:
+    if (request.header("transfer-encoding") or "").lower() == "chunked":
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                break
+            if len(body) + size > max_body:
+                raise BadRequest(413)
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        return bytes(body)
+    try:
+        length = int(request.header("content-length", "0"))
+    except ValueError:
+        raise BadRequest(400)
+    if length > max_body:
+        raise BadRequest(413)
+    return await reader.readexactly(length) if length else b""
+
+
+async def read_request(reader: asyncio.StreamReader):
+    """The next request on the connection, or None once the client is done."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), READ_TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise BadRequest(431)
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise BadRequest(400)
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers.append((name.strip().lower(), value.strip()))
+    request = Request(method, target, version, headers, b"")
+    try:
+        request.body = await asyncio.wait_for(read_body(reader, request, body_limit(request.path)), READ_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise BadRequest(408)
+    return request
+
+
+def head_bytes(version: str, status: int, headers: list) -> bytes:
+    lines = [f"{version} {status} {HTTPStatus(status).phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def scan_card(idno: str, route: str, callback) -> tuple:
+    """(student, scan card HTML) from app.record_scan, or (None, None) for an unknown idno."""
+    student = web.record_scan(idno, route, callback)
+    if student is None:
+        return None, None
+    with web.app.test_request_context():
+        return student, web.student_card(student)
+
+
+def record_batch(payload) -> tuple:
+    with web.app.test_request_context():
+        return web.scan_batch(payload)
+
+
+class CheckinServer:
+    def __init__(self, db_threads: int = DB_THREADS, wsgi_threads: int = WSGI_THREADS):
+        self.reads = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix="db-read")
+        self.wsgi = ThreadPoolExecutor(max_workers=wsgi_threads, thread_name_prefix="wsgi")
+        self.port = None
+        self._loop = None
+        self._feed_changed = None
+
+    # --- Plumbing ---
+
+    def attach(self, loop: asyncio.AbstractEventLoop, port: int) -> None:
+        self._loop = loop
+        self.port = port
+        self._feed_changed = asyncio.Event()
+        live.feed.add_listener(lambda: self._call_soon(self._feed_published))
+
+    def _call_soon(self, callback, *args) -> None:
+        # From other threads; the loop may already be gone at shutdown
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass
+
+    def _feed_published(self) -> None:
+        changed, self._feed_changed = self._feed_changed, asyncio.Event()
+        changed.set()
+
+    async def _run(self, executor: ThreadPoolExecutor, fn, *args):
+        return await self._loop.run_in_executor(executor, fn, *args)
+
+    async def _scan(self, idno: str, route: str) -> tuple:
+        """(student, card, ok) for one badge read; waits for the writer's flush without a thread."""
+        done = self._loop.create_future()
+
+        def resolve(ok):
+            if not done.done():
+                done.set_result(ok)
+
+        student, card = await self._run(self.reads, scan_card, idno, route,
+                                        lambda ok: self._call_soon(resolve, ok))
+        if student is None:
+            return None, None, False
+        try:
+            return student, card, await asyncio.wait_for(done, WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            web.log.error("attendance write for idno=%s not done after %ss", idno, WAIT_TIMEOUT)
+            return student, card, False
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as e:
+                    writer.write(head_bytes("HTTP/1.1", e.status, [("Content-Length", "0"), ("Connection", "close")]))
+                    break
+                except (asyncio.IncompleteReadError, ValueError):
+                    break
+                if request is None:
+                    break
+                route = NATIVE_ROUTES.get((request.method, request.path))
+                started = time.perf_counter()
+                if route == "stream":
+                    await self.stream(request, writer, started)
+                    break
+                if route is None:
+                    keep_alive = await self.forward(request, writer)
+                else:
+                    keep_alive = request.keep_alive
+                    try:
+                        status, content_type, body = await getattr(self, route)(request)
+                    except dbhelper.PoolTimeout:
+                        # Same answer as the app's PoolTimeout error handler
+                        web.log.warning("database busy: %s %s", request.method, request.path)
+                        status, content_type, body = 503, "text/plain; charset=utf-8", b"Server busy, try again"
+                    except Exception:
+                        web.log.exception("%s %s failed", request.method, request.path)
+                        status, content_type, body = 500, "text/plain; charset=utf-8", b"Internal Server Error"
+                        keep_alive = False
+                    headers = [("Content-Type", content_type), ("Content-Length", str(len(body)))]
+                    if not keep_alive:
+                        headers.append(("Connection", "close"))
+                    writer.write(head_bytes(request.version, status, headers) + body)
+                    self._observe(request, started, status)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _observe(self, request: Request, started: float, status: int) -> None:
+        # Same series as the Flask routes, so /metrics covers both halves
+        web.request_seconds.observe(time.perf_counter() - started, request.method, request.path)
+        web.requests_total.inc(request.method, request.path, status)
+
+    # --- Scan endpoints ---
+
+    async def check(self, request: Request) -> tuple:
+        student, card, ok = await self._scan(request.query.get("idno"), '/check')
+        if student is None:
+            return 200, "text/html; charset=utf-8", b"STUDENT NOT FOUND"
+        if not ok:
+            return 503, "text/html; charset=utf-8", b"ATTENDANCE NOT RECORDED"
+        return 200, "text/html; charset=utf-8", card.encode()
+
+    async def attendance(self, request: Request) -> tuple:
+        form = {key: values[0] for key, values in parse_qs(request.body.decode("utf-8", "replace")).items()}
+        if "idno" not in form:
+            return 400, "text/html; charset=utf-8", b"Bad Request"
+        student, _, ok = await self._scan(form["idno"], '/attendance')
+        if student is None:
+            return 404, "text/html; charset=utf-8", b"Student not found"
+        if not ok:
+            return 503, "text/html; charset=utf-8", b"Failed to record attendance"
+        return 200, "text/html; charset=utf-8", b"Attendance recorded successfully!"
+
+    async def check_batch(self, request: Request) -> tuple:
+        payload = None
+        if (request.header("content-type") or "").split(";")[0].strip() == "application/json":
+            try:
+                payload = json.loads(request.body)
+            except ValueError:
+                pass
+        body, status = await self._run(self.reads, record_batch, payload)
+        return status, "application/json", json.dumps(body).encode()
+
+    async def stream(self, request: Request, writer: asyncio.StreamWriter, started: float) -> None:
+        selected_date = request.query.get("date") or datetime.now().strftime("%Y-%m-%d")
+        seq = web.stream_start(request.header("last-event-id"), request.query.get("last_id"))
+        writer.write(head_bytes(request.version, 200, [
+            ("Content-Type", "text/event-stream; charset=utf-8"), ("Cache-Control", "no-cache"),
+            ("X-Accel-Buffering", "no"), ("Connection", "close")]) + b"retry: 3000\n\n")
+        self._observe(request, started, 200)
+        if seq is None:
+            writer.write(b"event: reset\ndata: {}\n\n")
+            await writer.drain()
+            return
+        last = seq
+        while True:
+            # Taken before reading the feed, so a publish in between still wakes us
+            changed = self._feed_changed
+            batch = live.feed.since(last)
+            if not batch:
+                try:
+                    await asyncio.wait_for(changed.wait(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+                    await writer.drain()
+                continue
+            for event_seq, data in batch:
+                last = event_seq
+                if data['date'] == selected_date:
+                    writer.write(web.checkin_sse(event_seq, data).encode())
+            await writer.drain()
+
+    # --- Everything else: the Flask app over WSGI ---
+
+    def _environ(self, request: Request, peer) -> dict:
+        environ = {
+            "REQUEST_METHOD": request.method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(request.path, encoding="latin-1"),
+            "QUERY_STRING": request.query_string,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": request.version,
+            "REMOTE_ADDR": peer[0] if peer else "",
+            "CONTENT_LENGTH": str(len(request.body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(request.body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in request.headers:
+            if name == "content-type":
+                environ["CONTENT_TYPE"] = value
+            elif name not in ("content-length", "transfer-encoding"):
+                key = "HTTP_" + name.upper().replace("-", "_")
+                separator = "; " if name == "cookie" else ", "
+                environ[key] = environ[key] + separator + value if key in environ else value
+        return environ
+
+    @staticmethod
+    def _call_app(environ: dict) -> tuple:
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+            return lambda data: None  # the legacy write() callable; Flask does not use it
+
+        result = web.app(environ, start_response)
+        chunks = iter(result)
+        # start_response has been called by the first chunk at the latest
+        first = next(chunks, None)
+        return started[0], started[1], first, chunks, result
+
+    async def forward(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        """Runs the request through the Flask app; returns whether the connection can be reused."""
+        environ = self._environ(request, writer.get_extra_info("peername"))
+        status, headers, first, chunks, result = await self._run(self.wsgi, self._call_app, environ)
+        keep_alive = request.keep_alive
+        sized = any(name.lower() == "content-length" for name, _ in headers)
+        chunked = not sized and request.version == "HTTP/1.1" and request.method != "HEAD"
+        headers = [(name, value) for name, value in headers if name.lower() != "connection"]
+        if chunked:
+            headers.append(("Transfer-Encoding", "chunked"))
+        elif not sized:
+            keep_alive = False
+        if not keep_alive:
+            headers.append(("Connection", "close"))
+        writer.write(head_bytes(request.version, int(status.split(" ", 1)[0]), headers))
+        try:
+            chunk = first
+            while chunk is not None:
+                if chunk:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+                    await writer.drain()
+                chunk = await self._run(self.wsgi, next, chunks, None)
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+        finally:
+            if hasattr(result, "close"):
+                await self._run(self.wsgi, result.close)
+        return keep_alive
+
+    def shutdown(self) -> None:
+        for executor in (self.reads, self.wsgi):
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def serve(host: str, port: int, db_threads: int = DB_THREADS, wsgi_threads: int = WSGI_THREADS) -> None:
+    server = CheckinServer(db_threads, wsgi_threads)
+    loop = asyncio.get_running_loop()
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_HEADER_BYTES)
+    server.attach(loop, listener.sockets[0].getsockname()[1])
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C still raises KeyboardInterrupt
+    web.log.info("check-in server listening on %s:%d", host, server.port)
+    try:
+        await stop.wait()
+    finally:
+        listener.close()
+        server.shutdown()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the scan endpoints on asyncio and the rest of the app over WSGI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--db-threads", type=int, default=DB_THREADS, help="threads for scans and roster lookups")
+    parser.add_argument("--wsgi-threads", type=int, default=WSGI_THREADS, help="threads for the Flask pages")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.db_threads, args.wsgi_threads))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date
+from db import dbhelper
+from db.dbhelper import connection
+from db.migrations import migrate
+
+# --- Attendance archives ---
+# Closed terms are moved out of the live attendance table into one SQLite
+# file per term (archives/attendance_<term>.db next to the database), so the
+# hot table, its indexes, backups and maintenance only cover the current
+# term. Archived rows carry a copy of the student's idno, name, course and
+# level as they were at archival, since the archive file cannot reference
+# the live students table.
+#
+# Readers use spanning(): it ATTACHes the archives whose dates overlap the
+# query on demand, and attendance_rows() builds a UNION ALL over the live
+# table and those archives with the same columns for both. A check-in that
+# is in the live table and an archive at once (while a term is being moved,
+# or a late scan for a closed term) is read from the live table only.
+ARCHIVE_DIR = "archives"
+# SQLite allows 10 attached databases by default; keep room for other ATTACHes
+MAX_ATTACHED = 8
+# Pause between the days archive_term() moves, so check-ins get the write lock in between
+PAUSE_SECONDS = 0.05
+
+log = logging.getLogger(__name__)
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+ROW_COLUMNS = "id, date, time_in, student_id, idno, lastname, firstname, course, level"
+
+LIVE_ROWS = '''
+    SELECT a.id, a.date, a.time_in, a.student_id, s.idno, s.lastname, s.firstname, s.course, s.level
+    FROM main.attendance a JOIN main.students s ON s.id = a.student_id
+'''
+
+# Rows of one attached archive that are not (or no longer) in the live table
+ARCHIVED_ROWS = '''
+    SELECT {columns} FROM {schema}.attendance x
+    WHERE NOT EXISTS (SELECT 1 FROM main.attendance l WHERE l.student_id = x.student_id AND l.date = x.date)
+'''
+
+
+def _archive_schema(schema: str) -> list:
+    return [f'''
+        CREATE TABLE IF NOT EXISTS {schema}.attendance (
+            id INTEGER PRIMARY KEY,
+            student_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            time_in INTEGER NOT NULL,
+            kiosk_id TEXT,
+            idno TEXT NOT NULL,
+            lastname TEXT,
+            firstname TEXT,
+            course TEXT,
+            level TEXT,
+            UNIQUE (student_id, date)
+        )
+    ''', f'''
+        CREATE INDEX IF NOT EXISTS {schema}.idx_attendance_date_time ON attendance(date, time_in, id)
+    ''']
+
+
+def archive_file(path: str, name: str) -> str:
+    """Where the archive for term `name` lives, relative to the database at path."""
+    return os.path.join(os.path.dirname(dbhelper.file_path(path)), ARCHIVE_DIR, f"attendance_{name}.db")
+
+
+def list_archives(conn: sqlite3.Connection, start: str = None, end: str = None) -> list:
+    """Registered archives, oldest first, optionally only those overlapping start..end."""
+    sql = "SELECT * FROM archives"
+    vals = []
+    if start and end:
+        sql += " WHERE start_date <= ? AND end_date >= ?"
+        vals = [end, start]
+    return conn.execute(sql + " ORDER BY start_date", vals).fetchall()
+
+
+def _resolve(conn: sqlite3.Connection, file: str) -> str:
+    if os.path.isabs(file):
+        return file
+    main_file = conn.execute("PRAGMA database_list").fetchone()["file"]
+    return os.path.join(os.path.dirname(main_file), file)
+
+
+@contextmanager
+def spanning(conn: sqlite3.Connection, start: str, end: str):
+    """Attaches the archives overlapping start..end; yields their schema names.
+
+    Cursors reading from them must be closed before the block ends, or the
+    archives cannot be detached.
+    """
+    archives = list_archives(conn, start, end)
+    if len(archives) > MAX_ATTACHED:
+        raise ValueError(f"The range spans {len(archives)} archived terms; at most {MAX_ATTACHED} can be read at once")
+    schemas = []
+    try:
+        for n, archive in enumerate(archives):
+            schema = f"archive_{n}"
+            conn.execute("ATTACH DATABASE ? AS " + schema, (dbhelper.disk_uri(_resolve(conn, archive["file"])),))
+            schemas.append(schema)
+        yield schemas
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        for schema in schemas:
+            try:
+                conn.execute("DETACH DATABASE " + schema)
+            except sqlite3.Error as e:
+                log.warning("could not detach %s: %s", schema, e)
+
+
+def attendance_rows(schemas: list, where: str = "", vals: list = ()) -> tuple:
+    """(sql, vals) for ROW_COLUMNS from the live table plus each attached archive.
+
+    `where` is applied to every part separately, so its filters reach each
+    file's own date index.
+    """
+    parts = [LIVE_ROWS] + [ARCHIVED_ROWS.format(columns=ROW_COLUMNS, schema=schema) for schema in schemas]
+    clause = f" WHERE {where}" if where else ""
+    sql = " UNION ALL ".join(f"SELECT * FROM ({part}){clause}" for part in parts)
+    return sql, list(vals) * len(parts)
+
+
+def archive_term(path: str, name: str, start: str, end: str, pause: float = PAUSE_SECONDS) -> int:
+    """Moves attendance for start..end into the archive for term `name`. Returns rows moved.
+
+    The term is registered first and its rows are then moved one day at a
+    time: the day is copied into the archive file and committed, then deleted
+    from the live table in a second short transaction, so a check-in never
+    waits on more than one day's rows. Readers skip archived rows that are
+    still live, so they never see a row twice, and an interrupted run leaves
+    rows in both files rather than in neither. Running it again finishes the move.
+    """
+    if not _NAME_RE.match(name or ""):
+        raise ValueError("Term name may only use letters, digits, '-' and '_'")
+    start_day = date.fromisoformat(start)
+    end_day = date.fromisoformat(end)
+    if start_day > end_day:
+        raise ValueError("start must not be after end")
+    if end_day >= date.today():
+        raise ValueError("Only closed terms can be archived (end must be before today)")
+
+    file = archive_file(path, name)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    relative = os.path.join(ARCHIVE_DIR, os.path.basename(file))
+
+    with connection(path) as conn:
+        for archive in list_archives(conn, start, end):
+            if archive["name"] != name:
+                raise ValueError(f"{start}..{end} overlaps archived term {archive['name']}")
+        existing = conn.execute("SELECT start_date, end_date FROM archives WHERE name = ?", (name,)).fetchone()
+        if existing and (existing["start_date"], existing["end_date"]) != (start, end):
+            raise ValueError(f"Term {name} was archived as {existing['start_date']}..{existing['end_date']}")
+
+        conn.execute("ATTACH DATABASE ? AS archive", (dbhelper.disk_uri(file),))
+        moved = 0
+        try:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            for statement in _archive_schema("archive"):
+                c.execute(statement)
+            c.execute('''
+                INSERT INTO main.archives (name, file, start_date, end_date, row_count, archived_at)
+                VALUES (?, ?, ?, ?, 0, ?)
+                ON CONFLICT(name) DO NOTHING
+            ''', (name, relative, start, end, int(time.time())))
+            conn.commit()
+
+            days = [row[0] for row in c.execute(
+                "SELECT DISTINCT date FROM main.attendance WHERE date BETWEEN ? AND ? ORDER BY date", (start, end))]
+            for day in days:
+                # Deferred, so only the archive file is locked for writing while the day is copied.
+                # A late scan can land in the live table after a term was archived;
+                # re-archiving merges it, keeping the later check-in
+                c.execute("BEGIN")
+                c.execute('''
+                    INSERT INTO archive.attendance (id, student_id, date, time_in, kiosk_id, idno, lastname, firstname, course, level)
+                    SELECT a.id, a.student_id, a.date, a.time_in, a.kiosk_id, s.idno, s.lastname, s.firstname, s.course, s.level
+                    FROM main.attendance a JOIN main.students s ON s.id = a.student_id
+                    WHERE a.date = ?
+                    ON CONFLICT(student_id, date) DO UPDATE SET time_in = MAX(time_in, excluded.time_in)
+                ''', (day,))
+                conn.commit()
+
+                c.execute("BEGIN IMMEDIATE")
+                # Deleting fires the attendance_daily triggers; the archived day keeps its counts.
+                # The temp table lives as long as the pooled connection, so clear out any a failed run left
+                c.execute("DROP TABLE IF EXISTS temp.archive_term_daily")
+                c.execute("CREATE TEMP TABLE archive_term_daily AS SELECT * FROM main.attendance_daily WHERE date = ?",
+                          (day,))
+                c.execute("DELETE FROM main.attendance WHERE date = ?", (day,))
+                moved += c.rowcount
+                c.execute("INSERT OR REPLACE INTO main.attendance_daily SELECT * FROM temp.archive_term_daily")
+                c.execute("DROP TABLE temp.archive_term_daily")
+                conn.commit()
+                time.sleep(pause)
+
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("UPDATE main.archives SET row_count = (SELECT COUNT(*) FROM archive.attendance), archived_at = ? "
+                      "WHERE name = ?", (int(time.time()), name))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DETACH DATABASE archive")
+    return moved
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Move a closed term's attendance into its own archive file.")
+    parser.add_argument("--db", default=None, help="database path (defaults to db/Avila.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    move = sub.add_parser("archive", help="archive a term")
+    move.add_argument("name", help="term name, e.g. 2025-1")
+    move.add_argument("start", help="first day of the term (YYYY-MM-DD)")
+    move.add_argument("end", help="last day of the term (YYYY-MM-DD)")
+    sub.add_parser("list", help="list archived terms")
+    args = parser.parse_args(argv)
+
+    migrate(args.db)
+    if args.command == "archive":
+        try:
+            moved = archive_term(args.db, args.name, args.start, args.end)
+        except ValueError as e:
+            print("Error:", e)
+            return 1
+        print(f"Archived {moved} attendance rows into term {args.name}")
+        return 0
+    with connection(args.db) as conn:
+        for archive in list_archives(conn):
+            print(f"{archive['name']}\t{archive['start_date']}..{archive['end_date']}\t"
+                  f"{archive['row_count']} rows\t{archive['file']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import logging
+import queue
+import threading
+import time
+from sqlite3 import Error
+from db.checkin import UPSERT_SQL
+from db.dbhelper import PoolTimeout, connection
+
+# --- Group-commit attendance writer ---
+# Scans are queued here and written by a single background thread, many per
+# transaction, so a burst of check-ins costs one commit (and one fsync)
+# instead of one each. Callers can wait (up to WAIT_TIMEOUT) for their batch
+# to be committed or be acknowledged as soon as the check-in is queued. If a
+# batch fails, its rows are written again one per transaction, so one bad row
+# fails only itself (unless no connection was free, which would fail every
+# row the same way).
+# Single scans and kiosk batches both come through here; a check-in only
+# moves time_in forward (checkin.UPSERT_SQL), so the order they land in does
+# not matter.
+ACK_FLUSH = "flush"
+ACK_IMMEDIATE = "immediate"
+WAIT_TIMEOUT = 30.0  # seconds a caller waits for its flush before reporting failure
+
+_STOP = object()
+
+log = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ("row", "done", "ok", "callback")
+
+    def __init__(self, row: tuple, callback=None):
+        self.row = row
+        self.done = threading.Event()
+        self.ok = False
+        self.callback = callback
+
+
+class AttendanceWriter:
+    def __init__(self, path: str = None, flush_ms: int = 50, max_rows: int = 500,
+                 ack: str = ACK_FLUSH, on_commit=None):
+        if ack not in (ACK_FLUSH, ACK_IMMEDIATE):
+            raise ValueError(f"ack must be '{ACK_FLUSH}' or '{ACK_IMMEDIATE}'")
+        self.path = path
+        self.flush_interval = flush_ms / 1000.0
+        self.max_rows = max_rows
+        self.ack = ack
+        # Called with the committed (student_id, date, time_in, kiosk_id) rows after each flush
+        self.on_commit = on_commit
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def start(self) -> None:
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self) -> None:
+        if self._thread is None and not self._stopped:
+            self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, student_id: int, date: str, time_in: int, callback=None, kiosk_id: str = None):
+        """Queues one check-in without waiting; returns None if the writer has stopped.
+
+        callback(ok) is called from the writer thread once the batch is committed or has failed.
+        """
+        pending = _Pending((student_id, date, time_in, kiosk_id), callback)
+        with self._lock:
+            # Enqueue under the lock so nothing can land behind the stop marker
+            if self._stopped:
+                return None
+            self._start_locked()
+            self._queue.put(pending)
+        return pending
+
+    def record(self, student_id: int, date: str, time_in: int, kiosk_id: str = None) -> bool:
+        """Queues one check-in. In 'flush' mode, blocks until it is committed."""
+        return self.wait(self.submit(student_id, date, time_in, kiosk_id=kiosk_id))
+
+    def wait(self, pending, timeout: float = WAIT_TIMEOUT) -> bool:
+        """Whether a check-in from submit() was written; in 'flush' mode, blocks until its batch is done."""
+        if pending is None:
+            return False
+        if self.ack == ACK_IMMEDIATE:
+            return True
+        if not pending.done.wait(timeout):
+            log.error("attendance write for %s not done after %ss", pending.row, timeout)
+            return False
+        return pending.ok
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stops accepting check-ins and drains everything already queued."""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+        # Drain whatever was queued behind the stop marker
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.max_rows):
+            self._flush(leftover[start:start + self.max_rows])
+
+    def _write(self, rows: list):
+        """True once committed, False if the rows failed, None if no connection was free."""
+        try:
+            with connection(self.path) as conn:
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.executemany(UPSERT_SQL, rows)
+                    conn.commit()
+                except Error:
+                    conn.rollback()
+                    raise
+            return True
+        except PoolTimeout:
+            log.exception("attendance batch of %d rows not written", len(rows))
+            return None
+        except Error:
+            if len(rows) == 1:
+                log.exception("attendance write failed for %s", rows[0])
+            else:
+                log.exception("attendance batch of %d rows failed; retrying row by row", len(rows))
+            return False
+
+    def _flush(self, batch: list) -> None:
+        written = self._write([pending.row for pending in batch])
+        if written:
+            for pending in batch:
+                pending.ok = True
+        elif written is False and len(batch) > 1:
+            for pending in batch:
+                pending.ok = bool(self._write([pending.row]))
+        for pending in batch:
+            pending.done.set()
+            if pending.callback is not None:
+                try:
+                    pending.callback(pending.ok)
+                except Exception:
+                    log.exception("attendance callback failed for %s", pending.row)
+        committed = [pending.row for pending in batch if pending.ok]
+        if committed and self.on_commit is not None:
+            try:
+                self.on_commit(committed)
+            except Exception:
+                log.exception("attendance on_commit callback failed")
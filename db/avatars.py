@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import io
+import os
+import re
+import threading
+from functools import lru_cache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it thumbnails are the original image
+    Image = None
+
+# --- Avatar storage ---
+# Avatars are stored under the SHA-256 of their bytes, so identical uploads
+# share one file and a stored name never changes content. That lets them be
+# served with far-future, immutable cache headers. A small thumbnail is made
+# once at upload for the scan screen, which only shows the picture at 100px.
+AVATAR_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "avatars")
+THUMB_SIZE = (200, 200)  # 2x the 100px the scan page renders
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
+
+_NAME_RE = re.compile(r"^[0-9a-f]{64}(_thumb)?\.(jpg|jpeg|png|gif)$")
+
+
+def is_stored_name(name: str) -> bool:
+    """True for names produced by store(); older avatars are plain static/images files."""
+    return bool(name) and bool(_NAME_RE.match(name))
+
+
+def _path(name: str, avatar_dir: str) -> str:
+    # Two-level fan-out keeps directories small with tens of thousands of students
+    return os.path.join(avatar_dir, name[:2], name)
+
+
+def _write_once(path: str, data: bytes) -> None:
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per process and thread: two threads storing the same upload must
+    # not write into one temp file (whichever replace() lands last wins, harmlessly)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _thumbnail(data: bytes) -> bytes:
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        thumb = ImageOps.fit(img.convert("RGB"), THUMB_SIZE)
+    out = io.BytesIO()
+    thumb.save(out, "JPEG", quality=85, optimize=True)
+    return out.getvalue()
+
+
+def validate(data: bytes, ext: str) -> None:
+    """The checks store() can make without decoding the image; raises ValueError."""
+    if ext.lower() not in ALLOWED_EXTENSIONS:
+        raise ValueError(f"Invalid file type. Allowed: {', '.join(sorted(ALLOWED_EXTENSIONS))}")
+    if not data:
+        raise ValueError("Empty image")
+
+
+def store(data: bytes, ext: str = ".png", avatar_dir: str = AVATAR_DIR) -> str:
+    """Stores image bytes by content hash (plus a thumbnail) and returns the avatar name."""
+    validate(data, ext)
+    ext = ext.lower()
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"{digest}{ext}"
+    if Image is not None:
+        thumb_path = _path(f"{digest}_thumb.jpg", avatar_dir)
+        if not os.path.exists(thumb_path):
+            try:
+                thumb = _thumbnail(data)
+            except (OSError, ValueError) as e:  # not a decodable image
+                raise ValueError(f"Unreadable image: {e}")
+            _write_once(thumb_path, thumb)
+    _write_once(_path(name, avatar_dir), data)
+    return name
+
+
+def decode_data_url(data_url: str) -> tuple:
+    """(bytes, ext) of a webcam data: URL (data:image/png;base64,...)."""
+    header, encoded = data_url.split(",", 1)
+    mime = header[len("data:"):].split(";", 1)[0]
+    ext = {"image/jpeg": ".jpg", "image/gif": ".gif"}.get(mime, ".png")
+    return base64.b64decode(encoded), ext
+
+
+def store_data_url(data_url: str, avatar_dir: str = AVATAR_DIR) -> str:
+    """Stores a webcam data: URL (data:image/png;base64,...)."""
+    data, ext = decode_data_url(data_url)
+    return store(data, ext, avatar_dir)
+
+
+@lru_cache(maxsize=65536)
+def thumbnail_name(name: str, avatar_dir: str = AVATAR_DIR) -> str:
+    """The thumbnail for a stored avatar, or the avatar itself if none was made."""
+    thumb = f"{name.split('.', 1)[0]}_thumb.jpg"
+    return thumb if os.path.exists(_path(thumb, avatar_dir)) else name
+
+
+def file_path(name: str, avatar_dir: str = AVATAR_DIR) -> str:
+    """Filesystem path of a stored avatar or thumbnail; None for unknown names."""
+    if not is_stored_name(name):
+        return None
+    path = _path(name, avatar_dir)
+    return path if os.path.exists(path) else None
@@ -0,0 +1,183 @@
+import sqlite3
+import threading
+from datetime import date, timedelta
+from db import archive, pagecache
+from db.dbhelper import connection
+
+# --- Attendance bitmaps ---
+# For each term, every student has a bitset of the days they checked in
+# (attendance_bits, kept current by the triggers from migration 12). Term
+# questions are answered from those bitsets in memory instead of by reading
+# attendance row by row: one Python int per student holds the whole term,
+# so a rate is popcount(bits & school_days) and an absence count is
+# popcount(days & ~bits), each a handful of machine words. A school day is
+# any day of the term on which at least one student checked in.
+#
+# A term's bitmaps are loaded in one pass (one row per student per 64 days;
+# for 50k students the bitsets take about 2MB and load in a fraction of a
+# second) and reused until a check-in in the term or a roster change bumps
+# their data_versions scopes.
+WORD_BITS = 64
+_WORD_MASK = (1 << WORD_BITS) - 1
+
+
+class TermBitmaps:
+    """One term's bitsets, with the students they belong to."""
+
+    def __init__(self, name: str, start: str, end: str, students: list, bits: list):
+        self.name = name
+        self.start = date.fromisoformat(start)
+        self.end = date.fromisoformat(end)
+        self.students = students  # rows of (id, idno, lastname, firstname, course, level)
+        self.bits = bits          # one int per student, same order
+        school = 0
+        for value in bits:
+            school |= value
+        self.school_days = school
+
+    def ordinal(self, day: str) -> int:
+        return (date.fromisoformat(day) - self.start).days
+
+    def day(self, ordinal: int) -> str:
+        return (self.start + timedelta(days=ordinal)).isoformat()
+
+    def mask(self, days: list) -> int:
+        """Bitset of the given days; days outside the term are ignored."""
+        value = 0
+        for day in days:
+            n = self.ordinal(day)
+            if 0 <= n <= (self.end - self.start).days:
+                value |= 1 << n
+        return value
+
+    def _selected(self, course: str = None, level: str = None):
+        for student, value in zip(self.students, self.bits):
+            if (course is None or student[4] == course) and (level is None or student[5] == level):
+                yield student, value
+
+    def rates(self, course: str = None, level: str = None, ascending: bool = False, limit: int = None) -> list:
+        """Students ranked by the share of school days they attended."""
+        school = self.school_days
+        total = school.bit_count()
+        ranked = [(student, (value & school).bit_count()) for student, value in self._selected(course, level)]
+        ranked.sort(key=lambda item: (item[1] if ascending else -item[1], item[0][2], item[0][3]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [_student_dict(student, attended=present, school_days=total,
+                              rate=round(present / total, 4) if total else None)
+                for student, present in ranked]
+
+    def absentees(self, days: int, min_absent: int = None, course: str = None, level: str = None) -> list:
+        """Students absent on at least min_absent of the `days` bitset (default: all of them).
+
+        With no days selected (say, a range without school days) nobody was absent.
+        """
+        if not days:
+            return []
+        wanted = days.bit_count() if min_absent is None else max(min_absent, 1)
+        found = []
+        for student, value in self._selected(course, level):
+            absent = (days & ~value).bit_count()
+            if absent >= wanted:
+                found.append((student, absent))
+        found.sort(key=lambda item: (-item[1], item[0][2], item[0][3]))
+        return [_student_dict(student, absent=absent) for student, absent in found]
+
+
+def _student_dict(student: tuple, **extra) -> dict:
+    row = dict(zip(("id", "idno", "lastname", "firstname", "course", "level"), student))
+    row.update(extra)
+    return row
+
+
+def list_terms(path: str = None) -> list:
+    with connection(path) as conn:
+        return [dict(row) for row in conn.execute("SELECT * FROM terms ORDER BY start_date")]
+
+
+def add_term(path: str, name: str, start: str, end: str, build: bool = True) -> int:
+    """Registers a term and (unless build is False) builds its bitmaps. Returns bitmap words written."""
+    if not name:
+        raise ValueError("Term name is required")
+    if date.fromisoformat(start) > date.fromisoformat(end):
+        raise ValueError("start must not be after end")
+    with connection(path) as conn:
+        overlap = conn.execute("SELECT name FROM terms WHERE start_date <= ? AND end_date >= ? AND name != ?",
+                               (end, start, name)).fetchone()
+        if overlap:
+            raise ValueError(f"{start}..{end} overlaps term {overlap['name']}")
+        conn.execute('''
+            INSERT INTO terms (name, start_date, end_date) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET start_date = excluded.start_date, end_date = excluded.end_date
+        ''', (name, start, end))
+        conn.commit()
+    return rebuild(path, name) if build else 0
+
+
+def rebuild(path: str, name: str) -> int:
+    """Recomputes a term's bitmaps from the live and archived attendance. Returns bitmap words written."""
+    with connection(path) as conn:
+        term = conn.execute("SELECT * FROM terms WHERE name = ?", (name,)).fetchone()
+        if term is None:
+            raise ValueError(f"Unknown term: {name}")
+        start, end = term["start_date"], term["end_date"]
+        with archive.spanning(conn, start, end) as schemas:
+            rows, vals = archive.attendance_rows(schemas, "date BETWEEN ? AND ?", [start, end])
+            try:
+                c = conn.cursor()
+                c.execute("BEGIN IMMEDIATE")
+                c.execute("DELETE FROM attendance_bits WHERE term = ?", (name,))
+                # (student_id, date) is unique, so summing distinct powers of two is an OR
+                c.execute(f'''
+                    INSERT INTO attendance_bits (term, student_id, word, bits)
+                    SELECT ?, student_id, ordinal / {WORD_BITS}, SUM(1 << (ordinal % {WORD_BITS}))
+                    FROM (SELECT DISTINCT student_id, CAST(julianday(date) - julianday(?) AS INTEGER) AS ordinal
+                          FROM ({rows}))
+                    GROUP BY student_id, ordinal / {WORD_BITS}
+                ''', [name, start] + vals)
+                count = c.rowcount
+                c.execute('''
+                    INSERT INTO data_versions (scope, version, changed_at)
+                    VALUES (?, 1, CAST(strftime('%s', 'now') AS INTEGER))
+                    ON CONFLICT(scope) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at
+                ''', ("bitmaps:" + name,))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+    return count
+
+
+def _load(path: str, name: str) -> TermBitmaps:
+    with connection(path) as conn:
+        term = conn.execute("SELECT * FROM terms WHERE name = ?", (name,)).fetchone()
+        if term is None:
+            raise ValueError(f"Unknown term: {name}")
+        students = [tuple(row) for row in conn.execute(
+            "SELECT id, idno, lastname, firstname, course, level FROM students ORDER BY id")]
+        index = {student[0]: i for i, student in enumerate(students)}
+        bits = [0] * len(students)
+        for student_id, word, value in conn.execute(
+                "SELECT student_id, word, bits FROM attendance_bits WHERE term = ?", (name,)):
+            i = index.get(student_id)
+            if i is not None:
+                bits[i] |= (value & _WORD_MASK) << (word * WORD_BITS)
+    return TermBitmaps(name, term["start_date"], term["end_date"], students, bits)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def term_bitmaps(path: str, name: str) -> TermBitmaps:
+    """The term's bitmaps, reloaded only when a check-in or roster change has touched them."""
+    scope_versions, _ = pagecache.versions(path, ["bitmaps:" + name, "students"])
+    key = (path, name)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[0] == scope_versions:
+        return cached[1]
+    bitmaps = _load(path, name)
+    with _cache_lock:
+        _cache[key] = (scope_versions, bitmaps)
+    return bitmaps
@@ -0,0 +1,150 @@
+import sqlite3
+import time
+from datetime import datetime
+from db.dbhelper import connection
+
+# --- Batch check-in ---
+# Kiosks queue scans while offline and send them in batches. A batch is
+# resolved with one student query and its check-ins are written by the app's
+# group-commit AttendanceWriter, like single scans. Replaying a batch is
+# harmless: a check-in only moves time_in forward, so the same scan sent
+# twice (or an older scan arriving late) leaves the row as it is.
+# Given the app's ScanDebouncer, a scan less than its window after the
+# recorded one (in memory or in the table) is the same read and not written,
+# the last-seen rule db/debounce.py describes for every route.
+MAX_CLOCK_SKEW = 300  # seconds a kiosk clock may run ahead of the server
+
+RECORDED = "recorded"
+DUPLICATE = "duplicate"
+DEBOUNCED = "debounced"
+NOT_FOUND = "not_found"
+INVALID = "invalid"
+FAILED = "failed"
+
+# Every attendance write (the group-commit writer, sync) goes through this;
+# relies on the unique (student_id, date) key from migration 4
+UPSERT_SQL = """
+    INSERT INTO attendance (student_id, date, time_in, kiosk_id) VALUES (?, ?, ?, ?)
+    ON CONFLICT(student_id, date) DO UPDATE SET time_in = excluded.time_in, kiosk_id = excluded.kiosk_id
+    WHERE excluded.time_in > attendance.time_in
+"""
+
+
+def parse_scanned_at(value, now: float) -> int:
+    """Epoch seconds from a number (seconds or milliseconds) or an ISO 8601 string."""
+    if value is None or value == "":
+        return int(now)
+    if isinstance(value, bool):
+        raise ValueError("scanned_at must be a timestamp")
+    if isinstance(value, (int, float)):
+        seconds = value / 1000.0 if value > 1e11 else float(value)
+    else:
+        seconds = datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    if seconds > now + MAX_CLOCK_SKEW:
+        raise ValueError("scanned_at is in the future")
+    return int(seconds)
+
+
+def _students_by_idno(conn: sqlite3.Connection, idnos: list) -> dict:
+    students = {}
+    for start in range(0, len(idnos), 500):
+        batch = idnos[start:start + 500]
+        qmarks = ",".join("?" for _ in batch)
+        # ORDER BY id keeps the oldest row for a duplicated idno, like getrecord
+        for row in conn.execute(f"SELECT * FROM students WHERE idno IN ({qmarks}) ORDER BY id", batch):
+            students.setdefault(row["idno"], row)
+    return students
+
+
+def _current_times(conn: sqlite3.Connection, keys: set) -> dict:
+    if not keys:
+        return {}
+    student_ids = sorted({student_id for student_id, _ in keys})
+    dates = sorted({date for _, date in keys})
+    times = {}
+    for start in range(0, len(student_ids), 500):
+        batch = student_ids[start:start + 500]
+        sql = f'''
+            SELECT student_id, date, time_in FROM attendance
+            WHERE student_id IN ({",".join("?" for _ in batch)}) AND date IN ({",".join("?" for _ in dates)})
+        '''
+        for row in conn.execute(sql, batch + dates):
+            times[(row["student_id"], row["date"])] = row["time_in"]
+    return times
+
+
+def record_batch(path: str, scans: list, writer, debouncer=None) -> list:
+    """Records [{idno, scanned_at, kiosk_id}, ...] through writer; returns one result dict per scan, in order.
+
+    A scan whose check-in could not be written is marked FAILED.
+    """
+    now = time.time()
+    results = []
+    parsed = []
+    for index, scan in enumerate(scans):
+        result = {"index": index, "idno": None, "status": INVALID}
+        results.append(result)
+        if not isinstance(scan, dict):
+            result["error"] = "scan must be an object"
+            continue
+        idno = str(scan.get("idno") or "").strip()
+        result["idno"] = idno or None
+        if not idno:
+            result["error"] = "missing idno"
+            continue
+        try:
+            time_in = parse_scanned_at(scan.get("scanned_at"), now)
+        except (TypeError, ValueError, OverflowError) as e:
+            result["error"] = f"bad scanned_at: {e}"
+            continue
+        kiosk_id = scan.get("kiosk_id")
+        parsed.append((result, idno, time_in, str(kiosk_id)[:64] if kiosk_id else None))
+
+    if not parsed:
+        return results
+
+    with connection(path) as conn:
+        students = _students_by_idno(conn, sorted({idno for _, idno, _, _ in parsed}))
+
+        # Latest time_in per (student, date) in this batch, seeded from the table
+        rows = {}
+        for result, idno, time_in, kiosk_id in parsed:
+            student = students.get(idno)
+            if student is None:
+                result["status"] = NOT_FOUND
+                continue
+            date = datetime.fromtimestamp(time_in).strftime("%Y-%m-%d")
+            result.update(date=date, time_in=time_in, student={
+                "idno": student["idno"], "lastname": student["lastname"], "firstname": student["firstname"],
+                "course": student["course"], "level": student["level"], "avatar": student["avatar"]})
+            rows.setdefault((student["id"], date), []).append((result, time_in, kiosk_id))
+
+        current = _current_times(conn, set(rows))
+
+    window = debouncer.window if debouncer is not None else 0
+    writes = []
+    for (student_id, date), scans_for_day in rows.items():
+        latest = current.get((student_id, date))
+        for result, time_in, kiosk_id in sorted(scans_for_day, key=lambda scan: scan[1]):
+            if latest is not None and time_in <= latest:
+                result["status"] = DUPLICATE
+                continue
+            key = (result["student"]["idno"], date)
+            # Only recent scans can share a burst with one the debouncer holds
+            recent = debouncer is not None and now - time_in < window
+            if (latest is not None and time_in - latest < window) or \
+                    (recent and debouncer.get(key, time_in) is not None):
+                result["status"] = DEBOUNCED
+                continue
+            result["status"] = RECORDED
+            latest = time_in
+            pending = writer.submit(student_id, date, time_in, kiosk_id=kiosk_id)
+            writes.append((result, pending, key if recent else None))
+
+    # Everything is queued before the first wait, so the batch shares the writer's flushes
+    for result, pending, key in writes:
+        if not writer.wait(pending):
+            result["status"] = FAILED
+        elif key is not None:
+            debouncer.put(key, result["time_in"], result["student"])
+    return results
@@ -1,70 +1,269 @@
-import sqlite3
-import os
-from sqlite3 import Error
-
-database = os.path.join(os.path.dirname(__file__), "Avila.db")
-
-def getprocess(sql: str, vals: list = []) -> list:
-    try:
-        conn = sqlite3.connect(os.path.abspath(database))
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(sql, vals)
-        data = cursor.fetchall()
-        conn.close()
-        return data
-    except Error as e:
-        print("Error:", e)
-        return []
-
-def postprocess(sql: str, vals: list = []) -> bool:
-    try:
-        conn = sqlite3.connect(os.path.abspath(database))
-        cursor = conn.cursor()
-        cursor.execute(sql, vals)
-        conn.commit()
-        conn.close()
-        return True
-    except Error as e:
-        print("Error:", e)
-        return False
-
-# --- THE FIX: Updated getall to accept order_by ---
-def getall(table: str, order_by: str = None) -> list:
-    """Fetches all records from a table, with optional sorting."""
-    sql = f"SELECT * FROM {table}"
-    # Append the ORDER BY clause if a value is provided
-    if order_by:
-        sql += f" ORDER BY {order_by}"
-        
-    return getprocess(sql, [])
-# --- END OF FIX ---
-
-def getrecord(table: str, **kwargs) -> list:
-    keys = list(kwargs.keys())
-    vals = list(kwargs.values())
-    fields = " AND ".join([f"{k}=?" for k in keys])
-    sql = f"SELECT * FROM {table} WHERE {fields}"
-    return getprocess(sql, vals)
-
-def addrecord(table: str, **kwargs) -> bool:
-    keys = list(kwargs.keys())
-    vals = list(kwargs.values())
-    fields = ",".join(keys)
-    qmarks = ",".join(["?" for _ in vals])
-    sql = f"INSERT INTO {table} ({fields}) VALUES ({qmarks})"
-    return postprocess(sql, vals)
-
-def deleterecord(table: str, **kwargs) -> bool:
-    keys = list(kwargs.keys())
-    vals = list(kwargs.values())
-    fields = " AND ".join([f"{k}=?" for k in keys])
-    sql = f"DELETE FROM {table} WHERE {fields}"
-    return postprocess(sql, vals)
-
-def updaterecord(table: str, data: dict, **kwargs) -> bool:
-    set_part = ", ".join([f"{k}=?" for k in data.keys()])
-    where_part = " AND ".join([f"{k}=?" for k in kwargs.keys()])
-    sql = f"UPDATE {table} SET {set_part} WHERE {where_part}"
-    vals = list(data.values()) + list(kwargs.values())
+import sqlite3
+import os
+import json
+import base64
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from sqlite3 import Error
+from urllib.parse import quote, unquote, urlsplit
+from db import metrics
+
+database = os.path.join(os.path.dirname(__file__), "Avila.db")
+
+log = logging.getLogger(__name__)
+
+# --- Connection pool ---
+# Opening a connection (and re-reading the schema) costs more than the single
+# statement most routes run, so connections are kept open and handed out from
+# a small pool per database file instead.
+POOL_SIZE = 8
+POOL_TIMEOUT = 10.0  # seconds to wait for a free connection before giving up
+CACHED_STATEMENTS = 256
+
+PRAGMAS = {
+    "synchronous": "NORMAL",    # safe with WAL, one fsync per checkpoint instead of per commit
+    "cache_size": -16000,       # ~16MB page cache per connection
+    "mmap_size": 268435456,     # 256MB memory-mapped reads
+    "busy_timeout": 5000,       # wait for the write lock instead of failing with "database is locked"
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Every pooled connection stayed busy for the whole timeout; the app answers 503."""
+
+
+def memory_uri(path: str) -> str:
+    """URI of a named in-memory database standing in for the file at path.
+
+    The memdb VFS lets every connection opened with the same name share one
+    database, with ordinary locking (busy_timeout applies), for as long as
+    at least one of them stays open.
+    """
+    return "file:" + quote(os.path.abspath(path)) + "?vfs=memdb"
+
+def disk_uri(path: str) -> str:
+    """URI to ATTACH the file at path with. An attached database uses the
+    main database's VFS unless told otherwise, which for an in-memory
+    database would leave the file untouched."""
+    vfs = "win32" if os.name == "nt" else "unix"
+    return "file:" + quote(os.path.abspath(path)) + "?vfs=" + vfs
+
+def is_memory(path: str) -> bool:
+    return path.startswith("file:") and "vfs=memdb" in path
+
+def file_path(path: str = None) -> str:
+    """The file on disk behind a database path; for an in-memory database, the file it is snapshotted to."""
+    path = path or database
+    if path.startswith("file:"):
+        return unquote(urlsplit(path).path)
+    return os.path.abspath(path)
+
+
+class ConnectionPool:
+    """A fixed-size pool of reusable connections to one SQLite file."""
+
+    def __init__(self, path: str, size: int = POOL_SIZE, factory=metrics.InstrumentedConnection, setup=None,
+                 timeout: float = POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.factory = factory
+        # Called with each new connection once its pragmas are set
+        self.setup = setup
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._wal_ready = False
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS,
+                               factory=self.factory,
+                               uri=True)
+        conn.row_factory = sqlite3.Row
+        if not self._wal_ready and not is_memory(self.path):
+            # Only takes effect on a new file, and only before it is switched to
+            # WAL; lets db/maintenance.py return free pages without a full VACUUM
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # journal_mode is persistent in the file, so this only has to happen once
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._wal_ready = True
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        if self.setup is not None:
+            self.setup(conn)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._open()
+                except Error:
+                    self._created -= 1
+                    raise
+        # Every connection is busy; how long this takes shows up in /metrics
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"no free connection to {self.path} after {self.timeout}s")
+        finally:
+            metrics.pool_wait_seconds.observe(time.perf_counter() - start)
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+def get_pool(path: str = None) -> ConnectionPool:
+    path = path or database
+    if not path.startswith("file:"):
+        path = os.path.abspath(path)
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ConnectionPool(path)
+    return pool
+
+
+def add_pool(pool: ConnectionPool) -> None:
+    """Installs a pool set up by the caller, e.g. with a setup hook, for its path."""
+    with _pools_lock:
+        _pools[pool.path] = pool
+
+
+@contextmanager
+def connection(path: str = None):
+    """Borrows a pooled connection. Uncommitted work is rolled back on release."""
+    pool = get_pool(path)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def close_all() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def getprocess(sql: str, vals: list = []) -> list:
+    try:
+        with connection() as conn:
+            cursor = conn.execute(sql, vals)
+            return cursor.fetchall()
+    except PoolTimeout:
+        raise
+    except Error:
+        log.exception("query failed: %s", sql)
+        return []
+
+def postprocess(sql: str, vals: list = []) -> bool:
+    try:
+        with connection() as conn:
+            conn.execute(sql, vals)
+            conn.commit()
+        return True
+    except PoolTimeout:
+        raise
+    except Error:
+        log.exception("statement failed: %s", sql)
+        return False
+
+# --- THE FIX: Updated getall to accept order_by ---
+def getall(table: str, order_by: str = None) -> list:
+    """Fetches all records from a table, with optional sorting."""
+    sql = f"SELECT * FROM {table}"
+    # Append the ORDER BY clause if a value is provided
+    if order_by:
+        sql += f" ORDER BY {order_by}"
+
+    return getprocess(sql, [])
+# --- END OF FIX ---
+
+def getpage(table: str, order_by: list, after: list = None, limit: int = 50) -> list:
+    """Fetches one keyset page: the first `limit` rows ordered by order_by that
+    come after the `after` values (the order_by values of the previous page's last row)."""
+    columns = ", ".join(order_by)
+    sql = f"SELECT * FROM {table}"
+    vals = []
+    if after:
+        qmarks = ", ".join(["?" for _ in order_by])
+        sql += f" WHERE ({columns}) > ({qmarks})"
+        vals = list(after)
+    sql += f" ORDER BY {columns} LIMIT ?"
+    return getprocess(sql, vals + [limit])
+
+def encode_cursor(values: list) -> str:
+    """Packs keyset values into an opaque, URL-safe page token."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str) -> list:
+    """Reverses encode_cursor; returns None for a missing or malformed token."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+def getrecord(table: str, **kwargs) -> list:
+    keys = list(kwargs.keys())
+    vals = list(kwargs.values())
+    fields = " AND ".join([f"{k}=?" for k in keys])
+    sql = f"SELECT * FROM {table} WHERE {fields}"
+    return getprocess(sql, vals)
+
+def addrecord(table: str, **kwargs) -> bool:
+    keys = list(kwargs.keys())
+    vals = list(kwargs.values())
+    fields = ",".join(keys)
+    qmarks = ",".join(["?" for _ in vals])
+    sql = f"INSERT INTO {table} ({fields}) VALUES ({qmarks})"
+    return postprocess(sql, vals)
+
+def deleterecord(table: str, **kwargs) -> bool:
+    keys = list(kwargs.keys())
+    vals = list(kwargs.values())
+    fields = " AND ".join([f"{k}=?" for k in keys])
+    sql = f"DELETE FROM {table} WHERE {fields}"
+    return postprocess(sql, vals)
+
+def updaterecord(table: str, data: dict, **kwargs) -> bool:
+    set_part = ", ".join([f"{k}=?" for k in data.keys()])
+    where_part = " AND ".join([f"{k}=?" for k in kwargs.keys()])
+    sql = f"UPDATE {table} SET {set_part} WHERE {where_part}"
+    vals = list(data.values()) + list(kwargs.values())
     return postprocess(sql, vals)
\ No newline at end of file
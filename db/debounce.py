@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+# --- Scan debounce ---
+# A camera usually reads the same badge several times in a second or two.
+# The first read of a burst is recorded as usual and the student kept here
+# under (idno, date), whichever route recorded it; further reads inside the
+# window are answered from that without a database read, write or commit.
+#
+# Every route follows one rule: time_in is the time of the day's latest scan
+# (last-seen), where reads of a badge less than a window after the recorded
+# one are the same scan rather than a new one. The window runs from the
+# recorded read and is not extended by later ones, so a badge shown again
+# after it moves time_in forward. checkin.record_batch applies the same
+# window to queued scans, against this cache and against the stored time_in.
+# The last read is tracked as last_seen, for inspection only.
+#
+# Entries live in buckets of one window's length by first read. Lookups only
+# look at the current and previous bucket, and older buckets are dropped
+# whole, so expiry costs nothing per entry; max_entries bounds memory during
+# a rush by dropping the oldest bucket early.
+WINDOW_SECONDS = 2.0
+MAX_ENTRIES = 10000
+
+
+class ScanDebouncer:
+    def __init__(self, window: float = WINDOW_SECONDS, max_entries: int = MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # bucket number -> {key: [first_seen, last_seen, response]}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _bucket(self, now: float) -> int:
+        return int(now // self.window)
+
+    def _expire(self, current: int) -> None:
+        while self._buckets:
+            oldest = next(iter(self._buckets))
+            if oldest >= current - 1 and self._size <= self.max_entries:
+                break
+            self._size -= len(self._buckets.pop(oldest))
+
+    def get(self, key: tuple, now: float):
+        """The response recorded for key less than one window ago, or None."""
+        if self.window <= 0:
+            return None
+        current = self._bucket(now)
+        with self._lock:
+            self._expire(current)
+            for number in (current, current - 1):
+                entry = self._buckets.get(number, {}).get(key)
+                if entry is not None and now - entry[0] < self.window:
+                    entry[1] = now
+                    return entry[2]
+        return None
+
+    def put(self, key: tuple, now: float, response) -> None:
+        """Remembers the response of a recorded scan, starting its window at now."""
+        if self.window <= 0:
+            return
+        current = self._bucket(now)
+        with self._lock:
+            bucket = self._buckets.get(current)
+            if bucket is None:
+                bucket = self._buckets[current] = {}
+            if key not in bucket:
+                self._size += 1
+            bucket[key] = [now, now, response]
+            self._expire(current)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._size = 0
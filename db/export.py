@@ -0,0 +1,82 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from db import archive
+from db.dbhelper import connection
+
+# --- Attendance export ---
+# Rows are read in fixed-size keyset chunks and serialized as they arrive,
+# so memory use does not depend on how large the date range is.
+CHUNK_SIZE = 1000
+
+COLUMNS = ["date", "time_in", "idno", "lastname", "firstname", "course", "level"]
+
+
+def iter_attendance(path: str, start: str, end: str, course: str = None, level: str = None,
+                    chunk_size: int = CHUNK_SIZE):
+    """Yields lists of attendance rows for start <= date <= end, oldest first,
+    including rows from archived terms in the range."""
+    where = "date BETWEEN ? AND ?"
+    vals = [start, end]
+    if course:
+        where += " AND course = ?"
+        vals.append(course)
+    if level:
+        where += " AND level = ?"
+        vals.append(level)
+
+    after = []
+    while True:
+        clause = where + (" AND (date, time_in, id) > (?, ?, ?)" if after else "")
+        # Each chunk borrows a connection only while it is read, so a slow
+        # download neither pins a pooled connection nor holds a WAL snapshot open
+        with connection(path) as conn, archive.spanning(conn, start, end) as schemas:
+            rows, params = archive.attendance_rows(schemas, clause, vals + after)
+            chunk = conn.execute(f'''
+                SELECT date, time_in, idno, lastname, firstname, course, level, id
+                FROM ({rows})
+                ORDER BY date, time_in, id
+                LIMIT ?
+            ''', params + [chunk_size]).fetchall()
+        if not chunk:
+            return
+        after = [chunk[-1]["date"], chunk[-1]["time_in"], chunk[-1]["id"]]
+        yield [tuple(row)[:-1] for row in chunk]
+        if len(chunk) < chunk_size:
+            return
+
+
+def _record(row) -> list:
+    values = list(row)
+    values[1] = datetime.fromtimestamp(values[1]).isoformat(timespec="seconds")
+    return values
+
+
+def to_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for chunk in chunks:
+        writer.writerows(_record(row) for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def to_ndjson(chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(dict(zip(COLUMNS, _record(row)))) + "\n" for row in chunk)
+
+
+def gzipped(parts):
+    """Compresses a stream of text parts into a gzip stream on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for part in parts:
+        data = compressor.compress(part.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
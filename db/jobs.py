@@ -0,0 +1,276 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from db import metrics
+from db.dbhelper import connection
+
+# --- Background jobs ---
+# Admin work that can take longer than a scan (decoding avatars, deleting a
+# student's history, rebuilding summaries) is queued in the jobs table and run
+# by a JobRunner on a small thread pool, so the request that asked for it
+# returns at once and web workers stay free for kiosks. Each job type has a
+# handler and a concurrency limit; a handler gets a Job and reports progress
+# through it.
+#
+# A failed job is queued again after RETRY_SECONDS, doubling per attempt,
+# until it has had max_attempts tries. ValueError means the input itself is
+# bad, so it fails the job at once. Running jobs carry a heartbeat; a job
+# whose heartbeat stops (the process died or was restarted) is queued again
+# by whichever runner notices first. Several processes can share the table:
+# a job is claimed with a conditional UPDATE, so only one of them runs it,
+# but each process applies the concurrency limits to its own jobs only.
+#
+# The runner thread also runs housekeeping registered with every(): small
+# periodic chores that need no queue entry or retries.
+WORKERS = 4
+POLL_SECONDS = 1.0
+STALE_SECONDS = 60
+MAX_ATTEMPTS = 3
+RETRY_SECONDS = 5
+KEEP_SECONDS = 7 * 24 * 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+log = logging.getLogger(__name__)
+job_failures = metrics.register(metrics.Counter(
+    "job_failures_total", "Job attempts that raised, by job type and whether the job was failed for good.",
+    ("type", "final")))
+runner_errors = metrics.register(metrics.Counter(
+    "job_runner_errors_total", "Errors in the job runner itself: polling, or a housekeeping task.", ("where",)))
+
+# Everything but the payload, which can be a whole upload
+COLUMNS = ("id", "type", "args", "status", "attempts", "max_attempts", "progress", "total", "result", "error",
+           "created_at", "run_after", "started_at", "heartbeat_at", "finished_at")
+
+
+class Job:
+    """A claimed job as its handler sees it."""
+
+    def __init__(self, path: str, row: sqlite3.Row):
+        self.path = path
+        self.id = row["id"]
+        self.type = row["type"]
+        self.args = json.loads(row["args"])
+        self.payload = row["payload"]
+        self.attempt = row["attempts"]
+
+    def progress(self, done: int, total: int = None) -> None:
+        """Records how far the job has got; also counts as a heartbeat."""
+        with connection(self.path) as conn:
+            conn.execute("UPDATE jobs SET progress = ?, total = COALESCE(?, total), heartbeat_at = ? WHERE id = ?",
+                         (done, total, int(time.time()), self.id))
+            conn.commit()
+
+
+def _as_dict(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    job["args"] = json.loads(job["args"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+def enqueue(path: str, job_type: str, args: dict = None, payload: bytes = None,
+            max_attempts: int = MAX_ATTEMPTS) -> int:
+    """Queues a job and returns its id."""
+    now = int(time.time())
+    with connection(path) as conn:
+        c = conn.execute('''
+            INSERT INTO jobs (type, args, payload, status, max_attempts, created_at, run_after)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (job_type, json.dumps(args or {}), payload, QUEUED, max_attempts, now, now))
+        conn.commit()
+    return c.lastrowid
+
+
+def get(path: str, job_id: int) -> dict:
+    """The job as a dict, or None."""
+    with connection(path) as conn:
+        row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _as_dict(row) if row else None
+
+
+def recent(path: str, status: str = None, limit: int = 50) -> list:
+    """The newest jobs first, optionally only those with the given status."""
+    sql = f"SELECT {', '.join(COLUMNS)} FROM jobs"
+    vals = []
+    if status:
+        sql += " WHERE status = ?"
+        vals.append(status)
+    with connection(path) as conn:
+        rows = conn.execute(sql + " ORDER BY id DESC LIMIT ?", vals + [limit]).fetchall()
+    return [_as_dict(row) for row in rows]
+
+
+def retry(path: str, job_id: int) -> bool:
+    """Queues a failed job again with a fresh set of attempts."""
+    now = int(time.time())
+    with connection(path) as conn:
+        changed = conn.execute('''
+            UPDATE jobs SET status = ?, attempts = 0, error = NULL, run_after = ?, finished_at = NULL
+            WHERE id = ? AND status = ?
+        ''', (QUEUED, now, job_id, FAILED)).rowcount
+        conn.commit()
+    return changed == 1
+
+
+class JobRunner:
+    """Claims queued jobs of the registered types and runs them on a thread pool."""
+
+    def __init__(self, path: str, workers: int = WORKERS, poll: float = POLL_SECONDS,
+                 stale: float = STALE_SECONDS, keep: float = KEEP_SECONDS):
+        self.path = path
+        self.workers = workers
+        self.poll = poll
+        self.stale = stale
+        self.keep = keep
+        self._handlers = {}  # type -> (handler(job) -> JSON-able result, concurrency)
+        self._running = {}   # job id -> type, for jobs of this runner
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pool = None
+        self._thread = None
+        self._pruned_at = 0
+        self._periodic = []  # [seconds, task, last run]
+
+    def register(self, job_type: str, handler, concurrency: int = 1) -> None:
+        self._handlers[job_type] = (handler, concurrency)
+
+    def every(self, seconds: float, task) -> None:
+        """Calls task() from the runner thread at most once per `seconds`, starting at the first poll."""
+        self._periodic.append([seconds, task, 0])
+
+    def _housekeeping(self) -> None:
+        now = time.time()
+        for entry in self._periodic:
+            seconds, task, last = entry
+            if now - last < seconds:
+                continue
+            entry[2] = now
+            try:
+                task()
+            except Exception:
+                log.exception("housekeeping task %s failed", getattr(task, "__name__", task))
+                runner_errors.inc("housekeeping")
+
+    def wake(self) -> None:
+        """Looks for work now instead of at the next poll; call after enqueue()."""
+        self._wake.set()
+
+    def _free_slots(self, job_type: str) -> int:
+        with self._lock:
+            busy = sum(1 for running in self._running.values() if running == job_type)
+            total = len(self._running)
+        return min(self._handlers[job_type][1] - busy, self.workers - total)
+
+    def _claim(self, conn: sqlite3.Connection, job_type: str, now: int):
+        row = conn.execute("SELECT * FROM jobs WHERE status = ? AND type = ? AND run_after <= ? ORDER BY id LIMIT 1",
+                           (QUEUED, job_type, now)).fetchone()
+        if row is None:
+            return None
+        claimed = conn.execute('''
+            UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ?
+            WHERE id = ? AND status = ?
+        ''', (RUNNING, now, now, row["id"], QUEUED)).rowcount
+        conn.commit()
+        if not claimed:
+            return None  # another process got there first
+        return conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+    def _tick(self) -> None:
+        now = int(time.time())
+        with connection(self.path) as conn:
+            # Most ticks find nothing to do; only commit when one changed something
+            changes = conn.total_changes
+            with self._lock:
+                mine = list(self._running)
+            if mine:
+                conn.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({','.join('?' for _ in mine)})",
+                             [now] + mine)
+            # Jobs whose runner went away: try again, or give up if that was the last attempt
+            if conn.execute("SELECT 1 FROM jobs WHERE status = ? AND heartbeat_at < ? LIMIT 1",
+                            (RUNNING, now - self.stale)).fetchone():
+                conn.execute('''
+                    UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN ? ELSE ? END,
+                                    error = 'worker stopped while running', run_after = ?,
+                                    finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END
+                    WHERE status = ? AND heartbeat_at < ?
+                ''', (QUEUED, FAILED, now, now, RUNNING, now - self.stale))
+            if now - self._pruned_at >= 3600:
+                conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                             (DONE, FAILED, now - self.keep))
+                self._pruned_at = now
+            if conn.total_changes != changes:
+                conn.commit()
+            elif conn.in_transaction:
+                conn.rollback()  # a prune that found nothing still took the write lock
+            for job_type in self._handlers:
+                while self._free_slots(job_type) > 0:
+                    row = self._claim(conn, job_type, now)
+                    if row is None:
+                        break
+                    with self._lock:
+                        self._running[row["id"]] = job_type
+                    self._pool.submit(self._execute, row)
+
+    def _execute(self, row: sqlite3.Row) -> None:
+        job = Job(self.path, row)
+        handler = self._handlers[job.type][0]
+        try:
+            result = handler(job)
+        except Exception as e:
+            final = isinstance(e, ValueError) or job.attempt >= row["max_attempts"]
+            log.exception("job %s (%s) attempt %s failed", job.id, job.type, job.attempt)
+            job_failures.inc(job.type, "true" if final else "false")
+            now = int(time.time())
+            with connection(self.path) as conn:
+                conn.execute('''
+                    UPDATE jobs SET status = ?, error = ?, run_after = ?, finished_at = ? WHERE id = ?
+                ''', (FAILED if final else QUEUED, str(e), now + RETRY_SECONDS * 2 ** (job.attempt - 1),
+                      now if final else None, job.id))
+                conn.commit()
+        else:
+            now = int(time.time())
+            with connection(self.path) as conn:
+                # The payload has served its purpose
+                conn.execute('''
+                    UPDATE jobs SET status = ?, result = ?, payload = NULL, error = NULL, finished_at = ?,
+                                    progress = COALESCE(total, progress)
+                    WHERE id = ?
+                ''', (DONE, json.dumps(result), now, job.id))
+                conn.commit()
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+            self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._tick()
+            except sqlite3.Error:
+                log.exception("job runner poll failed")
+                runner_errors.inc("poll")
+            self._housekeeping()
+            self._wake.wait(self.poll)
+            self._wake.clear()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops claiming jobs and waits for the running ones to finish."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._pool.shutdown(wait=True)
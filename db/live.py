@@ -0,0 +1,69 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+# --- Live attendance feed ---
+# Check-ins are published here once committed and streamed to dashboards
+# as Server-Sent Events. The last MAX_EVENTS are kept so a reconnecting
+# dashboard can send its last event id and get only what it missed. Ids
+# are "<boot>:<seq>"; a token from another run of the server, or one older
+# than the buffer, means the client has to reload instead.
+MAX_EVENTS = 5000
+
+
+class EventFeed:
+    def __init__(self, max_events: int = MAX_EVENTS):
+        self.boot = format(int(time.time() * 1000), "x")
+        self._events = deque(maxlen=max_events)
+        self._seq = itertools.count(1)
+        self._last = 0
+        self._changed = threading.Condition()
+        self._listeners = []
+
+    def token(self) -> str:
+        """Resume token for "everything published so far"."""
+        with self._changed:
+            return f"{self.boot}:{self._last}"
+
+    def publish(self, events: list) -> None:
+        """Appends event dicts (each gets an "id") and wakes waiting streams."""
+        if not events:
+            return
+        with self._changed:
+            for data in events:
+                self._last = next(self._seq)
+                self._events.append((self._last, data))
+            self._changed.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, listener) -> None:
+        """Calls listener() after every publish, for streams that cannot block in since()."""
+        self._listeners.append(listener)
+
+    def parse_token(self, token: str):
+        """Sequence number for a token from this run, or None if it cannot be resumed."""
+        boot, _, seq = (token or "").partition(":")
+        if boot != self.boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._changed:
+            oldest = self._events[0][0] if self._events else self._last + 1
+            # Events after seq must still all be buffered
+            if seq > self._last or seq + 1 < oldest:
+                return None
+        return seq
+
+    def since(self, seq: int, timeout: float = None) -> list:
+        """[(seq, data)] published after seq, waiting up to timeout for the first one."""
+        with self._changed:
+            if self._last <= seq and timeout:
+                self._changed.wait(timeout)
+            if not self._events:
+                return []
+            start = max(0, seq + 1 - self._events[0][0])
+            return list(itertools.islice(self._events, start, None))
+
+
+feed = EventFeed()
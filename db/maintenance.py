@@ -0,0 +1,240 @@
+import argparse
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from db import metrics
+from db.dbhelper import connection
+from db.migrations import migrate
+
+# --- Online maintenance ---
+# Clean-up that used to run as one long statement inside a web request now
+# walks its table in bounded id ranges, each in its own short transaction,
+# and sleeps between chunks so kiosk check-ins get the write lock in between.
+# Progress is saved in maintenance_runs in the same transaction as each
+# chunk, so a task that is stopped, fails or dies with the process carries
+# on from where it got to the next time it is started.
+CHUNK_ROWS = 2000
+PAUSE_SECONDS = 0.05
+
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+
+log = logging.getLogger(__name__)
+task_failures = metrics.register(metrics.Counter(
+    "maintenance_task_failures_total", "Maintenance runs that stopped on a database error, by task.", ("task",)))
+
+
+def _id_bounds(conn: sqlite3.Connection) -> tuple:
+    # Rows added after the task starts are new scans and need no clean-up
+    low, high = conn.execute("SELECT MIN(id), MAX(id) FROM attendance").fetchone()
+    return (low, high + 1, None) if low is not None else (0, 0, None)
+
+
+def _duplicates_step(c: sqlite3.Cursor, start: int, stop: int) -> int:
+    # Keeps the latest record per idno per day. (student_id, date) is unique
+    # since migration 4, so what is left are check-ins recorded against two
+    # student rows that share an idno.
+    c.execute('''
+        DELETE FROM attendance WHERE id IN (
+            SELECT a.id FROM attendance a JOIN students s ON s.id = a.student_id
+            WHERE a.id >= ? AND a.id < ?
+              -- CROSS JOIN pins the order: without ANALYZE stats the planner
+              -- would rather scan every check-in of the day by date
+              AND EXISTS (SELECT 1 FROM students t CROSS JOIN attendance b ON b.student_id = t.id
+                          WHERE t.idno = s.idno AND b.date = a.date AND b.id > a.id)
+        )
+    ''', (start, stop))
+    return c.rowcount
+
+
+def _orphans_step(c: sqlite3.Cursor, start: int, stop: int) -> int:
+    # Attendance whose student was deleted while foreign keys were not enforced
+    c.execute('''
+        DELETE FROM attendance
+        WHERE id >= ? AND id < ? AND NOT EXISTS (SELECT 1 FROM students s WHERE s.id = attendance.student_id)
+    ''', (start, stop))
+    return c.rowcount
+
+
+def _analyze_bounds(conn: sqlite3.Connection) -> tuple:
+    return 0, 1, None
+
+
+def _analyze_step(c: sqlite3.Cursor, start: int, stop: int) -> int:
+    # Sampling keeps ANALYZE to a bounded amount of work per index on any table size
+    c.execute("PRAGMA analysis_limit=1000")
+    try:
+        c.execute("ANALYZE")
+    finally:
+        c.execute("PRAGMA analysis_limit=0")
+    return 0
+
+
+def _vacuum_bounds(conn: sqlite3.Connection) -> tuple:
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Switching an existing file over needs one full VACUUM, which is not an online operation
+        return 0, 0, "auto_vacuum is not INCREMENTAL; run VACUUM once offline to enable it"
+    return 0, conn.execute("PRAGMA freelist_count").fetchone()[0], None
+
+
+def _vacuum_step(c: sqlite3.Cursor, start: int, stop: int) -> int:
+    before = c.execute("PRAGMA freelist_count").fetchone()[0]
+    # The pragma frees one page per step and the sqlite3 module only steps
+    # a statement without result rows once, so each execute frees one page
+    for _ in range(stop - start):
+        c.execute("PRAGMA incremental_vacuum")
+    return before - c.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+# name -> (bounds(conn) -> (start, end, message), step(cursor, start, stop) -> rows or pages changed)
+TASKS = {
+    "duplicates": (_id_bounds, _duplicates_step),
+    "orphans": (_id_bounds, _orphans_step),
+    "analyze": (_analyze_bounds, _analyze_step),
+    "vacuum": (_vacuum_bounds, _vacuum_step),
+}
+
+
+def status(path: str = None, task: str = None) -> list:
+    """Saved progress of every task (or one), as dicts."""
+    sql = "SELECT * FROM maintenance_runs"
+    vals = []
+    if task:
+        sql += " WHERE task = ?"
+        vals.append(task)
+    with connection(path) as conn:
+        rows = [dict(row) for row in conn.execute(sql + " ORDER BY task", vals)]
+    for row in rows:
+        row["running"] = is_running(row["task"])
+    return rows
+
+
+def _set_status(conn: sqlite3.Connection, task: str, status_value: str, message: str = None) -> None:
+    now = int(time.time())
+    conn.execute("UPDATE maintenance_runs SET status = ?, message = ?, updated_at = ?, finished_at = ? WHERE task = ?",
+                 (status_value, message, now, now if status_value == DONE else None, task))
+    conn.commit()
+
+
+def run(path: str, task: str, chunk: int = CHUNK_ROWS, pause: float = PAUSE_SECONDS,
+        restart: bool = False, stop: threading.Event = None) -> dict:
+    """Runs task to completion (or until stop is set), resuming an unfinished run. Returns its final state."""
+    bounds, step = TASKS[task]
+    with connection(path) as conn:
+        state = conn.execute("SELECT * FROM maintenance_runs WHERE task = ?", (task,)).fetchone()
+        now = int(time.time())
+        if state is None or state["status"] == DONE or restart:
+            start, end, message = bounds(conn)
+            conn.execute('''
+                INSERT OR REPLACE INTO maintenance_runs
+                    (task, status, position, end_position, processed, changed, message, started_at, updated_at, finished_at)
+                VALUES (?, ?, ?, ?, 0, 0, ?, ?, ?, NULL)
+            ''', (task, RUNNING, start, end, message, now, now))
+        else:
+            conn.execute("UPDATE maintenance_runs SET status = ?, message = NULL, updated_at = ? WHERE task = ?",
+                         (RUNNING, now, task))
+        conn.commit()
+
+    while True:
+        position = None
+        try:
+            # Inside the try, so a PoolTimeout marks the run failed instead of leaving it running
+            with connection(path) as conn:
+                state = conn.execute("SELECT * FROM maintenance_runs WHERE task = ?", (task,)).fetchone()
+                position, end = state["position"], state["end_position"]
+                if position >= end:
+                    _set_status(conn, task, DONE, state["message"])
+                    break
+                if stop is not None and stop.is_set():
+                    _set_status(conn, task, PAUSED)
+                    break
+                upto = min(position + chunk, end)
+                c = conn.cursor()
+                c.execute("BEGIN IMMEDIATE")
+                changed = step(c, position, upto)
+                c.execute('''
+                    UPDATE maintenance_runs
+                    SET position = ?, processed = processed + ?, changed = changed + ?, updated_at = ?
+                    WHERE task = ?
+                ''', (upto, upto - position, changed, int(time.time()), task))
+                conn.commit()
+        except sqlite3.Error as e:
+            # Releasing the connection rolled back the chunk
+            log.exception("maintenance task %s failed at position %s", task, position)
+            task_failures.inc(task)
+            _record_failure(path, task, str(e))
+            break
+        # Let queued check-ins take the write lock before the next chunk
+        time.sleep(pause)
+    return status(path, task)[0]
+
+
+def _record_failure(path: str, task: str, message: str) -> None:
+    try:
+        with connection(path) as conn:
+            _set_status(conn, task, FAILED, message)
+    except sqlite3.Error:
+        log.exception("could not mark maintenance task %s failed", task)
+
+
+_running = {}
+_running_lock = threading.Lock()
+
+
+def is_running(task: str) -> bool:
+    with _running_lock:
+        entry = _running.get(task)
+        return entry is not None and entry[0].is_alive()
+
+
+def start(path: str, task: str, chunk: int = CHUNK_ROWS, pause: float = PAUSE_SECONDS,
+          restart: bool = False) -> bool:
+    """Runs task on a background thread. Returns False if it is already running here."""
+    if task not in TASKS:
+        raise ValueError(f"Unknown maintenance task: {task}")
+    with _running_lock:
+        entry = _running.get(task)
+        if entry is not None and entry[0].is_alive():
+            return False
+        stop_event = threading.Event()
+        thread = threading.Thread(target=run, args=(path, task, chunk, pause, restart, stop_event),
+                                  name=f"maintenance-{task}", daemon=True)
+        _running[task] = (thread, stop_event)
+        thread.start()
+    return True
+
+
+def stop(task: str) -> bool:
+    """Asks a running task to pause after its current chunk."""
+    with _running_lock:
+        entry = _running.get(task)
+    if entry is None or not entry[0].is_alive():
+        return False
+    entry[1].set()
+    return True
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a chunked, resumable maintenance task.")
+    parser.add_argument("--db", default=None, help="database path (defaults to db/Avila.db)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="ids (or pages) per transaction")
+    parser.add_argument("--pause", type=float, default=PAUSE_SECONDS, help="seconds to sleep between chunks")
+    parser.add_argument("--restart", action="store_true", help="start over instead of resuming")
+    parser.add_argument("task", choices=sorted(TASKS) + ["status"])
+    args = parser.parse_args(argv)
+
+    migrate(args.db)
+    if args.task != "status":
+        run(args.db, args.task, args.chunk, args.pause, args.restart)
+    for row in status(args.db):
+        print(f"{row['task']}\t{row['status']}\t{row['position']}/{row['end_position']}\t"
+              f"changed {row['changed']}\t{row['message'] or ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
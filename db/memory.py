@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import closing, nullcontext
+from db import dbhelper, metrics
+
+# --- In-memory database ---
+# With DATABASE_MODE=memory the working database is a named in-memory
+# database (see dbhelper.memory_uri) loaded from the database file at
+# startup. It is written back to that file with the online backup API every
+# few seconds when something changed, and once more at shutdown. A snapshot
+# goes to a temporary file first and replaces the database file in one
+# rename, so a crash mid-snapshot leaves the previous one intact.
+#
+# Whatever was committed after the last snapshot is lost on a crash unless
+# the journal is on: every committed transaction's write statements and their
+# parameters are then appended to it (one JSON line per transaction) and
+# replayed on the next load. Statements that changed no row are left out, so
+# an idle app adds nothing to it. Each snapshot records the journal
+# position it includes, so replay never applies a transaction twice.
+#
+# Nothing else may open the database file while the app runs in this mode;
+# the snapshots would overwrite its changes. The memdb VFS caps a database
+# at 1GB.
+SNAPSHOT_SECONDS = 60
+
+log = logging.getLogger(__name__)
+
+# Reads, transaction control and ATTACH/DETACH (per-request views of archive
+# files, see db/archive.py); everything else is journaled
+_NOT_JOURNALED = ("SELECT", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "END", "SAVEPOINT", "RELEASE", "EXPLAIN", "--",
+                  "ATTACH", "DETACH")
+# Row changes, journaled only if they changed a row; a no-op replays as a no-op
+_ROW_CHANGES = ("INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+def _journaled(sql: str) -> bool:
+    head = sql.lstrip()[:24].upper()
+    if head.startswith("PRAGMA USER_VERSION"):
+        return "=" in sql
+    return not head.startswith(_NOT_JOURNALED)
+
+
+def _changes_rows(sql: str) -> bool:
+    return sql.lstrip()[:8].upper().startswith(_ROW_CHANGES)
+
+
+def _encode(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"$blob": bytes(value).hex()}
+    raise TypeError(f"Cannot journal a {type(value).__name__} parameter")
+
+
+def _decode(obj: dict):
+    return bytes.fromhex(obj["$blob"]) if obj.keys() == {"$blob"} else obj
+
+
+class Journal:
+    """Append-only log of committed write statements, one JSON line per transaction."""
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.seq = 0
+        # Held across commit + append, and by snapshots, so a snapshot's
+        # journal position always matches its contents
+        self.lock = threading.RLock()
+        self._file = None
+
+    def entries(self):
+        """Every readable entry, in order; a torn last line is skipped."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line, object_hook=_decode)
+                except ValueError:
+                    log.warning("ignoring a damaged journal line in %s", self.path)
+                    continue
+                yield entry
+
+    def replay(self, conn: sqlite3.Connection, after: int) -> int:
+        """Applies the transactions after seq `after` to conn. Returns how many were applied."""
+        applied = 0
+        self.seq = after
+        for entry in self.entries():
+            if entry["seq"] <= after:
+                continue
+            try:
+                if entry.get("tx", True):
+                    conn.execute("BEGIN")
+                for op in entry["ops"]:
+                    if "many" in op:
+                        conn.executemany(op["sql"], op["many"])
+                    else:
+                        conn.execute(op["sql"], op["args"])
+                conn.commit()
+                applied += 1
+            except sqlite3.Error as e:
+                conn.rollback()
+                log.warning("could not replay journal entry %s: %s", entry["seq"], e)
+            self.seq = max(self.seq, entry["seq"])
+        return applied
+
+    def open(self) -> None:
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, ops: list, tx: bool = True) -> None:
+        entry = {"seq": 0, "ops": ops}
+        if not tx:
+            entry["tx"] = False
+        with self.lock:
+            self.seq += 1
+            entry["seq"] = self.seq
+            self._file.write(json.dumps(entry, default=_encode) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def discard_through(self, seq: int) -> None:
+        """Drops the entries a snapshot now includes."""
+        with self.lock:
+            keep = [entry for entry in self.entries() if entry["seq"] > seq]
+            self._file.close()
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in keep:
+                    f.write(json.dumps(entry, default=_encode) + "\n")
+            os.replace(tmp, self.path)
+            self.open()
+
+    def close(self) -> None:
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class JournaledCursor(metrics.InstrumentedCursor):
+    """Hands each successful write statement to its connection for the journal."""
+
+    def execute(self, sql, parameters=()):
+        if not _journaled(sql):
+            return super().execute(sql, parameters)
+        before = self.connection.total_changes
+        result = super().execute(sql, parameters)
+        self.connection._record({"sql": sql, "args": parameters}, before)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _journaled(sql):
+            return super().executemany(sql, seq_of_parameters)
+        seq_of_parameters = list(seq_of_parameters)
+        before = self.connection.total_changes
+        result = super().executemany(sql, seq_of_parameters)
+        self.connection._record({"sql": sql, "many": seq_of_parameters}, before)
+        return result
+
+
+class JournaledConnection(metrics.InstrumentedConnection):
+    """Collects the write statements of a transaction and journals them once it commits."""
+    journal = None
+
+    def attach(self, journal: Journal) -> None:
+        self.journal = journal
+        self._ops = []
+
+    def cursor(self, factory=JournaledCursor):
+        return super().cursor(factory)
+
+    def _record(self, op: dict, changes_before: int) -> None:
+        if self.journal is None:
+            return
+        if self.total_changes == changes_before and _changes_rows(op["sql"]):
+            return  # an UPDATE or DELETE that matched nothing, say a job heartbeat sweep
+        if self.in_transaction:
+            self._ops.append(op)
+        else:
+            # Outside a transaction (ATTACH, DDL) the statement has already committed itself
+            self.journal.append([op], tx=False)
+
+    def commit(self):
+        if self.journal is None or not self._ops:
+            return super().commit()
+        ops, self._ops = self._ops, []
+        with self.journal.lock:
+            try:
+                super().commit()
+            except sqlite3.Error:
+                self._ops = ops + self._ops
+                raise
+            self.journal.append(ops)
+
+    def rollback(self):
+        if self.journal is not None:
+            self._ops = []
+        super().rollback()
+
+
+class MemoryDatabase:
+    """The in-memory working copy of the database file at `path`."""
+
+    def __init__(self, path: str, interval: float = SNAPSHOT_SECONDS, journal: str = None,
+                 journal_fsync: bool = False):
+        self.path = os.path.abspath(path)
+        self.uri = dbhelper.memory_uri(self.path)
+        self.interval = interval
+        self.journal = Journal(journal, fsync=journal_fsync) if journal else None
+        self._anchor = None
+        self._version = None
+        self._snapshot_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self) -> str:
+        """Copies the file into memory, replays the journal and returns the URI to use as the database path."""
+        # The in-memory database lives as long as this connection is open
+        self._anchor = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        seq = 0
+        if os.path.exists(self.path):
+            with closing(sqlite3.connect(self.path)) as source:
+                # An in-memory database cannot use WAL, and the backup copies the
+                # journal mode along with the pages; snapshots are written without it
+                source.execute("PRAGMA journal_mode=DELETE")
+                source.backup(self._anchor)
+            if self._anchor.execute("SELECT 1 FROM sqlite_master WHERE name = 'memory_snapshot'").fetchone():
+                seq = self._anchor.execute("SELECT journal_seq FROM memory_snapshot").fetchone()[0]
+                self._anchor.execute("DROP TABLE memory_snapshot")
+                self._anchor.commit()
+        if self.journal is not None:
+            self._anchor.execute("PRAGMA foreign_keys=ON")
+            replayed = self.journal.replay(self._anchor, seq)
+            if replayed:
+                log.info("replayed %d journaled transactions into %s", replayed, self.path)
+            self.journal.open()
+            dbhelper.add_pool(dbhelper.ConnectionPool(
+                self.uri, factory=JournaledConnection, setup=lambda conn: conn.attach(self.journal)))
+        return self.uri
+
+    def snapshot(self, force: bool = False) -> bool:
+        """Writes the database to its file if it changed since the last snapshot."""
+        with self._snapshot_lock:
+            version = self._anchor.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._version and not force:
+                return False
+            tmp = self.path + ".snapshot"
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            with closing(sqlite3.connect(tmp)) as target:
+                with self.journal.lock if self.journal else nullcontext():
+                    # Other connections can read but not commit while this runs
+                    version = self._anchor.execute("PRAGMA data_version").fetchone()[0]
+                    self._anchor.backup(target)
+                    seq = self.journal.seq if self.journal else 0
+                target.execute("CREATE TABLE memory_snapshot (journal_seq INTEGER NOT NULL)")
+                target.execute("INSERT INTO memory_snapshot VALUES (?)", (seq,))
+                target.commit()
+            with open(tmp, "rb") as f:
+                os.fsync(f.fileno())
+            # A WAL left beside the file would be applied on top of the new snapshot
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            os.replace(tmp, self.path)
+            self._version = version
+            if self.journal is not None:
+                self.journal.discard_through(seq)
+            return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.snapshot()
+            except (sqlite3.Error, OSError):
+                log.exception("snapshot of %s failed", self.path)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="memory-snapshot", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the snapshot thread and takes a final snapshot; later calls do nothing."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.snapshot()
+        except (sqlite3.Error, OSError):
+            log.exception("final snapshot of %s failed", self.path)
+        if self.journal is not None:
+            self.journal.close()
@@ -0,0 +1,227 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+# --- Metrics ---
+# A small in-process registry of counters and histograms, rendered in the
+# Prometheus text format by /metrics. Pooled connections are opened with
+# InstrumentedConnection, so every statement run through db.dbhelper is
+# timed under its normalized SQL (literals become "?", IN lists "(...)"),
+# along with rows returned, commit time and time spent waiting for locks.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger("db.slow_query")
+
+# Statements slower than this are logged to "db.slow_query"; None turns the log off
+slow_query_seconds = None
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 3)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1  # +Inf
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {series[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+statement_seconds = register(Histogram(
+    "sqlite_statement_duration_seconds", "Time to execute a statement, by normalized SQL.", ("sql",)))
+rows_returned = register(Counter(
+    "sqlite_rows_returned_total", "Rows fetched from statements, by normalized SQL.", ("sql",)))
+commit_seconds = register(Histogram(
+    "sqlite_commit_duration_seconds", "Time to commit a transaction (includes the WAL fsync when there is one)."))
+lock_wait_seconds = register(Histogram(
+    "sqlite_lock_wait_seconds", "Time spent in BEGIN IMMEDIATE/EXCLUSIVE waiting for the write lock."))
+busy_errors = register(Counter(
+    "sqlite_busy_errors_total", "Statements that gave up with 'database is locked' after busy_timeout.", ("sql",)))
+pool_wait_seconds = register(Histogram(
+    "sqlite_pool_wait_seconds", "Time spent waiting for a free pooled connection."))
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """Folds whitespace, literals and IN (?, ?, ...) lists so one query shape is one label."""
+    sql = _LITERALS.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACE.sub(" ", sql).strip()[:200]
+
+
+def _observe(sql: str, elapsed: float) -> str:
+    label = normalize_sql(sql)
+    statement_seconds.observe(elapsed, label)
+    if label.startswith(("BEGIN IMMEDIATE", "BEGIN EXCLUSIVE")):
+        lock_wait_seconds.observe(elapsed)
+    if slow_query_seconds is not None and elapsed >= slow_query_seconds:
+        log.warning("slow query ms=%.1f sql=%r", elapsed * 1000, label)
+    return label
+
+
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    return "locked" in str(e) or "busy" in str(e)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times execute/executemany and counts fetched rows per statement."""
+    _label = None
+    _rows = 0
+
+    def _run(self, method, sql, parameters):
+        self._flush_rows()
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if _is_busy(e):
+                busy_errors.inc(normalize_sql(sql))
+            raise
+        finally:
+            self._label = _observe(sql, time.perf_counter() - start)
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def _flush_rows(self) -> None:
+        if self._rows:
+            rows_returned.inc(self._label, amount=self._rows)
+            self._rows = 0
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._rows += len(rows)
+        self._flush_rows()
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._flush_rows()
+            raise
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._flush_rows()
+        super().close()
+
+    def __del__(self):
+        self._flush_rows()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including conn.execute's) are InstrumentedCursors."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # The C shortcuts create a plain Cursor, so route them through cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            commit_seconds.observe(time.perf_counter() - start)
@@ -0,0 +1,577 @@
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from db.dbhelper import connection, disk_uri
+
+# --- Schema migrations ---
+# Each migration brings a database from version N-1 to N; the current version
+# is kept in PRAGMA user_version. Migrations run in order inside one
+# transaction each, so a database is never left half-migrated.
+
+log = logging.getLogger(__name__)
+
+
+def _create_tables(c: sqlite3.Cursor) -> None:
+    """Baseline schema (what init_db() used to create)."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idno TEXT NOT NULL,
+            name TEXT NOT NULL,
+            course_level TEXT NOT NULL,
+            time_in TEXT NOT NULL,
+            date TEXT NOT NULL,
+            UNIQUE(idno, date)  -- Prevents duplicate entries for same student on same day
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idno TEXT UNIQUE NOT NULL,
+            lastname TEXT NOT NULL,
+            firstname TEXT NOT NULL,
+            course TEXT,
+            level TEXT,
+            avatar TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_idno_date ON attendance(idno, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_idno ON students(idno)')
+
+
+def _attendance_unique(c: sqlite3.Cursor) -> None:
+    """Enforce one attendance row per student per day so scans can UPSERT."""
+    # Keep only the latest record per student per day (what /clean_duplicates did)
+    c.execute('''
+        DELETE FROM attendance
+        WHERE id NOT IN (
+            SELECT MAX(id)
+            FROM attendance
+            GROUP BY idno, date
+        )
+    ''')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_attendance_idno_date ON attendance(idno, date)')
+    c.execute('DROP INDEX IF EXISTS idx_attendance_idno_date')
+    # Covers the /attend listing without touching the table
+    c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date_time ON attendance(date, time_in, idno, name, course_level)')
+
+
+def _students_unique(c: sqlite3.Cursor) -> None:
+    """Enforce unique student idnos where the existing data allows it."""
+    c.execute("SELECT idno FROM students GROUP BY idno HAVING COUNT(*) > 1")
+    duplicates = [row[0] for row in c.fetchall()]
+    if duplicates:
+        # Deleting students is not something a migration should decide; keep
+        # the plain index and report the idnos that need manual cleanup.
+        log.warning("duplicate student idnos, unique index skipped: %s", ', '.join(map(str, duplicates)))
+        return
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_students_idno ON students(idno)')
+    c.execute('DROP INDEX IF EXISTS idx_students_idno')
+
+
+LEGACY_TIME_FORMATS = ("%I:%M %p", "%H:%M:%S", "%H:%M")
+
+
+def legacy_epoch(date: str, time_in: str) -> int:
+    """Converts a v1 (date, time_in text) pair to epoch seconds in local time."""
+    for fmt in LEGACY_TIME_FORMATS:
+        try:
+            return int(datetime.strptime(f"{date} {time_in}", f"%Y-%m-%d {fmt}").timestamp())
+        except (TypeError, ValueError):
+            continue
+    try:
+        return int(datetime.strptime(date, "%Y-%m-%d").timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+def _copy_v1_attendance(c: sqlite3.Cursor, source: str) -> tuple:
+    """Copies idno-keyed attendance rows from source into the normalized table.
+
+    Returns (copied, skipped); skipped rows belong to idnos with no student.
+    """
+    c.execute(f'''
+        SELECT a.date, a.time_in, (SELECT MIN(s.id) FROM students s WHERE s.idno = a.idno)
+        FROM {source} a
+    ''')
+    rows = []
+    skipped = 0
+    for date, time_in, student_id in c.fetchall():
+        if student_id is None:
+            skipped += 1
+            continue
+        rows.append((student_id, date, legacy_epoch(date, time_in)))
+    c.executemany('''
+        INSERT INTO attendance (student_id, date, time_in) VALUES (?, ?, ?)
+        ON CONFLICT(student_id, date) DO UPDATE SET time_in = MAX(time_in, excluded.time_in)
+    ''', rows)
+    return len(rows), skipped
+
+
+def _attendance_by_student(c: sqlite3.Cursor) -> None:
+    """Reference students by id and store time_in as epoch seconds.
+
+    Rows for idnos that no longer have a student are kept in attendance_v1
+    so they are not lost; the rest of the old table is dropped.
+    """
+    c.execute('DROP INDEX IF EXISTS ux_attendance_idno_date')
+    c.execute('DROP INDEX IF EXISTS idx_attendance_idno_date')
+    c.execute('DROP INDEX IF EXISTS idx_attendance_date_time')
+    c.execute('ALTER TABLE attendance RENAME TO attendance_v1')
+    c.execute('''
+        CREATE TABLE attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            date TEXT NOT NULL,        -- local YYYY-MM-DD
+            time_in INTEGER NOT NULL,  -- unix epoch seconds
+            UNIQUE(student_id, date)
+        )
+    ''')
+    c.execute('CREATE INDEX idx_attendance_date_time ON attendance(date, time_in, student_id)')
+    copied, skipped = _copy_v1_attendance(c, "attendance_v1")
+    _drop_copied_v1_rows(c)
+    if skipped:
+        log.warning("%d attendance rows have no matching student; kept in attendance_v1", skipped)
+
+
+def _drop_copied_v1_rows(c: sqlite3.Cursor) -> None:
+    """Leaves only the orphan rows in attendance_v1, and drops it if there are none."""
+    c.execute("DELETE FROM attendance_v1 WHERE idno IN (SELECT idno FROM students)")
+    if not c.execute("SELECT 1 FROM attendance_v1 LIMIT 1").fetchone():
+        c.execute("DROP TABLE attendance_v1")
+
+
+REBUILD_DAILY_SQL = '''
+    INSERT INTO attendance_daily (date, course, level, present_count)
+    SELECT a.date, COALESCE(s.course, ''), COALESCE(s.level, ''), COUNT(*)
+    FROM attendance a JOIN students s ON s.id = a.student_id
+    GROUP BY 1, 2, 3
+'''
+
+
+def _attendance_daily(c: sqlite3.Cursor) -> None:
+    """Per-day present counts by course and level, kept current by triggers.
+
+    Triggers cover every writer (scan batches, imports, edits) without each
+    call site having to remember. Missing course/level are stored as ''.
+    """
+    c.execute('''
+        CREATE TABLE attendance_daily (
+            date TEXT NOT NULL,
+            course TEXT NOT NULL,
+            level TEXT NOT NULL,
+            present_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, course, level)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_attendance_daily_insert AFTER INSERT ON attendance
+        BEGIN
+            INSERT INTO attendance_daily (date, course, level, present_count)
+            SELECT NEW.date, COALESCE(s.course, ''), COALESCE(s.level, ''), 1
+            FROM students s WHERE s.id = NEW.student_id
+            ON CONFLICT(date, course, level) DO UPDATE SET present_count = present_count + 1;
+        END
+    ''')
+    # When a student is deleted the cascade runs after the student row is
+    # gone, so this finds nothing; trg_attendance_daily_student_delete has
+    # already taken those rows out of the counts.
+    c.execute('''
+        CREATE TRIGGER trg_attendance_daily_delete AFTER DELETE ON attendance
+        BEGIN
+            UPDATE attendance_daily SET present_count = present_count - 1
+            WHERE date = OLD.date
+              AND (course, level) = (SELECT COALESCE(course, ''), COALESCE(level, '') FROM students WHERE id = OLD.student_id);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_attendance_daily_move AFTER UPDATE OF student_id, date ON attendance
+        WHEN OLD.student_id IS NOT NEW.student_id OR OLD.date IS NOT NEW.date
+        BEGIN
+            UPDATE attendance_daily SET present_count = present_count - 1
+            WHERE date = OLD.date
+              AND (course, level) = (SELECT COALESCE(course, ''), COALESCE(level, '') FROM students WHERE id = OLD.student_id);
+            INSERT INTO attendance_daily (date, course, level, present_count)
+            SELECT NEW.date, COALESCE(s.course, ''), COALESCE(s.level, ''), 1
+            FROM students s WHERE s.id = NEW.student_id
+            ON CONFLICT(date, course, level) DO UPDATE SET present_count = present_count + 1;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_attendance_daily_student_edit AFTER UPDATE OF course, level ON students
+        WHEN COALESCE(OLD.course, '') IS NOT COALESCE(NEW.course, '') OR COALESCE(OLD.level, '') IS NOT COALESCE(NEW.level, '')
+        BEGIN
+            UPDATE attendance_daily SET present_count = present_count - 1
+            WHERE course = COALESCE(OLD.course, '') AND level = COALESCE(OLD.level, '')
+              AND date IN (SELECT date FROM attendance WHERE student_id = NEW.id);
+            INSERT INTO attendance_daily (date, course, level, present_count)
+            SELECT date, COALESCE(NEW.course, ''), COALESCE(NEW.level, ''), 1
+            FROM attendance WHERE student_id = NEW.id
+            ON CONFLICT(date, course, level) DO UPDATE SET present_count = present_count + 1;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_attendance_daily_student_delete BEFORE DELETE ON students
+        BEGIN
+            UPDATE attendance_daily SET present_count = present_count - 1
+            WHERE course = COALESCE(OLD.course, '') AND level = COALESCE(OLD.level, '')
+              AND date IN (SELECT date FROM attendance WHERE student_id = OLD.id);
+        END
+    ''')
+    c.execute(REBUILD_DAILY_SQL)
+
+
+def _attendance_kiosk(c: sqlite3.Cursor) -> None:
+    """Which kiosk recorded the check-in; NULL for scans made on the server's own page."""
+    c.execute("ALTER TABLE attendance ADD COLUMN kiosk_id TEXT")
+
+
+def _students_fts(c: sqlite3.Cursor) -> None:
+    """Full-text index over the roster for the student search box.
+
+    students_fts is an external-content table: it stores only the index and
+    reads the text back from students, so the triggers keep it in step with
+    every add, edit, import and delete.
+    """
+    c.execute('''
+        CREATE VIRTUAL TABLE students_fts USING fts5(
+            idno, lastname, firstname, course, level,
+            content='students', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='1 2 3'
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_students_fts_insert AFTER INSERT ON students
+        BEGIN
+            INSERT INTO students_fts (rowid, idno, lastname, firstname, course, level)
+            VALUES (NEW.id, NEW.idno, NEW.lastname, NEW.firstname, NEW.course, NEW.level);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_students_fts_delete AFTER DELETE ON students
+        BEGIN
+            INSERT INTO students_fts (students_fts, rowid, idno, lastname, firstname, course, level)
+            VALUES ('delete', OLD.id, OLD.idno, OLD.lastname, OLD.firstname, OLD.course, OLD.level);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_students_fts_update AFTER UPDATE OF idno, lastname, firstname, course, level ON students
+        BEGIN
+            INSERT INTO students_fts (students_fts, rowid, idno, lastname, firstname, course, level)
+            VALUES ('delete', OLD.id, OLD.idno, OLD.lastname, OLD.firstname, OLD.course, OLD.level);
+            INSERT INTO students_fts (rowid, idno, lastname, firstname, course, level)
+            VALUES (NEW.id, NEW.idno, NEW.lastname, NEW.firstname, NEW.course, NEW.level);
+        END
+    ''')
+    c.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+
+def _archives(c: sqlite3.Cursor) -> None:
+    """Registry of closed terms moved out to their own files by db/archive.py."""
+    c.execute('''
+        CREATE TABLE archives (
+            name TEXT PRIMARY KEY,
+            file TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            archived_at INTEGER NOT NULL
+        )
+    ''')
+    c.execute("CREATE INDEX idx_archives_dates ON archives(start_date, end_date)")
+
+
+def _data_versions(c: sqlite3.Cursor) -> None:
+    """Change counters for cached pages: one for the roster and one per attendance date.
+
+    Every write to students or attendance bumps its scope from a trigger, so
+    db/pagecache.py can tell whether a cached page is still current with one
+    small lookup, whichever process or code path made the change.
+    """
+    c.execute('''
+        CREATE TABLE data_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            changed_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    bump = '''
+        INSERT INTO data_versions (scope, version, changed_at) VALUES ({scope}, 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+    '''
+    for event, scopes in (("INSERT", ["'attendance:' || NEW.date"]),
+                          ("DELETE", ["'attendance:' || OLD.date"]),
+                          ("UPDATE", ["'attendance:' || NEW.date", "'attendance:' || OLD.date"])):
+        body = "".join(bump.format(scope=scope) for scope in scopes)
+        c.execute(f"CREATE TRIGGER trg_versions_attendance_{event.lower()} AFTER {event} ON attendance BEGIN {body} END")
+    students = bump.format(scope="'students'")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        c.execute(f"CREATE TRIGGER trg_versions_students_{event.lower()} AFTER {event} ON students BEGIN {students} END")
+
+
+def _change_log(c: sqlite3.Cursor) -> None:
+    """Change-data-capture log of attendance and roster writes, shipped to a central node by db/sync.py.
+
+    Entries are written by triggers, so they commit or roll back with the
+    write that caused them. Each one carries the natural keys (idno, and
+    date for attendance) plus the student's details, so another database
+    with different row ids can merge it. Deletes are not logged: removing
+    duplicates or archiving a term on one gate should not retract check-ins
+    elsewhere.
+    """
+    c.execute('''
+        CREATE TABLE change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            idno TEXT NOT NULL,
+            prev_idno TEXT,
+            lastname TEXT,
+            firstname TEXT,
+            course TEXT,
+            level TEXT,
+            date TEXT,
+            time_in INTEGER,
+            kiosk_id TEXT,
+            changed_at INTEGER NOT NULL
+        )
+    ''')
+    # High-water marks of the nodes merged into this database
+    c.execute('''
+        CREATE TABLE sync_sources (
+            node TEXT PRIMARY KEY,
+            high_water INTEGER NOT NULL,
+            synced_at INTEGER NOT NULL
+        )
+    ''')
+    attendance = '''
+        INSERT INTO change_log (entity, idno, lastname, firstname, course, level, date, time_in, kiosk_id, changed_at)
+        SELECT 'attendance', s.idno, s.lastname, s.firstname, s.course, s.level, NEW.date, NEW.time_in, NEW.kiosk_id,
+               CAST(strftime('%s', 'now') AS INTEGER)
+        FROM students s WHERE s.id = NEW.student_id;
+    '''
+    c.execute(f"CREATE TRIGGER trg_change_log_attendance_insert AFTER INSERT ON attendance BEGIN {attendance} END")
+    c.execute(f'''
+        CREATE TRIGGER trg_change_log_attendance_update AFTER UPDATE OF student_id, date, time_in, kiosk_id ON attendance
+        WHEN NEW.student_id IS NOT OLD.student_id OR NEW.date IS NOT OLD.date
+          OR NEW.time_in IS NOT OLD.time_in OR NEW.kiosk_id IS NOT OLD.kiosk_id
+        BEGIN {attendance} END
+    ''')
+    student = '''
+        INSERT INTO change_log (entity, idno, prev_idno, lastname, firstname, course, level, changed_at)
+        VALUES ('student', NEW.idno, {prev_idno}, NEW.lastname, NEW.firstname, NEW.course, NEW.level,
+                CAST(strftime('%s', 'now') AS INTEGER));
+    '''
+    c.execute(f"CREATE TRIGGER trg_change_log_students_insert AFTER INSERT ON students BEGIN {student.format(prev_idno='NULL')} END")
+    c.execute(f'''
+        CREATE TRIGGER trg_change_log_students_update AFTER UPDATE OF idno, lastname, firstname, course, level ON students
+        WHEN NEW.idno IS NOT OLD.idno OR NEW.lastname IS NOT OLD.lastname OR NEW.firstname IS NOT OLD.firstname
+          OR NEW.course IS NOT OLD.course OR NEW.level IS NOT OLD.level
+        BEGIN {student.format(prev_idno="CASE WHEN NEW.idno IS NOT OLD.idno THEN OLD.idno END")} END
+    ''')
+
+
+def _maintenance_runs(c: sqlite3.Cursor) -> None:
+    """Progress of the chunked maintenance tasks in db/maintenance.py, one row per task."""
+    c.execute('''
+        CREATE TABLE maintenance_runs (
+            task TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            end_position INTEGER NOT NULL,
+            processed INTEGER NOT NULL,
+            changed INTEGER NOT NULL,
+            message TEXT,
+            started_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            finished_at INTEGER
+        )
+    ''')
+
+
+def _attendance_bits(c: sqlite3.Cursor) -> None:
+    """Terms and a per-student bitmap of the days attended in each, for db/bitmaps.py.
+
+    Day n of a term (counting from its start date) is bit n % 64 of word
+    n // 64. Check-ins set their bit from a trigger. Deleting attendance
+    leaves the bit alone, since archiving a term deletes its rows from the
+    live table; bitmaps.rebuild() recomputes a term from the live and
+    archived rows.
+    """
+    c.execute('''
+        CREATE TABLE terms (
+            name TEXT PRIMARY KEY,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE attendance_bits (
+            term TEXT NOT NULL,
+            student_id INTEGER NOT NULL,
+            word INTEGER NOT NULL,
+            bits INTEGER NOT NULL,
+            PRIMARY KEY (term, student_id, word)
+        ) WITHOUT ROWID
+    ''')
+    ordinal = "CAST(julianday({row}.date) - julianday(t.start_date) AS INTEGER)"
+    set_bit = f'''
+        INSERT INTO attendance_bits (term, student_id, word, bits)
+        SELECT t.name, NEW.student_id, {ordinal.format(row="NEW")} / 64, 1 << ({ordinal.format(row="NEW")} % 64)
+        FROM terms t WHERE NEW.date BETWEEN t.start_date AND t.end_date
+        ON CONFLICT(term, student_id, word) DO UPDATE SET bits = bits | excluded.bits;
+        INSERT INTO data_versions (scope, version, changed_at)
+        SELECT 'bitmaps:' || t.name, 1, CAST(strftime('%s', 'now') AS INTEGER)
+        FROM terms t WHERE NEW.date BETWEEN t.start_date AND t.end_date
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+    '''
+    c.execute(f"CREATE TRIGGER trg_attendance_bits_insert AFTER INSERT ON attendance BEGIN {set_bit} END")
+    c.execute(f'''
+        CREATE TRIGGER trg_attendance_bits_move AFTER UPDATE OF student_id, date ON attendance
+        WHEN OLD.student_id IS NOT NEW.student_id OR OLD.date IS NOT NEW.date
+        BEGIN
+            UPDATE attendance_bits SET bits = bits & ~(1 << ((SELECT {ordinal.format(row="OLD")} FROM terms t
+                                                              WHERE OLD.date BETWEEN t.start_date AND t.end_date) % 64))
+            WHERE student_id = OLD.student_id
+              AND (term, word) = (SELECT t.name, {ordinal.format(row="OLD")} / 64 FROM terms t
+                                  WHERE OLD.date BETWEEN t.start_date AND t.end_date);
+            {set_bit}
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_attendance_bits_student_delete AFTER DELETE ON students
+        BEGIN
+            DELETE FROM attendance_bits WHERE student_id = OLD.id;
+        END
+    ''')
+
+
+def _jobs(c: sqlite3.Cursor) -> None:
+    """Queue of background jobs for db/jobs.py; payload holds uploads too big for args."""
+    c.execute('''
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            args TEXT NOT NULL,
+            payload BLOB,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            result TEXT,
+            error TEXT,
+            created_at INTEGER NOT NULL,
+            run_after INTEGER NOT NULL,
+            started_at INTEGER,
+            heartbeat_at INTEGER,
+            finished_at INTEGER
+        )
+    ''')
+    c.execute("CREATE INDEX idx_jobs_queue ON jobs(status, run_after)")
+
+
+def _attendance_v1_orphans(c: sqlite3.Cursor) -> None:
+    """Trim attendance_v1 to the rows migration 4 could not copy; drop the unused time_in index."""
+    # Every query on time_in also filters on date, which idx_attendance_date_time covers
+    c.execute("DROP INDEX IF EXISTS idx_attendance_time")
+    if c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_v1'").fetchone():
+        _drop_copied_v1_rows(c)
+
+
+def _students_name_index(c: sqlite3.Cursor) -> None:
+    """Serve the student listings, keyset-paginated on (lastname, firstname, id), from an index."""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_students_name ON students(lastname, firstname, id)")
+
+
+MIGRATIONS = [
+    (1, _create_tables),
+    (2, _attendance_unique),
+    (3, _students_unique),
+    (4, _attendance_by_student),
+    (5, _attendance_daily),
+    (6, _attendance_kiosk),
+    (7, _students_fts),
+    (8, _archives),
+    (9, _data_versions),
+    (10, _change_log),
+    (11, _maintenance_runs),
+    (12, _attendance_bits),
+    (13, _jobs),
+    (14, _attendance_v1_orphans),
+    (15, _students_name_index),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(path: str = None) -> int:
+    """Applies every pending migration to the database at path. Returns the new version."""
+    with connection(path) as conn:
+        version = schema_version(conn)
+        for target, step in MIGRATIONS:
+            if target <= version:
+                continue
+            try:
+                c = conn.cursor()
+                c.execute("BEGIN IMMEDIATE")
+                # Another process may have migrated while we waited for the lock
+                if schema_version(conn) >= target:
+                    conn.rollback()
+                    version = schema_version(conn)
+                    continue
+                step(c)
+                c.execute(f"PRAGMA user_version = {target}")
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            version = target
+        return version
+
+
+def import_legacy_attendance(path: str, legacy_path: str) -> int:
+    """Merges attendance from an old, separate database file into path, once.
+
+    Older builds wrote attendance to a second Avila.db in the working
+    directory while students lived in db/Avila.db.
+    """
+    legacy_path = os.path.abspath(legacy_path)
+    with connection(path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS legacy_imports (path TEXT PRIMARY KEY, imported_at INTEGER NOT NULL)")
+        conn.commit()
+        if conn.execute("SELECT 1 FROM legacy_imports WHERE path = ?", (legacy_path,)).fetchone():
+            return 0
+        conn.execute("ATTACH DATABASE ? AS legacy", (disk_uri(legacy_path),))
+        try:
+            c = conn.cursor()
+            columns = [row[1] for row in c.execute("PRAGMA legacy.table_info(attendance)")]
+            if "idno" in columns:
+                source = "legacy.attendance"
+            elif c.execute("SELECT 1 FROM legacy.sqlite_master WHERE name = 'attendance_v1'").fetchone():
+                source = "legacy.attendance_v1"
+            else:
+                source = None
+            copied = skipped = 0
+            if source:
+                copied, skipped = _copy_v1_attendance(c, source)
+            c.execute("INSERT INTO legacy_imports (path, imported_at) VALUES (?, strftime('%s', 'now'))", (legacy_path,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DETACH DATABASE legacy")
+        if skipped:
+            log.warning("%d attendance rows in %s have no matching student", skipped, legacy_path)
+        return copied
@@ -0,0 +1,61 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from db.dbhelper import connection
+
+# --- Page cache ---
+# Rendered pages are cached in-process under their route and parameters and
+# validated against the data_versions counters from migration 9. A page's
+# tag is derived from the versions of the scopes it was built from, so the
+# same tag doubles as its HTTP ETag: browsers revalidate and get a 304, and
+# other clients get the cached body, until a write bumps one of the scopes.
+MAX_ENTRIES = 256
+
+# Part of every tag, so a restart (and with it any template change) retires old ETags
+BOOT = format(int(time.time()), "x")
+
+
+def versions(path: str, scopes: list) -> tuple:
+    """({scope: version}, newest changed_at or None) for the given scopes."""
+    qmarks = ",".join("?" for _ in scopes)
+    with connection(path) as conn:
+        rows = conn.execute(f"SELECT scope, version, changed_at FROM data_versions WHERE scope IN ({qmarks})",
+                            scopes).fetchall()
+    found = {row["scope"]: row["version"] for row in rows}
+    changed = max((row["changed_at"] for row in rows), default=None)
+    return {scope: found.get(scope, 0) for scope in scopes}, changed
+
+
+def make_tag(key: tuple, scope_versions: dict) -> str:
+    raw = repr((BOOT, key, sorted(scope_versions.items())))
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+class PageCache:
+    """A bounded LRU of key -> (tag, body)."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, tag: str):
+        """The cached body for key if it was stored under tag, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != tag:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, tag: str, body: str) -> None:
+        with self._lock:
+            self._entries[key] = (tag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
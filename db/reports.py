@@ -0,0 +1,69 @@
+from db import archive
+from db.dbhelper import connection
+from db.migrations import REBUILD_DAILY_SQL
+
+# --- Attendance reports ---
+# Answered from attendance_daily (one row per date/course/level), which the
+# triggers from migration 5 keep in step with attendance and students.
+GROUPINGS = {
+    "date": ["date"],
+    "course": ["date", "course"],
+    "level": ["date", "course", "level"],
+}
+
+
+def rebuild_daily(path: str = None) -> int:
+    """Recomputes attendance_daily from attendance and the archived terms.
+    Returns the number of summary rows."""
+    with connection(path) as conn:
+        # Archived terms count with the course/level copied at archival. They are
+        # gathered first, one file at a time, since ATTACH cannot run inside the
+        # rebuild transaction.
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archived_daily (date TEXT, course TEXT, level TEXT, present_count INTEGER)")
+        conn.execute("DELETE FROM temp.archived_daily")
+        for term in archive.list_archives(conn):
+            with archive.spanning(conn, term["start_date"], term["end_date"]) as schemas:
+                for schema in schemas:
+                    # Rows still in the live table are counted by REBUILD_DAILY_SQL
+                    rows = archive.ARCHIVED_ROWS.format(columns="date, course, level", schema=schema)
+                    conn.execute(f'''
+                        INSERT INTO temp.archived_daily
+                        SELECT date, COALESCE(course, ''), COALESCE(level, ''), COUNT(*)
+                        FROM ({rows}) GROUP BY 1, 2, 3
+                    ''')
+                conn.commit()
+        # Ends the transaction the temp-table DELETE opened when there are no archives
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM attendance_daily")
+        conn.execute(REBUILD_DAILY_SQL)
+        conn.execute('''
+            INSERT INTO attendance_daily (date, course, level, present_count)
+            SELECT date, course, level, SUM(present_count) FROM temp.archived_daily GROUP BY 1, 2, 3
+            ON CONFLICT(date, course, level) DO UPDATE SET present_count = present_count + excluded.present_count
+        ''')
+        conn.execute("DROP TABLE temp.archived_daily")
+        count = conn.execute("SELECT COUNT(*) FROM attendance_daily").fetchone()[0]
+        conn.commit()
+    return count
+
+
+def daily_summary(path: str, start: str, end: str, course: str = None, level: str = None,
+                  group_by: str = "level") -> list:
+    """Present counts per day for start <= date <= end, grouped by date, course or level."""
+    columns = GROUPINGS[group_by]
+    sql = f'''
+        SELECT {", ".join(columns)}, SUM(present_count) AS present_count
+        FROM attendance_daily
+        WHERE date BETWEEN ? AND ? AND present_count > 0
+    '''
+    vals = [start, end]
+    if course:
+        sql += " AND course = ?"
+        vals.append(course)
+    if level:
+        sql += " AND level = ?"
+        vals.append(level)
+    sql += f" GROUP BY {', '.join(columns)} ORDER BY {', '.join(columns)}"
+    with connection(path) as conn:
+        return [dict(row) for row in conn.execute(sql, vals)]
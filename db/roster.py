@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+from db.dbhelper import getrecord, getall
+
+# --- Student roster cache ---
+# Every QR scan needs the student's display fields. The roster changes a few
+# times a day while scans arrive by the thousand, so students are kept in a
+# bounded LRU keyed by idno and the write routes invalidate their entries.
+# Every invalidation bumps a generation counter; a row read from the database
+# is only cached if no invalidation happened while it was being read, so a
+# lookup racing an update cannot put the old row back.
+MAX_ENTRIES = 50000
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_max_entries = MAX_ENTRIES
+_generation = 0
+
+
+def _make_entry(row) -> dict:
+    student = dict(row)
+    student['name'] = ' '.join(filter(None, (student['firstname'], student['lastname'])))
+    student['course_level'] = ' '.join(filter(None, (student['course'], student['level'])))
+    return student
+
+
+def _store(idno: str, entry: dict, generation: int) -> None:
+    with _lock:
+        if generation != _generation:
+            return  # invalidated while the row was read; the next lookup reloads it
+        _entries[idno] = entry
+        _entries.move_to_end(idno)
+        while len(_entries) > _max_entries:
+            _entries.popitem(last=False)
+
+
+def lookup(idno: str):
+    """Returns the cached student for idno (with name/course_level), loading it on a miss."""
+    with _lock:
+        entry = _entries.get(idno)
+        if entry is not None:
+            _entries.move_to_end(idno)
+            return entry
+        generation = _generation
+
+    student_row = getrecord("students", idno=idno)
+    if not student_row:
+        return None
+    entry = _make_entry(student_row[0])
+    _store(idno, entry, generation)
+    return entry
+
+
+def warm() -> int:
+    """Loads the whole roster (up to the size bound) in one query."""
+    with _lock:
+        generation = _generation
+    count = 0
+    for row in getall("students", order_by="id DESC"):
+        if count >= _max_entries:
+            break
+        _store(row['idno'], _make_entry(row), generation)
+        count += 1
+    return count
+
+
+def invalidate(*idnos: str) -> None:
+    global _generation
+    with _lock:
+        _generation += 1
+        for idno in idnos:
+            if idno:
+                _entries.pop(idno, None)
+
+
+def clear() -> None:
+    global _generation
+    with _lock:
+        _generation += 1
+        _entries.clear()
+
+
+def set_max_entries(size: int) -> None:
+    global _max_entries
+    with _lock:
+        _max_entries = max(1, size)
+        while len(_entries) > _max_entries:
+            _entries.popitem(last=False)
+
+
+def size() -> int:
+    return len(_entries)
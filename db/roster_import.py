@@ -0,0 +1,154 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import zipfile
+from db import avatars
+from db.dbhelper import connection
+from db.migrations import migrate
+
+# --- Bulk roster import ---
+# Loads a whole intake in one transaction: the file is parsed and validated
+# in a single pass, existing idnos are resolved with one query, and rows are
+# written with executemany. Photos come from an optional zip whose file
+# names are the students' idnos (e.g. 2024-0001.png).
+FIELDS = ["idno", "lastname", "firstname", "course", "level"]
+
+ON_CONFLICT_UPDATE = "update"
+ON_CONFLICT_SKIP = "skip"
+
+
+def parse_roster(data: bytes, fmt: str) -> list:
+    """Parses CSV (with a header row) or a JSON array of objects into dicts."""
+    text = data.decode("utf-8-sig")
+    if fmt == "json":
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError("JSON roster must be an array of objects")
+        return rows
+    if fmt == "csv":
+        return list(csv.DictReader(io.StringIO(text)))
+    raise ValueError(f"Unsupported roster format: {fmt}")
+
+
+def validate(rows: list) -> tuple:
+    """Returns (valid rows, errors). Row numbers in errors are 1-based."""
+    valid = []
+    errors = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({"row": number, "idno": None, "error": "not an object"})
+            continue
+        record = {field: str(row.get(field) or "").strip() for field in FIELDS}
+        missing = [field for field in FIELDS if not record[field]]
+        if missing:
+            errors.append({"row": number, "idno": record["idno"] or None,
+                           "error": f"missing {', '.join(missing)}"})
+            continue
+        if record["idno"] in seen:
+            errors.append({"row": number, "idno": record["idno"], "error": "duplicate idno in file"})
+            continue
+        seen.add(record["idno"])
+        record["row"] = number
+        valid.append(record)
+    return valid, errors
+
+
+def extract_photos(photos: zipfile.ZipFile, idnos: set, errors: list) -> dict:
+    """Stores zip members named after known idnos as avatars; returns {idno: avatar name}."""
+    stored = {}
+    for member in photos.infolist():
+        if member.is_dir():
+            continue
+        stem, ext = os.path.splitext(os.path.basename(member.filename))
+        ext = ext.lower()
+        if stem not in idnos or ext not in avatars.ALLOWED_EXTENSIONS:
+            continue
+        with photos.open(member) as src:
+            try:
+                stored[stem] = avatars.store(src.read(), ext)
+            except ValueError as e:
+                errors.append({"row": None, "idno": stem, "error": f"photo {member.filename}: {e}"})
+    return stored
+
+
+def import_roster(path: str, rows: list, photos: zipfile.ZipFile = None,
+                  on_conflict: str = ON_CONFLICT_UPDATE) -> dict:
+    """Validates and writes rows in one transaction. Returns a per-row report."""
+    if on_conflict not in (ON_CONFLICT_UPDATE, ON_CONFLICT_SKIP):
+        raise ValueError(f"on_conflict must be '{ON_CONFLICT_UPDATE}' or '{ON_CONFLICT_SKIP}'")
+    valid, errors = validate(rows)
+    report = {"total": len(rows), "inserted": 0, "updated": 0, "skipped": 0, "photos": 0, "errors": errors}
+    if not valid:
+        return report
+
+    photo_names = extract_photos(photos, {r["idno"] for r in valid}, errors) if photos else {}
+
+    with connection(path) as conn:
+        try:
+            existing = set()
+            idnos = [r["idno"] for r in valid]
+            # Resolve existing idnos in batches below SQLite's variable limit
+            for start in range(0, len(idnos), 500):
+                batch = idnos[start:start + 500]
+                qmarks = ",".join("?" for _ in batch)
+                existing.update(row[0] for row in conn.execute(
+                    f"SELECT idno FROM students WHERE idno IN ({qmarks})", batch))
+
+            inserts = []
+            updates = []
+            for r in valid:
+                avatar = photo_names.get(r["idno"])
+                if r["idno"] not in existing:
+                    inserts.append((r["idno"], r["lastname"], r["firstname"], r["course"], r["level"],
+                                    avatar or "default_avatar.png"))
+                elif on_conflict == ON_CONFLICT_UPDATE:
+                    updates.append((r["lastname"], r["firstname"], r["course"], r["level"], avatar, r["idno"]))
+                else:
+                    report["skipped"] += 1
+
+            conn.executemany("INSERT INTO students (idno, lastname, firstname, course, level, avatar) VALUES (?, ?, ?, ?, ?, ?)",
+                             inserts)
+            conn.executemany("UPDATE students SET lastname = ?, firstname = ?, course = ?, level = ?, avatar = COALESCE(?, avatar) WHERE idno = ?",
+                             updates)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            report["errors"].append({"row": None, "idno": None, "error": f"import rolled back: {e}"})
+            return report
+
+    report["inserted"] = len(inserts)
+    report["updated"] = len(updates)
+    report["photos"] = len(photo_names)
+    return report
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk import a student roster (CSV or JSON).")
+    parser.add_argument("roster", help="roster file (.csv or .json)")
+    parser.add_argument("--photos", help="zip of photos named <idno>.<ext>")
+    parser.add_argument("--db", default=None, help="database path (defaults to db/Avila.db)")
+    parser.add_argument("--on-conflict", choices=[ON_CONFLICT_UPDATE, ON_CONFLICT_SKIP], default=ON_CONFLICT_UPDATE)
+    args = parser.parse_args(argv)
+
+    migrate(args.db)
+    fmt = "json" if args.roster.lower().endswith(".json") else "csv"
+    with open(args.roster, "rb") as f:
+        rows = parse_roster(f.read(), fmt)
+    photos = zipfile.ZipFile(args.photos) if args.photos else None
+    try:
+        report = import_roster(args.db, rows, photos, args.on_conflict)
+    finally:
+        if photos:
+            photos.close()
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
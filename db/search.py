@@ -0,0 +1,42 @@
+import re
+from db.dbhelper import connection
+
+# --- Student search ---
+# Prefix search over students_fts (migration 7) for the typeahead box. Each
+# word typed becomes a prefix term and all of them must match, so "dela cr"
+# finds "Dela Cruz". Results are ranked with bm25, weighting idno and names
+# above course and level.
+MAX_LIMIT = 50
+# A one- or two-letter prefix can match most of the roster; every match is
+# scored, but only this many of the best are joined to students and sorted
+CANDIDATES = 500
+WEIGHTS = (10.0, 5.0, 5.0, 1.0, 1.0)  # idno, lastname, firstname, course, level
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def build_query(text: str) -> str:
+    """FTS5 MATCH expression for what the user typed; '' if there is nothing to search."""
+    # Words are quoted, so FTS5 syntax in the input (AND, NEAR, *, ^...) is just text
+    return " ".join(f'"{word}"*' for word in _WORD.findall(text or "")[:8])
+
+
+def search_students(path: str, text: str, limit: int = 10) -> list:
+    """Best matches for text as dicts (id, idno, lastname, firstname, course, level, avatar)."""
+    query = build_query(text)
+    if not query:
+        return []
+    limit = max(1, min(limit, MAX_LIMIT))
+    sql = f'''
+        SELECT s.id, s.idno, s.lastname, s.firstname, s.course, s.level, s.avatar
+        FROM (
+            SELECT rowid, bm25(students_fts, {", ".join(map(str, WEIGHTS))}) AS score
+            FROM students_fts WHERE students_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+        ) f JOIN students s ON s.id = f.rowid
+        ORDER BY f.score, s.lastname, s.firstname
+        LIMIT ?
+    '''
+    with connection(path) as conn:
+        return [dict(row) for row in conn.execute(sql, (query, CANDIDATES, limit))]
@@ -0,0 +1,266 @@
+import argparse
+import json
+import logging
+import socket
+import sqlite3
+import sys
+import time
+import urllib.parse
+import urllib.request
+from db.checkin import UPSERT_SQL
+from db.dbhelper import connection
+from db.migrations import migrate
+
+# --- Change-log replication ---
+# Every gate runs its own copy of the app. Attendance and roster writes are
+# captured in change_log by the triggers from migration 10, in the same
+# transaction as the write, and shipped to a central node from a high-water
+# mark: either pushed by the gate (POST /sync/push) or pulled by the central
+# node (GET /sync/changes). The central node keeps one high-water mark per
+# gate in sync_sources and merges on natural keys: students by idno,
+# attendance by (idno, date) keeping the later time_in, which is how
+# check-ins already merge locally. Applying a batch twice changes nothing.
+# Merged writes are logged on the central node too, so it can pass them on.
+# An entry that would give an idno to a second student (say, a gate renamed a
+# student to an idno another gate already uses) is a conflict: it is logged,
+# skipped and reported in the response, and the high-water mark moves past it
+# so the rest of the log still syncs. Conflicts are resolved by hand.
+#
+# Only changes made after migration 10 are in the log; seed the central node
+# from a full copy of each gate once, then sync incrementally.
+#
+# A push drops the entries the central node has acknowledged. A gate that is
+# only pulled from (or not synced at all) never hears what was merged, so
+# trim() also keeps the log to KEEP_DAYS and MAX_LOG_ENTRIES; a central node
+# that falls further behind than that has to be seeded again.
+BATCH_SIZE = 1000
+KEEP_DAYS = 30
+MAX_LOG_ENTRIES = 1000000
+TRIM_CHUNK = 10000
+
+log = logging.getLogger(__name__)
+
+ENTRY_COLUMNS = ("seq", "entity", "idno", "prev_idno", "lastname", "firstname", "course", "level",
+                 "date", "time_in", "kiosk_id", "changed_at")
+
+
+def node_id() -> str:
+    return socket.gethostname()
+
+
+def changes_since(path: str, after: int, limit: int = BATCH_SIZE) -> list:
+    """Log entries with seq > after, oldest first, as dicts."""
+    with connection(path) as conn:
+        rows = conn.execute(f"SELECT {', '.join(ENTRY_COLUMNS)} FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                            (after, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def high_water(path: str, node: str) -> int:
+    """The last seq from node merged into this database (0 if none)."""
+    with connection(path) as conn:
+        row = conn.execute("SELECT high_water FROM sync_sources WHERE node = ?", (node,)).fetchone()
+    return row["high_water"] if row else 0
+
+
+def prune(path: str, through: int) -> int:
+    """Drops log entries up to seq `through` once the central node has them. Returns rows deleted."""
+    deleted = 0
+    with connection(path) as conn:
+        # In bounded chunks, so a long backlog does not hold the write lock in one go
+        while True:
+            count = conn.execute("DELETE FROM change_log WHERE seq IN "
+                                 "(SELECT seq FROM change_log WHERE seq <= ? ORDER BY seq LIMIT ?)",
+                                 (through, TRIM_CHUNK)).rowcount
+            conn.commit()
+            deleted += count
+            if count < TRIM_CHUNK:
+                return deleted
+
+
+def trim(path: str, keep_days: float = KEEP_DAYS, max_entries: int = MAX_LOG_ENTRIES) -> int:
+    """Drops log entries older than keep_days or beyond the newest max_entries. Returns rows deleted."""
+    with connection(path) as conn:
+        newest = conn.execute("SELECT MAX(seq) FROM change_log").fetchone()[0]
+        if newest is None:
+            return 0
+        # seq grows with changed_at, so the first recent entry is where the old ones end
+        row = conn.execute("SELECT seq FROM change_log WHERE changed_at >= ? ORDER BY seq LIMIT 1",
+                           (int(time.time() - keep_days * 86400),)).fetchone()
+    through = max(row["seq"] - 1 if row else newest, newest - max_entries)
+    return prune(path, through)
+
+
+def _find_student(c: sqlite3.Cursor, idno: str):
+    # ORDER BY id keeps the oldest row for a duplicated idno, like checkin
+    return c.execute("SELECT id FROM students WHERE idno = ? ORDER BY id LIMIT 1", (idno,)).fetchone()
+
+
+class Conflict(Exception):
+    """An entry that cannot be merged without breaking a unique key."""
+
+
+def _merge_student(c: sqlite3.Cursor, entry: dict) -> int:
+    """Inserts or updates the student an entry describes; returns its id."""
+    details = (entry["lastname"] or "", entry["firstname"] or "", entry["course"], entry["level"])
+    student = _find_student(c, entry["idno"])
+    if entry.get("prev_idno"):
+        # The idno itself was changed on the gate
+        renamed = _find_student(c, entry["prev_idno"])
+        if student is not None and renamed is not None and renamed["id"] != student["id"]:
+            raise Conflict(f"idno {entry['idno']} belongs to student {student['id']}, "
+                           f"not to student {renamed['id']} (was {entry['prev_idno']})")
+        student = student or renamed
+    if student is None:
+        c.execute("INSERT INTO students (idno, lastname, firstname, course, level) VALUES (?, ?, ?, ?, ?)",
+                  (entry["idno"],) + details)
+        return c.lastrowid
+    c.execute("UPDATE students SET idno = ?, lastname = ?, firstname = ?, course = ?, level = ? WHERE id = ?",
+              (entry["idno"],) + details + (student["id"],))
+    return student["id"]
+
+
+def apply_changes(path: str, node: str, entries: list) -> dict:
+    """Merges a batch of entries from node. Entries at or below its high-water mark are skipped.
+
+    Returns {"applied": n, "high_water": seq, "conflicts": [...]}, one conflict
+    dict (seq, entity, idno, prev_idno, error) per entry that was skipped.
+    """
+    applied = 0
+    conflicts = []
+    with connection(path) as conn:
+        try:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            row = c.execute("SELECT high_water FROM sync_sources WHERE node = ?", (node,)).fetchone()
+            mark = row["high_water"] if row else 0
+            start = mark
+            for entry in sorted(entries, key=lambda e: e["seq"]):
+                if entry["seq"] <= mark:
+                    continue
+                try:
+                    _apply(c, entry)
+                    applied += 1
+                except (Conflict, sqlite3.IntegrityError) as e:
+                    # Only the failing statement was undone; the batch carries on without it
+                    log.warning("sync conflict node=%s seq=%s entity=%s idno=%s prev_idno=%s: %s",
+                                node, entry["seq"], entry["entity"], entry["idno"], entry.get("prev_idno"), e)
+                    conflicts.append({"seq": entry["seq"], "entity": entry["entity"], "idno": entry["idno"],
+                                      "prev_idno": entry.get("prev_idno"), "error": str(e)})
+                mark = entry["seq"]
+            if mark != start:
+                c.execute('''
+                    INSERT INTO sync_sources (node, high_water, synced_at) VALUES (?, ?, ?)
+                    ON CONFLICT(node) DO UPDATE SET high_water = excluded.high_water, synced_at = excluded.synced_at
+                ''', (node, mark, int(time.time())))
+            conn.commit()
+        except (sqlite3.Error, KeyError, TypeError, ValueError):
+            conn.rollback()
+            raise
+    return {"applied": applied, "high_water": mark, "conflicts": conflicts}
+
+
+def _apply(c: sqlite3.Cursor, entry: dict) -> None:
+    if entry["entity"] == "student":
+        _merge_student(c, entry)
+    elif entry["entity"] == "attendance":
+        student = _find_student(c, entry["idno"])
+        # An attendance entry carries the student's details in case
+        # the roster entry has not reached this node
+        student_id = student["id"] if student else _merge_student(c, entry)
+        c.execute(UPSERT_SQL, (student_id, entry["date"], entry["time_in"], entry["kiosk_id"]))
+    else:
+        raise ValueError(f"Unknown change_log entity: {entry['entity']}")
+
+
+# --- Client side of the protocol ---
+
+def _request(url: str, token: str, body: dict = None) -> dict:
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method="POST" if data else "GET")
+    req.add_header("Authorization", "Bearer " + token)
+    if data:
+        req.add_header("Content-Type", "application/json")
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        return json.load(resp)
+
+
+def push(path: str, central: str, token: str, node: str = None, batch: int = BATCH_SIZE,
+         prune_acked: bool = True) -> int:
+    """Sends this database's new log entries to the central node. Returns entries sent.
+
+    Entries the central node has merged are then dropped, unless prune_acked is False.
+    """
+    node = node or node_id()
+    central = central.rstrip("/")
+    state = _request(f"{central}/sync/state?" + urllib.parse.urlencode({"node": node}), token)
+    mark = state["high_water"]
+    sent = 0
+    while True:
+        entries = changes_since(path, mark, batch)
+        if not entries:
+            break
+        result = _request(f"{central}/sync/push", token, {"node": node, "entries": entries})
+        for conflict in result.get("conflicts", []):
+            log.warning("central node skipped a conflicting change: %s", conflict)
+        mark = result["high_water"]
+        sent += len(entries)
+    if prune_acked:
+        prune(path, mark)
+    return sent
+
+
+def pull(path: str, source: str, token: str, batch: int = BATCH_SIZE) -> int:
+    """Fetches and merges a gate's new log entries into this database. Returns entries applied."""
+    source = source.rstrip("/")
+    node = _request(f"{source}/sync/changes?limit=0", token)["node"]
+    mark = high_water(path, node)
+    applied = 0
+    while True:
+        page = _request(f"{source}/sync/changes?" + urllib.parse.urlencode({"after": mark, "limit": batch}), token)
+        if not page["entries"]:
+            break
+        result = apply_changes(path, node, page["entries"])
+        mark = result["high_water"]
+        applied += result["applied"]
+    return applied
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Ship attendance and roster changes between gates and a central node.")
+    parser.add_argument("--db", default=None, help="database path (defaults to db/Avila.db)")
+    parser.add_argument("--token", help="the nodes' SYNC_TOKEN (push and pull)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="entries per request")
+    sub = parser.add_subparsers(dest="command", required=True)
+    send = sub.add_parser("push", help="push this gate's changes to the central node")
+    send.add_argument("central", help="base URL of the central node")
+    send.add_argument("--node", default=None, help="this gate's name (defaults to the host name)")
+    send.add_argument("--keep-log", action="store_true", help="keep log entries the central node has merged")
+    fetch = sub.add_parser("pull", help="pull a gate's changes into this (central) database")
+    fetch.add_argument("source", help="base URL of the gate")
+    cut = sub.add_parser("trim", help="drop old log entries on a gate nothing pushes from")
+    cut.add_argument("--days", type=float, default=KEEP_DAYS, help="keep entries this many days old")
+    cut.add_argument("--max-entries", type=int, default=MAX_LOG_ENTRIES, help="keep at most this many entries")
+    args = parser.parse_args(argv)
+    if args.command != "trim" and not args.token:
+        parser.error("--token is required to push or pull")
+
+    migrate(args.db)
+    try:
+        if args.command == "push":
+            count = push(args.db, args.central, args.token, args.node, args.batch, not args.keep_log)
+            print(f"Pushed {count} changes to {args.central}")
+        elif args.command == "trim":
+            count = trim(args.db, args.days, args.max_entries)
+            print(f"Dropped {count} log entries")
+        else:
+            count = pull(args.db, args.source, args.token, args.batch)
+            print(f"Merged {count} changes from {args.source}")
+    except (OSError, ValueError) as e:
+        print("Error:", e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())